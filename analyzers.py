@@ -0,0 +1,57 @@
+"""
+Backends extracting the function definitions of file versions.
+
+Both engines talk to an analyzer through the interface of ctagspool.CtagsPool:
+`generate(files)` returns one list of ctags-like tag dicts per (filename, data)
+pair, `calls` counts the analysed files and `close()` releases the resources.
+
+- `ctags`: persistent universal-ctags processes (ctagspool.CtagsPool)
+- `cscan`: the in-process scanner of cscan.py, C function definitions only,
+  without any subprocess or temporary file
+"""
+import ctagspool
+import cscan
+import profiling
+import tagcache
+
+ANALYZERS = ('ctags', 'cscan')
+DEFAULT_ANALYZER = 'ctags'
+
+
+class ScanPool:
+    """
+    Analyses files in process with cscan
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, files):
+        """
+        :param files: list of (filename, data) tuples
+        :return: list of tag lists, in the order of `files`
+        """
+        self.calls += len(files)
+        return [cscan.scan(data) for _, data in files]
+
+    def close(self):
+        pass
+
+
+def create_pool(analyzer, ctags_flags, workers=None, profiler=profiling.NULL):
+    """
+    Start the given analyzer
+    :param analyzer: one of ANALYZERS
+    :param ctags_flags: flags of the ctags processes, they define which tags are generated
+    :param workers: number of ctags processes
+    :param profiler: receives the time spent decoding the output of ctags
+    :return: (pool, cache flavour) tuple, the flavour identifies the analyzer in the tag cache
+    """
+    if analyzer == 'cscan':
+        return ScanPool(), tagcache.flavour('cscan', cscan.VERSION)
+    if analyzer != 'ctags':
+        raise ValueError("Unknown analyzer '{}'".format(analyzer))
+
+    # Raises FileNotFoundError if ctags is not installed
+    pool = ctagspool.CtagsPool(ctags_flags, workers, profiler=profiler)
+    return pool, tagcache.flavour(tagcache.ctags_version(pool.ctags), *ctags_flags)
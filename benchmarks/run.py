@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of the diffanalyze engines.
+
+A synthetic repository (see synthrepo.py) is generated, or an existing local
+repository is used, and each scenario is timed in a fresh process:
+
+- `compare_patches_in_range`: diffanalyze --revision HEAD --range ROOT
+- `get_updated_fn_per_commit`: diffanalyze -s over the whole history
+- `generate_repository_changes`: diffanalyze2 over the whole history
+
+Every scenario starts with an empty tag cache in a temporary directory. The
+number of analyser calls is the number of entries in that cache after the run,
+i.e. the number of distinct file versions that were analysed. Peak RSS is
+reported for the scenario process and, separately, for its children (ctags,
+worker processes).
+
+The results are written as JSON; `--compare OLD.json` prints the relative
+change of every metric against an earlier run.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCHMARKS_DIR))
+import pygit2
+
+import analyzers
+import profiling
+import synthrepo
+import tagcache
+
+SCENARIOS = ('compare_patches_in_range', 'get_updated_fn_per_commit', 'generate_repository_changes')
+
+# Metrics compared by --compare, with True if larger is better
+METRICS = {'seconds': False, 'commits_per_second': True, 'analyser_calls': False, 'peak_rss_kb': False,
+           'children_peak_rss_kb': False}
+
+
+def count_commits(repo, hide=None):
+    walker = repo.walk(repo.head.target)
+    if hide:
+        walker.hide(hide)
+    return sum(1 for _ in walker)
+
+
+def root_commit(repo):
+    for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_REVERSE):
+        return commit.id
+
+
+def run_compare_patches_in_range(repo_path, tag_cache, analyzer, jobs):
+    import diffanalyze
+    repo = pygit2.Repository(repo_path)
+    root = root_commit(repo)
+    manager = diffanalyze.RepoManager(repo_path, 'full', False, None, None, tag_cache=tag_cache, jobs=jobs,
+                                      analyzer=analyzer)
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            manager.compare_patches_in_range('HEAD', str(root))
+    finally:
+        manager.cleanup()
+    return count_commits(repo, root)
+
+
+def run_get_updated_fn_per_commit(repo_path, tag_cache, analyzer, jobs):
+    import diffanalyze
+    manager = diffanalyze.RepoManager(repo_path, 'full', False, None, None, tag_cache=tag_cache, jobs=jobs,
+                                      analyzer=analyzer)
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            manager.get_updated_fn_per_commit()
+    finally:
+        manager.cleanup()
+    return count_commits(pygit2.Repository(repo_path))
+
+
+def run_generate_repository_changes(repo_path, tag_cache, analyzer, jobs):
+    import diffanalyze2
+    commits = 0
+    for _ in diffanalyze2.generate_repository_changes(repo_path, 'HEAD', None, tag_cache, jobs=jobs,
+                                                      keep_results=False, analyzer=analyzer):
+        commits += 1
+    return commits
+
+
+def run_scenario(scenario, repo_path, analyzer, jobs):
+    """
+    Time one scenario in the current process
+    :return: dict of metrics
+    """
+    runner = globals()['run_' + scenario]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        tag_cache = tagcache.TagCache(cache_dir)
+        start = time.perf_counter()
+        try:
+            commits = runner(os.path.abspath(repo_path), tag_cache, analyzer, jobs)
+            error = None
+        except (Exception, SystemExit) as e:
+            commits = None
+            error = '{}: {}'.format(type(e).__name__, e)
+        seconds = time.perf_counter() - start
+        calls = tag_cache.db.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+        tag_cache.close()
+
+    result = {
+        'scenario': scenario,
+        'seconds': round(seconds, 4),
+        'commits': commits,
+        'commits_per_second': round(commits / seconds, 2) if commits and seconds else None,
+        'analyser_calls': calls,
+        'peak_rss_kb': profiling.peak_rss_kb(),
+        'children_peak_rss_kb': profiling.peak_rss_kb(resource.RUSAGE_CHILDREN),
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def run_in_subprocess(scenario, repo_path, analyzer, jobs):
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', '--scenario', scenario,
+                                   '--repo', repo_path, '--analyzer', analyzer, '--jobs', str(jobs)])
+    return json.loads(out.decode('utf-8'))
+
+
+def environment(analyzer):
+    info = {
+        'python': platform.python_version(),
+        'pygit2': pygit2.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'analyzer': analyzer,
+    }
+    if analyzer == 'ctags':
+        ctags = analyzers.ctagspool.find_ctags()
+        info['ctags'] = tagcache.ctags_version(ctags) if ctags else None
+    # Version of diffanalyze being measured
+    try:
+        source = pygit2.Repository(pygit2.discover_repository(BENCHMARKS_DIR))
+        info['revision'] = str(source.head.target)
+        info['modified'] = bool(source.status(untracked_files='no'))
+    except (KeyError, pygit2.GitError, TypeError):
+        info['revision'] = None
+    return info
+
+
+def compare(old, new):
+    """
+    Print the relative change of every metric of `new` against `old`
+    """
+    old_results = {r['scenario']: r for r in old['results']}
+    for result in new['results']:
+        previous = old_results.get(result['scenario'])
+        if not previous:
+            continue
+        print(result['scenario'])
+        for metric, larger_is_better in METRICS.items():
+            before, after = previous.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if larger_is_better else change < 0
+            print('  {:22} {:>12} -> {:<12} {:+7.1f}% {}'.format(metric, before, after, change,
+                                                                 'better' if better else ''))
+
+
+def main(main_args):
+    parser = argparse.ArgumentParser(description='Benchmark diffanalyze on a synthetic or local repository')
+    parser.add_argument('--repo', help='local repository to use instead of a synthetic one')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('--analyzer', choices=analyzers.ANALYZERS, default=analyzers.DEFAULT_ANALYZER)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='worker processes of the engines')
+    parser.add_argument('-o', '--output', help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--compare', metavar='OLD', help='results of an earlier run to compare with')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    synthrepo.add_shape_arguments(parser)
+    args = parser.parse_args(main_args)
+
+    # Process started by run_in_subprocess: time a single scenario and print its metrics
+    if args.child:
+        print(json.dumps(run_scenario(args.scenario[0], args.repo, args.analyzer, args.jobs)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.repo:
+            repo_path, shape = args.repo, None
+        else:
+            repo_path, shape = os.path.join(tmp, 'repo.git'), synthrepo.shape_from_args(args)
+            start = time.perf_counter()
+            synthrepo.create_repository(repo_path, **shape)
+            sys.stderr.write('Generated repository in {:.1f}s\n'.format(time.perf_counter() - start))
+
+        results = []
+        for scenario in args.scenario or SCENARIOS:
+            result = run_in_subprocess(scenario, repo_path, args.analyzer, args.jobs)
+            if 'error' in result:
+                sys.stderr.write('{scenario}: failed after {seconds}s: {error}\n'.format(**result))
+            else:
+                sys.stderr.write('{scenario}: {seconds}s, {commits_per_second} commits/s\n'.format(**result))
+            results.append(result)
+
+    report = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': environment(args.analyzer),
+        'repository': args.repo or 'synthetic',
+        'shape': shape,
+        'jobs': args.jobs,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
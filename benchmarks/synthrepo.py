@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Generator of synthetic git repositories for the benchmarks.
+
+The repository is written directly into the object database with pygit2, so
+no git executable or network access is needed and the same parameters always
+produce the same history (commit ids included).
+
+History shape:
+- an initial commit with `files` C files of `functions` functions each,
+  every function body being `function_lines` lines long, plus a README
+- `commits` further commits, each modifying `files_per_commit` C files:
+  a few function bodies are edited, sometimes a function is added or removed,
+  sometimes the README or a build file changes as well
+- with probability `merge_density` a commit starts a side branch of
+  `branch_length` commits that is then merged back with a merge commit
+"""
+import argparse
+import json
+import random
+import sys
+
+import pygit2
+
+DEFAULTS = {
+    'commits': 200,
+    'files': 50,
+    'files_per_commit': 3,
+    'functions': 20,
+    'function_lines': 10,
+    'merge_density': 0.05,
+    'branch_length': 3,
+    'seed': 0,
+}
+
+
+class SyntheticHistory:
+    """
+    Builds the history of a synthetic repository, see the module documentation
+    """
+
+    def __init__(self, repo, commits=DEFAULTS['commits'], files=DEFAULTS['files'],
+                 files_per_commit=DEFAULTS['files_per_commit'], functions=DEFAULTS['functions'],
+                 function_lines=DEFAULTS['function_lines'], merge_density=DEFAULTS['merge_density'],
+                 branch_length=DEFAULTS['branch_length'], seed=DEFAULTS['seed']):
+        self.repo = repo
+        self.commits = commits
+        self.files = files
+        self.files_per_commit = min(files_per_commit, files)
+        self.functions = functions
+        self.function_lines = function_lines
+        self.merge_density = merge_density
+        self.branch_length = branch_length
+        self.random = random.Random(seed)
+        self.time = 1577836800  # 2020-01-01
+        self.counter = 0
+        # Content of every file: C files are lists of functions, other files lists of lines
+        self.sources = {}
+        self.other = {}
+
+    def function(self, name):
+        body = ['  int v{} = x * {};'.format(i, self.random.randrange(1000)) for i in range(self.function_lines - 3)]
+        return ['int {}(int x)'.format(name), '{'] + body + ['}']
+
+    def render(self, functions):
+        lines = []
+        for name, body in functions:
+            lines.extend(body)
+            lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+    def tree(self, sources, other):
+        index = pygit2.Index()
+        for path, functions in sources.items():
+            index.add(pygit2.IndexEntry(path, self.repo.create_blob(self.render(functions)), pygit2.GIT_FILEMODE_BLOB))
+        for path, lines in other.items():
+            index.add(pygit2.IndexEntry(path, self.repo.create_blob('\n'.join(lines).encode('utf-8')),
+                                        pygit2.GIT_FILEMODE_BLOB))
+        return index.write_tree(self.repo)
+
+    def commit(self, sources, other, parents, message):
+        self.time += 60
+        signature = pygit2.Signature('Benchmark', 'benchmark@example.com', self.time, 0)
+        return self.repo.create_commit(None, signature, signature, message, self.tree(sources, other), parents)
+
+    def new_name(self):
+        self.counter += 1
+        return 'fn_{}'.format(self.counter)
+
+    def modify(self, sources, other, paths):
+        """
+        Edit the given C files in place, sometimes touching the other files too
+        """
+        for path in paths:
+            functions = sources[path]
+            for _ in range(self.random.randint(1, 3)):
+                position = self.random.randrange(len(functions))
+                name, body = functions[position]
+                body = list(body)
+                line = self.random.randrange(2, len(body) - 1)
+                body[line] = '  x += {};'.format(self.random.randrange(1000))
+                functions[position] = (name, body)
+            choice = self.random.random()
+            if choice < 0.1:
+                name = self.new_name()
+                functions.insert(self.random.randrange(len(functions) + 1), (name, self.function(name)))
+            elif choice < 0.15 and len(functions) > 1:
+                del functions[self.random.randrange(len(functions))]
+
+        if other and self.random.random() < 0.2:
+            path = self.random.choice(sorted(other))
+            other[path] = other[path] + ['change {}'.format(self.random.randrange(1000))]
+
+    def pick(self, excluded=()):
+        candidates = [path for path in sorted(self.sources) if path not in excluded]
+        return self.random.sample(candidates, min(self.files_per_commit, len(candidates)))
+
+    @staticmethod
+    def copy(sources):
+        return {path: list(functions) for path, functions in sources.items()}
+
+    def generate(self, branch='master'):
+        """
+        Write the history and point `branch` (and HEAD) at its last commit
+        :return: id of the last commit
+        """
+        for i in range(self.files):
+            names = [self.new_name() for _ in range(self.functions)]
+            self.sources['src/file_{}.c'.format(i)] = [(name, self.function(name)) for name in names]
+        self.other = {'README': ['Synthetic repository'], 'Makefile': ['all:']}
+        head = self.commit(self.sources, self.other, [], 'Initial commit')
+
+        done = 1
+        while done < self.commits:
+            if self.merge_density and self.random.random() < self.merge_density and \
+                    done + self.branch_length + 2 <= self.commits:
+                head = self.merge_branch(head)
+                done += self.branch_length + 2
+                continue
+            self.modify(self.sources, self.other, self.pick())
+            head = self.commit(self.sources, self.other, [head], 'Commit {}'.format(done))
+            done += 1
+
+        self.repo.references.create('refs/heads/' + branch, head, force=True)
+        self.repo.set_head('refs/heads/' + branch)
+        return head
+
+    def merge_branch(self, base):
+        # The side branch and the mainline touch distinct C files, so the merge has no conflicts
+        side_sources, side_other = SyntheticHistory.copy(self.sources), dict(self.other)
+        side_paths = set()
+        side = base
+        for i in range(self.branch_length):
+            paths = self.pick()
+            side_paths.update(paths)
+            self.modify(side_sources, {}, paths)
+            side = self.commit(side_sources, side_other, [side], 'Branch commit {}'.format(i))
+
+        self.modify(self.sources, self.other, self.pick(side_paths))
+        main = self.commit(self.sources, self.other, [base], 'Mainline commit')
+
+        for path in side_paths:
+            self.sources[path] = side_sources[path]
+        return self.commit(self.sources, self.other, [main, side], 'Merge branch')
+
+
+def create_repository(path, **shape):
+    """
+    Create a bare synthetic repository
+    :param path: directory of the new repository, must not exist yet
+    :param shape: parameters of SyntheticHistory, see DEFAULTS
+    :return: pygit2.Repository
+    """
+    repo = pygit2.init_repository(path, bare=True)
+    SyntheticHistory(repo, **shape).generate()
+    return repo
+
+
+def add_shape_arguments(parser):
+    parser.add_argument('--commits', type=int, default=DEFAULTS['commits'], help='number of commits')
+    parser.add_argument('--files', type=int, default=DEFAULTS['files'], help='number of C files')
+    parser.add_argument('--files-per-commit', type=int, default=DEFAULTS['files_per_commit'],
+                        help='C files modified by each commit')
+    parser.add_argument('--functions', type=int, default=DEFAULTS['functions'],
+                        help='functions per file in the initial commit')
+    parser.add_argument('--function-lines', type=int, default=DEFAULTS['function_lines'],
+                        help='lines per function, controls the file sizes')
+    parser.add_argument('--merge-density', type=float, default=DEFAULTS['merge_density'],
+                        help='probability of a commit starting a merged side branch')
+    parser.add_argument('--branch-length', type=int, default=DEFAULTS['branch_length'],
+                        help='commits per side branch')
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'], help='seed of the random generator')
+
+
+def shape_from_args(args):
+    return {key: getattr(args, key) for key in DEFAULTS}
+
+
+def main(main_args):
+    parser = argparse.ArgumentParser(description='Create a synthetic git repository for benchmarks')
+    parser.add_argument('path', help='directory of the new (bare) repository')
+    add_shape_arguments(parser)
+    args = parser.parse_args(main_args)
+
+    shape = shape_from_args(args)
+    repo = create_repository(args.path, **shape)
+    print(json.dumps({'path': repo.path, 'head': str(repo.head.target), 'shape': shape}))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Persistent index of function changes (`diffanalyze.py --index DB`).
+
+Building the index records, for every analysed commit, one row per changed
+function with the number of added and removed lines, in a SQLite database:
+
+- `commits`: every indexed commit, with or without function changes, and its
+  commit time
+- `changes`: (commit, file, function, added, removed), indexed by function,
+  by file and by commit
+
+Indexing again only analyses the commits that are not in the database yet,
+so the index of a branch is kept up to date by re-running the same command.
+This script queries the index without opening the repository:
+
+    ./changeindex.py DB --function NAME [--file PATH]   commits that changed a function
+    ./changeindex.py DB --file PATH                     changes of the functions of a file
+    ./changeindex.py DB --commit HASH                   functions changed by a commit
+    ./changeindex.py DB --hotspots [N] [--file PATH]    the N most often changed functions
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+
+VERSION = 1
+
+# Rows written per transaction: an interrupted run keeps the commits indexed so far
+BATCH_SIZE = 500
+
+DEFAULT_HOTSPOTS = 20
+
+CHANGE_FIELDS = ('commit', 'time', 'file', 'function', 'added', 'removed')
+HOTSPOT_FIELDS = ('file', 'function', 'commits', 'added', 'removed')
+
+
+class ChangeIndexError(Exception):
+    pass
+
+
+class ChangeIndex:
+    """
+    SQLite database of the functions changed by every indexed commit
+    """
+
+    def __init__(self, path, settings=None):
+        """
+        :param path: path of the database, created if it does not exist
+        :param settings: dict of the options the index is built with (e.g. the path filter). They are stored
+                         by the first run and must be the same for the following ones; None when only querying
+        """
+        self.path = path
+        self.pending = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS commits ('
+                        'id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL, time INTEGER NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS changes ('
+                        'commit_id INTEGER NOT NULL, file TEXT NOT NULL, function TEXT NOT NULL, '
+                        'added INTEGER NOT NULL, removed INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS changes_function ON changes (function, file)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS changes_file ON changes (file)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS changes_commit ON changes (commit_id)')
+        self.check_meta(dict(settings or {}, version=VERSION), settings is not None)
+
+    def check_meta(self, settings, store):
+        stored = dict(self.db.execute('SELECT key, value FROM meta'))
+        if stored.get('version', str(VERSION)) != str(VERSION):
+            raise ChangeIndexError("'{}' has version {}, expected {}".format(self.path, stored['version'], VERSION))
+        if not store:
+            return
+        for key, value in settings.items():
+            value = '' if value is None else str(value)
+            if key in stored and stored[key] != value:
+                raise ChangeIndexError("'{}' was built with {} '{}', not '{}'".format(self.path, key, stored[key],
+                                                                                    value))
+        self.db.executemany('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                            [(key, '' if value is None else str(value)) for key, value in settings.items()])
+
+    def indexed_commits(self):
+        """
+        :return: set of the hashes of the indexed commits
+        """
+        return {row[0] for row in self.db.execute('SELECT hash FROM commits')}
+
+    def add(self, commit, commit_time, diff_summary):
+        """
+        Record the functions changed by a commit, see flush
+        :param commit: hash of the commit
+        :param commit_time: seconds since the epoch
+        :param diff_summary: diffanalyze.DiffSummary of the commit
+        """
+        if not self.pending:
+            self.db.execute('BEGIN')
+        cursor = self.db.execute('INSERT OR IGNORE INTO commits (hash, time) VALUES (?, ?)', (commit, commit_time))
+        if cursor.rowcount:
+            self.db.executemany(
+                'INSERT INTO changes (commit_id, file, function, added, removed) VALUES (?, ?, ?, ?, ?)',
+                [(cursor.lastrowid, file_diff.filename, fn_name, len(lines.added_lines), len(lines.removed_lines))
+                 for file_diff in diff_summary.file_diffs
+                 for fn_name, lines in file_diff.fn_to_changed_lines.items()])
+        self.pending += 1
+        if self.pending >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # Commits the rows added since the last call
+        if self.pending:
+            self.db.execute('COMMIT')
+            self.pending = 0
+
+    def query(self, where, params):
+        return self.db.execute(
+            'SELECT commits.hash, commits.time, file, function, added, removed FROM changes '
+            'JOIN commits ON commits.id = changes.commit_id WHERE {} '
+            'ORDER BY commits.time, commits.id, file, function'.format(where), params).fetchall()
+
+    def function_history(self, function, filename=None):
+        """
+        :return: list of (commit, time, file, function, added, removed) tuples of the commits that changed the
+                 function, the oldest first
+        """
+        if filename is None:
+            return self.query('function = ?', (function,))
+        return self.query('function = ? AND file = ?', (function, filename))
+
+    def file_changes(self, filename):
+        """
+        :return: list of (commit, time, file, function, added, removed) tuples of the functions of a file
+        """
+        return self.query('file = ?', (filename,))
+
+    def commit_changes(self, commit):
+        """
+        :param commit: hash or prefix of a hash
+        :return: list of (commit, time, file, function, added, removed) tuples of the functions changed by the commit
+        """
+        commit = commit.lower()
+        # Hashes are hex: every hash starting with the prefix sorts before prefix + 'g'
+        commit_ids = self.db.execute('SELECT id FROM commits WHERE hash >= ? AND hash < ? LIMIT 2',
+                                     (commit, commit + 'g')).fetchall()
+        if len(commit_ids) > 1:
+            raise ChangeIndexError("Commit prefix '{}' is ambiguous".format(commit))
+        if not commit_ids:
+            return []
+        return self.query('commit_id = ?', commit_ids[0])
+
+    def hotspots(self, limit=DEFAULT_HOTSPOTS, filename=None):
+        """
+        :return: list of (file, function, commits, added, removed) tuples of the functions changed by the most
+                 commits, most changed first
+        """
+        where, params = ('WHERE file = ?', (filename,)) if filename is not None else ('', ())
+        return self.db.execute(
+            'SELECT file, function, COUNT(*) AS commits, SUM(added), SUM(removed) FROM changes {} '
+            'GROUP BY file, function ORDER BY commits DESC, file, function LIMIT ?'.format(where),
+            params + (limit,)).fetchall()
+
+    def stats(self):
+        commits, = self.db.execute('SELECT COUNT(*) FROM commits').fetchone()
+        changes, = self.db.execute('SELECT COUNT(*) FROM changes').fetchone()
+        return {'commits': commits, 'changes': changes}
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def main(main_args):
+    parser = argparse.ArgumentParser(description='Queries an index built by diffanalyze.py --index.')
+    parser.add_argument('index', help='index database')
+    parser.add_argument('--function', help='commits that changed this function')
+    parser.add_argument('--file', help='changes of the functions of this file, or restrict --function and --hotspots')
+    parser.add_argument('--commit', help='functions changed by this commit (hash or prefix)')
+    parser.add_argument('--hotspots', nargs='?', type=int, const=DEFAULT_HOTSPOTS, metavar='N',
+                        help='the N functions changed by the most commits')
+    args = vars(parser.parse_args(main_args))
+
+    if sum(bool(args[key]) for key in ('function', 'commit', 'hotspots')) > 1:
+        parser.error('--function, --commit and --hotspots cannot be combined')
+    if not os.path.exists(args['index']):
+        parser.error("'{}' does not exist".format(args['index']))
+
+    index = ChangeIndex(args['index'])
+    try:
+        if args['hotspots']:
+            header, rows = HOTSPOT_FIELDS, index.hotspots(args['hotspots'], args['file'])
+        elif args['function']:
+            header, rows = CHANGE_FIELDS, index.function_history(args['function'], args['file'])
+        elif args['commit']:
+            header, rows = CHANGE_FIELDS, index.commit_changes(args['commit'])
+        elif args['file']:
+            header, rows = CHANGE_FIELDS, index.file_changes(args['file'])
+        else:
+            print('{commits} commits, {changes} function changes'.format(**index.stats()))
+            return 0
+    except ChangeIndexError as e:
+        parser.error(str(e))
+    finally:
+        index.close()
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+"""
+Checkpoints for long history scans.
+
+A checkpoint records the commit the scan started from, the last commit that
+was fully processed and the aggregates accumulated so far. It is rewritten
+atomically (write to a temporary file, then rename) so an interrupted run
+always leaves a consistent checkpoint behind, from which `--resume` continues.
+Results that must be emitted again when resuming are appended to a separate
+file (`FILE.results`) rather than rewritten with every checkpoint.
+"""
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_INTERVAL = 30
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class Checkpoint:
+    """
+    A JSON checkpoint file.
+
+    `run` identifies the scan (repository, revisions, options); a checkpoint
+    written by a different scan is never resumed.
+    """
+
+    def __init__(self, path, run, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.run = run
+        self.interval = interval
+        self.last_save = time.monotonic()
+        self.results_path = path + '.results'
+
+    def load(self):
+        """
+        Return the saved state or None if there is no checkpoint yet
+        :return: dict with `start`, `last_commit`, `done` and `data`
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('run') != self.run:
+            raise CheckpointError("Checkpoint '{}' belongs to a different scan: {}".format(self.path, state.get('run')))
+        return state
+
+    def due(self):
+        return time.monotonic() - self.last_save >= self.interval
+
+    def save(self, start, last_commit, done, data):
+        """
+        Atomically replace the checkpoint
+        :param start: id of the commit the scan started from
+        :param last_commit: id of the last commit fully processed
+        :param done: number of commits processed
+        :param data: JSON serializable aggregates
+        """
+        state = {'run': self.run, 'start': start, 'last_commit': last_commit, 'done': done, 'data': data}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.last_save = time.monotonic()
+
+    def append_results(self, records):
+        """
+        Append records to the results file, before the save that counts them
+        :param records: list of JSON serializable records
+        """
+        with open(self.results_path, 'a') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load_results(self, count):
+        """
+        Return the first records of the results file. The ones appended after the last save are dropped
+        :param count: number of records counted by the last save, 0 to start a new scan
+        :return: list of records
+        """
+        if not count:
+            if os.path.isfile(self.results_path):
+                os.unlink(self.results_path)
+            return []
+        records = []
+        try:
+            with open(self.results_path, 'rb+') as f:
+                for _ in range(count):
+                    records.append(json.loads(f.readline()))
+                f.truncate(f.tell())
+        except (OSError, ValueError) as e:
+            raise CheckpointError("Results of checkpoint '{}' are missing or damaged: {}".format(self.path, e))
+        return records
+
+    def remove(self):
+        for path in (self.path, self.results_path):
+            if os.path.isfile(path):
+                os.unlink(path)
+
+
+def skip_processed(commits, last_commit):
+    """
+    Skip the commits up to and including `last_commit`
+    :param commits: iterable of pygit2.Commit, in the order of the original scan
+    :param last_commit: id of the last commit processed, None to skip nothing
+    :return: generator of the remaining commits
+    """
+    if last_commit is None:
+        yield from commits
+        return
+
+    seen = False
+    for commit in commits:
+        if seen:
+            yield commit
+        elif str(commit.id) == last_commit:
+            seen = True
+    if not seen:
+        raise CheckpointError('Commit {} of the checkpoint is not part of the scan'.format(last_commit))
@@ -0,0 +1,318 @@
+"""
+Staged commit pipeline of diffanalyze (`--pipeline`).
+
+Without it, diffanalyze handles one commit after the other: walk, diff, read
+the blobs, analyse both sides, match, print; the analyzer idles while git
+diffs and the other way round. The pipeline overlaps these steps for
+consecutive commits. Its stages are connected by bounded asyncio queues; a
+full queue stops the stage feeding it, so at most `depth` commits wait
+between two stages:
+
+- producer: walks the commits
+- git: diffs every commit and reads the changed blobs and hunks
+- analyse: looks up the tags of both sides of all the files of a commit in the
+  tag cache and analyses the missing ones concurrently, with ctags processes
+  started by asyncio.create_subprocess_exec. A blob already being analysed for
+  another commit in flight (the new side of a file is the old side of the same
+  file in the next commit) is awaited rather than analysed again
+- emitter: matches the changed lines to functions and writes the results, in
+  the order of the walk
+
+All repository access happens in a single thread, one step at a time; the
+event loop keeps the ctags processes busy while that thread diffs the next
+commits. The emitter runs in a thread of its own as well, so writing the
+output overlaps the analysis of the following commits. The in-process cscan
+analyzer, and ctags without interactive mode, run in a third thread.
+"""
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ctagspool
+import profiling
+
+# Commits held between two stages
+DEFAULT_DEPTH = 8
+
+# Bytes of the output of ctags read at once
+READ_SIZE = 64 * 1024
+
+
+class AsyncCtagsWorker:
+    """
+    A ctags process in interactive mode driven by the event loop, see ctagspool.CtagsWorker
+    """
+
+    def __init__(self, ctags, flags, profiler=profiling.NULL):
+        self.ctags = ctags
+        self.flags = flags
+        self.profiler = profiler
+        self.proc = None
+        # Output read but not decoded yet: whole chunks are read, not single lines
+        self.buffer = bytearray()
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            self.ctags, '--_interactive', *self.flags, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        if not ctagspool.is_banner(await self.proc.stdout.readline()):
+            await self.close()
+            raise ctagspool.CtagsError('{} does not support the interactive mode'.format(self.ctags))
+
+    async def generate(self, filename, data):
+        try:
+            self.proc.stdin.write(ctagspool.tags_request(filename, data))
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            raise ctagspool.CtagsError('ctags worker exited unexpectedly')
+
+        answer = ctagspool.Answer(filename, self.profiler)
+        while True:
+            end = self.buffer.find(b'\n')
+            if end < 0:
+                chunk = await self.proc.stdout.read(READ_SIZE)
+                if chunk:
+                    self.buffer += chunk
+                    continue
+                answer.feed(b'')
+            line = bytes(self.buffer[:end + 1])
+            del self.buffer[:end + 1]
+            if answer.feed(line):
+                return answer.tags
+
+    async def close(self, kill=False):
+        if self.proc:
+            if kill:
+                self.proc.kill()
+            self.proc.stdin.close()
+            await self.proc.wait()
+            self.proc = None
+
+
+class AsyncAnalyzer:
+    """
+    Analyses files for the pipeline with the interface of ctagspool.CtagsPool, as coroutines
+    """
+
+    def __init__(self, pool, profiler=profiling.NULL):
+        """
+        :param pool: analyzer of analyzers.create_pool. An interactive CtagsPool only provides the
+                     ctags executable, the flags and the number of processes; the others run in a thread
+        """
+        self.pool = pool
+        self.profiler = profiler
+        # Until the first process shows otherwise, see probe
+        self.interactive = isinstance(pool, ctagspool.CtagsPool) and pool.interactive is not False
+        self.executor = None
+        # One slot per process: either a running AsyncCtagsWorker or None if not started yet
+        self.slots = None
+        self.workers = []
+        self.probing = None
+
+    async def generate(self, files):
+        """
+        :param files: list of (filename, data) tuples
+        :return: list of tag lists, in the order of `files`; None for files the analyzer failed on
+        """
+        if not files:
+            return []
+        if self.interactive and self.slots is None:
+            # Concurrent calls wait for the same first process
+            if self.probing is None:
+                self.probing = asyncio.ensure_future(self.probe())
+            await self.probing
+        if not self.interactive:
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analyse')
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.pool.generate, files)
+
+        self.pool.calls += len(files)
+        return await asyncio.gather(*(self.generate_one(filename, data) for filename, data in files))
+
+    async def probe(self):
+        # Starts the first process, falling back to the pool in a thread if ctags has no interactive mode
+        worker = AsyncCtagsWorker(self.pool.ctags, self.pool.flags, self.profiler)
+        try:
+            await worker.start()
+        except ctagspool.CtagsError:
+            self.interactive = False
+            return
+        self.workers.append(worker)
+        slots = asyncio.Queue()
+        slots.put_nowait(worker)
+        for _ in range(self.pool.size - 1):
+            slots.put_nowait(None)
+        self.slots = slots
+
+    async def generate_one(self, filename, data):
+        worker = await self.slots.get()
+        try:
+            if worker is None:
+                worker = AsyncCtagsWorker(self.pool.ctags, self.pool.flags, self.profiler)
+                await worker.start()
+                self.workers.append(worker)
+            return await worker.generate(filename, data)
+        except ctagspool.CtagsError as e:
+            sys.stderr.write('{}\n'.format(e))
+            # The worker is in an unknown state, drop it and free its slot
+            if worker in self.workers:
+                self.workers.remove(worker)
+                await worker.close(kill=True)
+            worker = None
+            return None
+        finally:
+            self.slots.put_nowait(worker)
+
+    async def close(self):
+        if self.probing:
+            await asyncio.gather(self.probing, return_exceptions=True)
+            self.probing = None
+        workers, self.workers = self.workers, []
+        for worker in workers:
+            await worker.close()
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class _End:
+    """
+    Passed down the stages after the last commit, or when a stage failed
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+async def _stages(commits, prepare, entries, finish, emit, tagger, depth, profiler):
+    loop = asyncio.get_running_loop()
+    git = ThreadPoolExecutor(max_workers=1, thread_name_prefix='git')
+    output = ThreadPoolExecutor(max_workers=1, thread_name_prefix='emit')
+    analyzer = AsyncAnalyzer(tagger.pool, profiler)
+    walked = asyncio.Queue(depth)
+    prepared = asyncio.Queue(depth)
+    analysed = asyncio.Queue(depth)
+
+    async def produce():
+        iterator = iter(commits)
+        try:
+            while True:
+                commit = await loop.run_in_executor(git, next, iterator, _End)
+                if commit is _End:
+                    break
+                await walked.put(commit)
+        except Exception as e:
+            await walked.put(_End(e))
+        else:
+            await walked.put(_End())
+
+    async def diff():
+        while True:
+            commit = await walked.get()
+            if isinstance(commit, _End):
+                await prepared.put(commit)
+                return
+            try:
+                job = await loop.run_in_executor(git, prepare, commit)
+            except Exception as e:
+                await prepared.put(_End(e))
+                return
+            await prepared.put(job)
+
+    # Futures of the tags of the blobs analysed by the jobs not emitted yet, by blob id
+    in_flight = {}
+
+    async def analyse(job):
+        job_tagger = ctagspool.BlobTagger(None, tagger.tag_cache, tagger.cache_flavour, profiler)
+        missing, _ = job_tagger.collect(entries(job))
+        owned = [entry for entry in missing if entry[0] not in in_flight]
+        awaited = [(oid, in_flight[oid]) for oid, _, _ in missing if oid in in_flight]
+        for oid, _, _ in owned:
+            in_flight[oid] = loop.create_future()
+        try:
+            start = time.perf_counter()
+            results = await analyzer.generate([(filename, data) for _, filename, data in owned])
+            if owned:
+                profiler.add('analyse', time.perf_counter() - start, 1, sum(len(data) for _, _, data in owned))
+        except BaseException:
+            for oid, _, _ in owned:
+                in_flight[oid].cancel()
+            raise
+        job_tagger.store(owned, results)
+        for (oid, _, _), tags in zip(owned, results):
+            in_flight[oid].set_result(tags)
+        for oid, future in awaited:
+            job_tagger.known[oid] = await future
+        return job, job_tagger, [oid for oid, _, _ in owned]
+
+    def finish_and_emit(job, job_tagger):
+        result = finish(job, job_tagger)
+        if emit:
+            emit(result)
+        return result
+
+    analyses = set()
+
+    async def dispatch():
+        # Starts the analysis of every commit as soon as it is prepared; the emitter awaits them in order
+        while True:
+            job = await prepared.get()
+            if isinstance(job, _End):
+                await analysed.put(job)
+                return
+            task = asyncio.ensure_future(analyse(job))
+            analyses.add(task)
+            task.add_done_callback(analyses.discard)
+            await analysed.put(task)
+
+    tasks = [asyncio.ensure_future(stage()) for stage in (produce, diff, dispatch)]
+    try:
+        while True:
+            item = await analysed.get()
+            if isinstance(item, _End):
+                if item.error:
+                    raise item.error
+                return
+            job, job_tagger, owned = await item
+            result = await loop.run_in_executor(output, finish_and_emit, job, job_tagger)
+            for oid in owned:
+                del in_flight[oid]
+            yield result
+    finally:
+        tasks.extend(analyses)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await analyzer.close()
+        git.shutdown()
+        output.shutdown()
+
+
+def run(commits, prepare, entries, finish, tagger, depth=DEFAULT_DEPTH, profiler=profiling.NULL, emit=None):
+    """
+    Process commits through the pipeline
+    :param commits: iterable of commits, iterated in the git thread
+    :param prepare: function(commit) -> job, reads everything needed from the repository, run in the git thread
+    :param entries: function(job) -> list of (filename, blob) tuples to tag
+    :param finish: function(job, tagger) -> result, the tagger knowing the tags of all the entries of the job
+    :param tagger: ctagspool.BlobTagger providing the analyzer, the tag cache and its flavour
+    :param depth: bound of the queues between the stages
+    :param profiler: receives the time spent analysing
+    :param emit: function(result) writing a result, called in the order of `commits` while the following
+                 commits are analysed; finish and emit run in the same thread
+    :return: generator of the results, in the order of `commits`, each once emitted. The pipeline only runs
+             while the generator waits for the next result
+    """
+    loop = asyncio.new_event_loop()
+    results = _stages(commits, prepare, entries, finish, emit, tagger, max(1, depth), profiler)
+    try:
+        while True:
+            try:
+                result = loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                return
+            yield result
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
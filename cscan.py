@@ -0,0 +1,273 @@
+"""
+In-process scanner for C function definitions.
+
+Produces the same records as ``ctags --output-format=json --fields=+ne`` for
+function definitions (name, kind, line, end, pattern) without spawning any
+process or touching the filesystem. It understands enough of C to find the
+top level function bodies: comments, strings, preprocessor directives,
+attributes and `extern "C"`/namespace blocks. Like ctags, it only reads the
+first branch of every `#if`/`#elif`/`#else` group (the first one whose
+condition is not literally 0), so that conditional code opening the same brace
+in several branches keeps the braces balanced.
+"""
+import re
+
+# Part of the tag cache key, bump when the scanner output changes
+VERSION = '2'
+
+_TOKEN_RE = re.compile(rb'''
+      (?P<nl>\n)
+    | (?P<ws>[ \t\r\f\v]+)
+    | (?P<lcomment>//[^\n]*)
+    | (?P<bcomment>/\*.*?(?:\*/|\Z))
+    | (?P<string>"(?:\\.|\\\n|[^"\\\n])*"?)
+    | (?P<char>'(?:\\.|[^'\\\n])*'?)
+    | (?P<ident>[A-Za-z_$][A-Za-z0-9_$]*)
+    | (?P<scope>::)
+    | (?P<punct>.)
+''', re.VERBOSE | re.DOTALL)
+
+_DIRECTIVE_RE = re.compile(rb'[ \t]*#[ \t]*([A-Za-z]*)')
+
+_FALSE_CONDITIONS = frozenset([b'0', b'(0)'])
+
+_KEYWORDS = frozenset([
+    b'if', b'else', b'while', b'for', b'do', b'switch', b'case', b'return', b'sizeof',
+    b'typedef', b'struct', b'union', b'enum', b'class', b'goto', b'break', b'continue',
+    b'_Alignof', b'alignof', b'_Static_assert', b'static_assert', b'__typeof__', b'typeof',
+    b'void', b'char', b'short', b'int', b'long', b'float', b'double', b'signed', b'unsigned',
+    b'const', b'volatile', b'static', b'inline', b'extern', b'register',
+])
+
+# Identifiers introducing parenthesised groups that are not parameter lists
+_ATTRIBUTES = frozenset([b'__attribute__', b'__attribute', b'__declspec', b'__asm__', b'__asm', b'asm',
+                         b'__THROW', b'__nonnull', b'_Noreturn'])
+
+# Blocks whose content is scanned as top level code
+_TRANSPARENT = frozenset([b'namespace', b'extern'])
+
+
+def _split_lines(data):
+    return data.split(b'\n')
+
+
+def _strip_preprocessor(data):
+    """
+    Blank out preprocessor directives and every branch of a conditional but the first one that is not `#if 0`,
+    keeping line numbers intact.
+    """
+    lines = _split_lines(data)
+    out = []
+    # One (enclosing code is read, a branch was read) pair per open conditional
+    groups = []
+    active = True
+    continued = False
+    for line in lines:
+        if continued:
+            continued = line.endswith(b'\\')
+            out.append(b'')
+            continue
+        m = _DIRECTIVE_RE.match(line)
+        if m:
+            continued = line.endswith(b'\\')
+            directive = m.group(1)
+            condition = line[m.end():].strip()
+            if directive in (b'if', b'ifdef', b'ifndef'):
+                enclosing = active
+                active = enclosing and not (directive == b'if' and condition in _FALSE_CONDITIONS)
+                groups.append((enclosing, active))
+            elif groups and directive in (b'elif', b'else'):
+                enclosing, taken = groups[-1]
+                active = enclosing and not taken and not (directive == b'elif' and condition in _FALSE_CONDITIONS)
+                groups[-1] = (enclosing, taken or active)
+            elif groups and directive == b'endif':
+                active = groups.pop()[0]
+            out.append(b'')
+            continue
+        out.append(line if active else b'')
+    return b'\n'.join(out), lines
+
+
+def _tokens(data):
+    """
+    Yield (kind, value, line) for every significant token of the source.
+    """
+    line = 1
+    for m in _TOKEN_RE.finditer(data):
+        kind = m.lastgroup
+        value = m.group()
+        if kind == 'nl':
+            line += 1
+            continue
+        if kind == 'ws' or kind == 'lcomment':
+            continue
+        if kind == 'bcomment':
+            line += value.count(b'\n')
+            continue
+        yield kind, value, line
+        if kind == 'string':
+            line += value.count(b'\n')
+
+
+def _function_name(decl):
+    """
+    Return the (name, line) of the function declared by the tokens preceding a
+    top level `{`, or None if the tokens do not form a function definition.
+    """
+    if not decl:
+        return None
+
+    depth = 0
+    candidate = None
+    i = 0
+    n = len(decl)
+    while i < n:
+        kind, value, _ = decl[i]
+        if value == b'=' and depth == 0:
+            return None
+        if value == b'(':
+            if depth == 0 and candidate is None and i > 0:
+                prev_kind, prev_value, prev_line = decl[i - 1]
+                if prev_kind == 'ident' and prev_value not in _KEYWORDS and prev_value not in _ATTRIBUTES:
+                    candidate = (prev_value, prev_line, i)
+            depth += 1
+        elif value == b')':
+            depth -= 1
+            if depth < 0:
+                return None
+        i += 1
+
+    if depth != 0:
+        return None
+    if candidate is None:
+        return _pointer_function_name(decl)
+
+    # Everything after the parameter list must be qualifiers or attribute groups
+    name, line, open_index = candidate
+    depth = 0
+    closed = False
+    attribute = False
+    for kind, value, _ in decl[open_index:]:
+        if value == b'(':
+            depth += 1
+        elif value == b')':
+            depth -= 1
+            if depth == 0:
+                if closed and not attribute:
+                    return None
+                closed = True
+                attribute = False
+        elif depth == 0:
+            if kind != 'ident' and value not in (b'&', b'*'):
+                return None
+            attribute = value in _ATTRIBUTES or (value.isupper() and len(value) > 1)
+    return name.decode('utf-8', 'replace'), line
+
+
+def _pointer_function_name(decl):
+    """
+    Return the (name, line) of a function returning a function pointer,
+    e.g. `void (*name(int sig))(int)`, or None.
+    """
+    for i in range(len(decl) - 3):
+        if (decl[i][1] == b'(' and decl[i + 1][1] == b'*' and decl[i + 2][0] == 'ident' and
+                decl[i + 3][1] == b'('):
+            if decl[-1][1] != b')':
+                return None
+            return decl[i + 2][1].decode('utf-8', 'replace'), decl[i + 2][2]
+    return None
+
+
+def _knr_header(decl):
+    """
+    Return the tokens of an old style function header, `name(a, b)`, if the
+    given tokens start with one and continue with a parameter declaration.
+    """
+    for i in range(1, len(decl)):
+        if decl[i][1] == b'(':
+            break
+    else:
+        return None
+    if decl[i - 1][0] != 'ident' or decl[i - 1][1] in _KEYWORDS:
+        return None
+
+    expect_name = True
+    for j in range(i + 1, len(decl)):
+        kind, value, _ = decl[j]
+        if value == b')':
+            # At least one parameter and a declaration after the header
+            if expect_name or j + 1 == len(decl):
+                return None
+            return decl[:j + 1]
+        if expect_name != (kind == 'ident') or (kind == 'ident' and value in _KEYWORDS):
+            return None
+        if not expect_name and value != b',':
+            return None
+        expect_name = not expect_name
+    return None
+
+
+def scan(data):
+    """
+    Scan C source code and return a list of ctags-like records for every function definition.
+
+    :param data: file content as bytes
+    :return: list of dicts with `name`, `kind`, `line`, `end` and `pattern`
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    code, lines = _strip_preprocessor(data)
+
+    result = []
+    decl = []
+    depth = 0
+    # Stack of open braces: (is_transparent, function record or None)
+    braces = []
+    current = None
+    # Header of an old style definition whose parameter declarations are being read
+    knr = None
+    for kind, value, line in _tokens(code):
+        if value == b'{':
+            if depth == 0:
+                if decl and (decl[0][1] in _TRANSPARENT and
+                             (len(decl) == 1 or decl[-1][0] in ('ident', 'string'))):
+                    braces.append((True, None))
+                    decl = []
+                    knr = None
+                    continue
+                found = _function_name(decl if decl or knr is None else knr)
+                knr = None
+                if found:
+                    name, start = found
+                    current = {'_type': 'tag', 'name': name, 'kind': 'function', 'line': start,
+                               'pattern': '/^' + lines[start - 1].decode('utf-8', 'replace') + '$/'}
+                    result.append(current)
+                decl = []
+            braces.append((False, current if depth == 0 else None))
+            depth += 1
+        elif value == b'}':
+            if not braces:
+                decl = []
+                continue
+            transparent, record = braces.pop()
+            if transparent:
+                decl = []
+                continue
+            depth -= 1
+            if depth == 0:
+                if record is not None:
+                    record['end'] = line
+                current = None
+                decl = []
+        elif depth == 0:
+            if value == b';':
+                if knr is None:
+                    knr = _knr_header(decl)
+                decl = []
+            else:
+                decl.append((kind, value, line))
+
+    # Unterminated functions extend to the end of the file
+    for record in result:
+        record.setdefault('end', len(lines))
+    return result
@@ -0,0 +1,441 @@
+"""
+Pool of long-lived universal-ctags processes.
+
+Spawning ctags for every version of every changed file dominates the runtime
+on commits touching many small files. The pool keeps a few ctags processes
+running in interactive mode (`--_interactive`), feeds them file contents over
+stdin and parses the JSON answers. If the available ctags does not support the
+interactive mode, files are tagged by batched multi-file invocations instead.
+"""
+import collections
+import functools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import incremental
+import profiling
+import tagcache
+
+# Number of files passed to a single ctags invocation in batch mode
+BATCH_SIZE = 200
+
+# Stand-in for a pygit2.Blob when only the id and the content are known
+BlobData = collections.namedtuple('BlobData', ['id', 'data'])
+
+
+@functools.lru_cache(maxsize=None)
+def find_ctags():
+    """
+    Locate universal ctags in the searchable path
+    :return: path to the executable or None
+    """
+    return shutil.which('universalctags') or shutil.which('ctags')
+
+
+def default_workers():
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class CtagsError(RuntimeError):
+    pass
+
+
+def is_banner(line):
+    try:
+        return json.loads(line.decode('utf-8')).get('_type') == 'program'
+    except ValueError:
+        return False
+
+
+def tags_request(filename, data):
+    """
+    :return: bytes of a `generate-tags` request of the interactive mode
+    """
+    request = json.dumps({'command': 'generate-tags', 'filename': filename, 'size': len(data)})
+    return request.encode('utf-8') + b'\n' + data
+
+
+class Answer:
+    """
+    Collects the tags of the answer of an interactive ctags to one request, line by line
+    """
+
+    def __init__(self, filename, profiler=profiling.NULL):
+        self.filename = filename
+        self.profiler = profiler
+        self.tags = []
+        self.decoding = 0.0
+        self.nbytes = 0
+
+    def feed(self, line):
+        """
+        :param line: next line of the output of ctags, empty at the end of the output
+        :return: True once the answer is complete
+        """
+        if not line:
+            raise CtagsError('ctags worker exited unexpectedly')
+        start = time.perf_counter()
+        entry = json.loads(line.decode('utf-8'))
+        self.decoding += time.perf_counter() - start
+        self.nbytes += len(line)
+        kind = entry.get('_type')
+        if kind == 'completed':
+            self.profiler.add('json_decode', self.decoding, 1, self.nbytes)
+            return True
+        if kind == 'error':
+            raise CtagsError(entry.get('message', 'ctags failed on {}'.format(self.filename)))
+        if kind == 'tag':
+            self.tags.append(entry)
+        return False
+
+
+class CtagsWorker:
+    """
+    A single ctags process in interactive mode answering `generate-tags` requests
+    """
+
+    def __init__(self, ctags, flags, profiler=profiling.NULL):
+        self.ctags = ctags
+        self.flags = flags
+        self.profiler = profiler
+        self.proc = None
+        self.start()
+
+    def start(self):
+        self.proc = subprocess.Popen([self.ctags, '--_interactive'] + self.flags,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        # ctags announces itself before reading any request
+        if not is_banner(self.proc.stdout.readline()):
+            self.close()
+            raise CtagsError('{} does not support the interactive mode'.format(self.ctags))
+
+    def generate(self, filename, data):
+        """
+        Tag the given file content
+        :param filename: name of the file, its extension selects the parser
+        :param data: file content as bytes
+        :return: list of tag dicts
+        """
+        try:
+            self.proc.stdin.write(tags_request(filename, data))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise CtagsError('ctags worker exited unexpectedly')
+
+        answer = Answer(filename, self.profiler)
+        while not answer.feed(self.proc.stdout.readline()):
+            pass
+        return answer.tags
+
+    def close(self, kill=False):
+        if self.proc:
+            if kill:
+                self.proc.kill()
+            if self.proc.stdin:
+                self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+
+class CtagsPool:
+    """
+    Tags many files per request using a fixed number of persistent ctags workers.
+    """
+
+    def __init__(self, flags, size=None, ctags=None, profiler=profiling.NULL):
+        self.profiler = profiler
+        self.ctags = ctags or find_ctags()
+        if not self.ctags:
+            raise FileNotFoundError(
+                "universalctags or ctags not found make sure its executable is available in the searchable path")
+        self.flags = list(flags)
+        self.size = size or default_workers()
+        self.calls = 0
+        # One slot per worker: either a running CtagsWorker or None if not started yet
+        self.slots = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+        # Whether ctags supports the interactive mode, None until the first worker is started by generate()
+        self.interactive = None
+        self.executor = None
+        for _ in range(self.size):
+            self.slots.put(None)
+
+    def probe(self):
+        # Starts the first worker, finding out whether ctags supports the interactive mode
+        with self.lock:
+            if self.interactive is not None:
+                return
+            try:
+                worker = CtagsWorker(self.ctags, self.flags, self.profiler)
+            except CtagsError:
+                self.interactive = False
+                return
+            self.workers.append(worker)
+            # No other thread uses the slots before the mode is known
+            self.slots.get_nowait()
+            self.slots.put(worker)
+            self.interactive = True
+
+    def spawn(self):
+        worker = CtagsWorker(self.ctags, self.flags, self.profiler)
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def generate_one(self, filename, data):
+        worker = self.slots.get()
+        try:
+            if worker is None:
+                worker = self.spawn()
+            return worker.generate(filename, data)
+        except CtagsError:
+            # The worker is in an unknown state, drop it and free its slot
+            if worker:
+                worker.close(kill=True)
+                with self.lock:
+                    self.workers.remove(worker)
+            worker = None
+            raise
+        finally:
+            self.slots.put(worker)
+
+    def generate(self, files):
+        """
+        Tag a list of files
+        :param files: list of (filename, data) tuples
+        :return: list of tag lists, in the order of `files`; None for files ctags failed on
+        """
+        if not files:
+            return []
+        self.calls += len(files)
+
+        if self.interactive is None:
+            self.probe()
+        if not self.interactive:
+            return self.generate_batch(files)
+
+        def run(entry):
+            try:
+                return self.generate_one(*entry)
+            except CtagsError as e:
+                sys.stderr.write('{}\n'.format(e))
+                return None
+
+        if len(files) == 1 or self.size == 1:
+            return [run(entry) for entry in files]
+        with self.lock:
+            # Several threads may tag files at the same time (see diffserver.py), only one creates the executor
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(max_workers=self.size)
+            executor = self.executor
+        return list(executor.map(run, files))
+
+    def generate_batch(self, files):
+        # Fallback without interactive mode: one ctags invocation for up to BATCH_SIZE files, None for the files
+        # of a failed invocation
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for first in range(0, len(files), BATCH_SIZE):
+                chunk = files[first:first + BATCH_SIZE]
+                paths = []
+                for i, (filename, data) in enumerate(chunk):
+                    # One directory per file keeps the names, and thus the language detection, intact
+                    path = os.path.join(tmp, str(first + i), os.path.basename(filename))
+                    os.makedirs(os.path.dirname(path))
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    paths.append(path)
+
+                proc = subprocess.Popen([self.ctags] + self.flags + paths,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = proc.communicate()
+                if err:
+                    sys.stderr.write(err.decode('utf-8'))
+                if proc.returncode:
+                    # Failed, not "no functions": None, as for a failed interactive request, is not cached
+                    sys.stderr.write('{} exited with status {}\n'.format(self.ctags, proc.returncode))
+                    results.extend([None] * len(chunk))
+                    continue
+
+                by_path = {path: [] for path in paths}
+                with self.profiler.stage('json_decode', len(out)):
+                    for line in out.decode('utf-8').split('\n'):
+                        if not line:
+                            continue
+                        entry = json.loads(line)
+                        if entry.get('path') in by_path:
+                            by_path[entry['path']].append(entry)
+                results.extend(by_path[path] for path in paths)
+        return results
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+            workers, self.workers = self.workers, []
+        if executor:
+            executor.shutdown()
+        for worker in workers:
+            worker.close()
+
+
+class BlobTagger:
+    """
+    Serves the tags of git blobs from the tag cache, generating the missing ones
+    in batches through a CtagsPool.
+
+    `prefetch` tags all blobs of a commit with a single pool request; `tags`
+    then returns the remembered result. `forget` drops the remembered results.
+
+    In incremental mode the results of the previous commit are kept by `forget`,
+    and a blob registered with `register_base` is derived from the tags of
+    another version of the file and the hunks between them (see incremental.py)
+    instead of being analysed completely.
+    """
+
+    def __init__(self, pool, tag_cache=None, cache_flavour=None, profiler=profiling.NULL, incremental=False):
+        self.pool = pool
+        self.tag_cache = tag_cache
+        self.cache_flavour = cache_flavour
+        # Derived tags are cached apart from those of complete analyses
+        self.derived_flavour = tagcache.flavour(cache_flavour, 'incremental')
+        self.profiler = profiler
+        self.incremental = incremental
+        self.known = {}
+        # Results and bases registered before the last call to forget, incremental mode only
+        self.recent = {}
+        self.bases = {}
+        self.next_bases = {}
+
+    def register_base(self, oid, base_oid, hunks):
+        """
+        Derive the tags of a blob from those of another version of the file, if known when it is prefetched
+        :param oid: id of the blob
+        :param base_oid: id of the other version
+        :param hunks: hunks from the other version to the blob, see incremental.hunks_from_patch
+        """
+        if self.incremental:
+            self.next_bases[str(oid)] = (str(base_oid), hunks)
+
+    def lookup(self, oid):
+        if oid in self.recent:
+            return self.recent[oid]
+        if not self.tag_cache:
+            return None
+        tags = self.tag_cache.get(oid, self.cache_flavour)
+        if tags is None and self.incremental:
+            tags = self.tag_cache.get(oid, self.derived_flavour)
+        return tags
+
+    def prefetch(self, entries):
+        """
+        :param entries: list of (filename, blob) tuples, blob being a pygit2.Blob or a BlobData
+        """
+        missing, derivable = self.collect(entries)
+        self.analyse(missing)
+        if derivable:
+            self.analyse(self.derive(derivable))
+
+    def collect(self, entries):
+        """
+        Look up the blobs that are not known yet in the tag cache
+        :param entries: list of (filename, blob) tuples
+        :return: (missing, derivable): (oid, filename, data) tuples of the blobs to analyse, and
+                 (oid, filename, data, (base oid, hunks)) tuples of those to derive in incremental mode
+        """
+        missing = []
+        derivable = []
+        with self.profiler.stage('tag_cache'):
+            for filename, blob in entries:
+                oid = str(blob.id)
+                if oid in self.known:
+                    continue
+                tags = self.lookup(oid)
+                if tags is not None:
+                    self.known[oid] = tags
+                    continue
+                # Placeholder, so duplicates are only tagged once
+                self.known[oid] = None
+                base = self.next_bases.get(oid) or self.bases.get(oid)
+                if base:
+                    derivable.append((oid, filename, blob.data, base))
+                else:
+                    missing.append((oid, filename, blob.data))
+        return missing, derivable
+
+    def analyse(self, missing):
+        if missing:
+            with self.profiler.stage('analyse', sum(len(data) for _, _, data in missing)):
+                results = self.pool.generate([(filename, data) for _, filename, data in missing])
+        else:
+            results = []
+        self.store(missing, results)
+
+    def store(self, missing, results):
+        """
+        Remember and cache the tags of the blobs returned by collect
+        :param missing: (oid, filename, data) tuples
+        :param results: tag lists in the order of `missing`, None for the blobs the analyzer failed on
+        """
+        with self.profiler.stage('tag_cache'):
+            for (oid, _, _), tags in zip(missing, results):
+                self.known[oid] = tags
+                if tags is not None and self.tag_cache:
+                    self.tag_cache.put(oid, self.cache_flavour, tags)
+
+    def derive(self, derivable):
+        """
+        Derive the tags of blobs from those of their bases, analysing the fragments of all of them with one request
+        :param derivable: list of (oid, filename, data, (base oid, hunks)) tuples
+        :return: list of (oid, filename, data) tuples of the blobs to analyse completely
+        """
+        with self.profiler.stage('derive'):
+            failed = []
+            planned = []
+            for oid, filename, data, (base_oid, hunks) in derivable:
+                base_tags = self.known.get(base_oid) or self.lookup(base_oid)
+                derivation = incremental.plan(base_tags, hunks, data) if base_tags is not None else None
+                if derivation is None:
+                    failed.append((oid, filename, data))
+                else:
+                    planned.append((oid, filename, data, derivation))
+
+            fragments = [(filename, fragment) for _, filename, _, derivation in planned
+                         for fragment in derivation.fragments]
+            results = iter(self.pool.generate(fragments))
+            for oid, filename, data, derivation in planned:
+                tags = derivation.finish([next(results) for _ in derivation.fragments])
+                if tags is None:
+                    failed.append((oid, filename, data))
+                    continue
+                self.known[oid] = tags
+                if self.tag_cache:
+                    self.tag_cache.put(oid, self.derived_flavour, tags)
+        return failed
+
+    def tags(self, filename, blob):
+        """
+        :return: list of tag dicts of the blob, None if ctags failed on it
+        """
+        oid = str(blob.id)
+        if oid not in self.known:
+            self.prefetch([(filename, blob)])
+        return self.known[oid]
+
+    def forget(self, keep=()):
+        """
+        Drop the tags known so far
+        :param keep: ids of blobs whose tags are kept, e.g. a version of a file needed by the next commit
+        """
+        if self.incremental:
+            self.recent = {oid: tags for oid, tags in self.known.items() if tags is not None}
+            self.bases, self.next_bases = self.next_bases, {}
+        self.known = {oid: self.known[oid] for oid in keep if oid in self.known}
@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 import argparse
+import array
 import collections
+import functools
 import getpass
+import itertools
 import json
+import multiprocessing
+import multiprocessing.util
 import os
 import re
-import shutil
-import subprocess
 import sys
-import tempfile
-from io import StringIO
-from os.path import dirname
+import time
 
 import pygit2
 
+import analyzers
+import changeindex
+import commitpipeline
+import ctagspool
+import incremental
+import intervals
+import mirrors
+import outputsink
+import profiling
+import statstore
+import tagcache
+from checkpoint import Checkpoint, CheckpointError, skip_processed
+
 # matplotlib
 try:
     import matplotlib.pyplot as plt
@@ -22,105 +36,45 @@ except ImportError:
 else:
     hasMatplotlib = True
 
-# check colour support
-try:
-    from termcolor import colored
-except ImportError:
-    hasColourSupport = False
-else:
-    hasColourSupport = sys.stdout.isatty()
-
-
 GIT_EMPTY_TREE_ID = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+GIT_NULL_OID = '0' * 40
 
 
-# Takes care of where the output from print goes and provides some utility functions
+# Prints the progress messages shown with --verbose, the results go through an outputsink
 class OutputManager:
     should_print = False
-    output = StringIO()
-    only_added = False
-    with_hash = False
 
     @staticmethod
     def print(*args, **kwargs):
         if OutputManager.should_print:
             print(' '.join(map(str, args)), **kwargs)
 
-    @staticmethod
-    def print_diff_summary(diff_summary, pretty):
-        for diff_data in diff_summary.file_diffs:
-            diff_data.print(pretty)
-
-    @staticmethod
-    def print_diff_summary_functions(diff_summary):
-        for diff_data in diff_summary.file_diffs:
-            diff_data.print_functions(OutputManager.only_added, OutputManager.with_hash)
-
-    @staticmethod
-    def print_diff_summary_simple(diff_summary):
-        for diff_data in diff_summary.file_diffs:
-            diff_data.print_simple(OutputManager.only_added)
-
-    @staticmethod
-    def print_relevant_diff(diff_summary, print_mode):
-        if print_mode == 'simple':
-            OutputManager.print_diff_summary_simple(diff_summary)
-            return
-
-        if print_mode == 'functions':
-            OutputManager.print_diff_summary_functions(diff_summary)
-            return
-
-        if print_mode == 'only-fn':
-            OutputManager.print_diff_summary(diff_summary, pretty=False)
-        else:
-            OutputManager.print_diff_summary(diff_summary, pretty=True)
-            if diff_summary.updated_fn_count == 0:
-                OutputManager.print('No relevant changes detected.')
-        OutputManager.print()
 
-    @staticmethod
-    def print_all(only_fn):
-        strs = OutputManager.output.getvalue().strip().split('\n') if not only_fn else list(
-            dict.fromkeys(OutputManager.output.getvalue().strip().split('\n')))
-        for str in strs:
-            if str and str != '\n':
-                print(str)
-
-
-# Keeps track of added and removed lines
+# Keeps track of added and removed lines. Line numbers are stored as arrays of unsigned ints,
+# a range analysis keeps one of these per changed function of every commit
 class ChangedLinesManager:
+    __slots__ = ('added_lines', 'removed_lines')
 
-    def __init__(self, added_lines, removed_lines, patch_commit):
-        self.added_lines = added_lines
-        self.removed_lines = removed_lines
-        self.patch_msg = 'Patch ' + patch_commit + ' has added lines'
-
-    def print_added_lines(self):
-        if self.added_lines:
-            print(self.patch_msg + ' (new line indices): [', end='')
-            print(*self.added_lines, end='')
-            print(']')
-
-    def print_removed_lines(self):
-        if self.removed_lines:
-            print(self.patch_msg + ' (rem line indices): [', end='')
-            print(*self.removed_lines, end='')
-            print(']')
+    def __init__(self, added_lines, removed_lines):
+        self.added_lines = array.array('I', added_lines)
+        self.removed_lines = array.array('I', removed_lines)
 
 
 # Concise representation of the data obtained from universalctags
 class FnAttributes:
+    __slots__ = ('fn_name', 'start_line', 'end_line', 'pattern')
 
-    def __init__(self, fn_name, start, end, prototype):
-        def trim_prototype(prototype):
-            proto = prototype[:prototype.rfind('{') - 1]
-            return proto[proto.find('^') + 1:]
-
+    def __init__(self, fn_name, start, end, pattern):
         self.fn_name = fn_name
         self.start_line = start
         self.end_line = end
-        self.prototype = trim_prototype(prototype)
+        # The ctags search pattern, the prototype is only extracted when needed
+        self.pattern = pattern
+
+    @property
+    def prototype(self):
+        proto = self.pattern[:self.pattern.rfind('{') - 1]
+        return proto[proto.find('^') + 1:]
 
     def __repr__(self):
         return "{}: {}-{} ({})".format(self.fn_name, self.start_line, self.end_line, self.prototype)
@@ -128,18 +82,22 @@ class FnAttributes:
 
 # Computes and stores the targets, as lines of added code
 class FileDifferences:
+    __slots__ = ('filename', 'file_extension', 'current_fn_map', 'prev_fn_map', 'current_fn_index', 'prev_fn_index',
+                 'fn_to_changed_lines', 'patch_commit')
 
-    def __init__(self, filename, patch, old_path, new_path):
-        # find ctags
-        self.ctags = shutil.which('universalctags')
-        if not self.ctags:
-            self.ctags = shutil.which('ctags')
-        if not self.ctags:
-            sys.exit('package universal-ctags not found.')
-        self.filename = filename
+    CTAGS_FLAGS = ['--c-kinds=fp', '--fields=+ne', '--output-format=json']
+
+    # old_blob and new_blob are the pygit2.Blob objects of both sides of the patch,
+    # None if the file does not exist on that side. tagger is the ctagspool.BlobTagger
+    # providing the ctags entries of the blobs
+    def __init__(self, filename, patch, old_blob, new_blob, tagger):
+        # File and function names repeat across commits, share a single copy of each
+        self.filename = sys.intern(filename)
         self.file_extension = FileDifferences.get_extension(filename)
-        self.current_fn_map = self.get_fn_names(new_path)
-        self.prev_fn_map = self.get_fn_names(old_path)
+        self.current_fn_map = self.get_fn_names(new_blob, tagger)
+        self.prev_fn_map = self.get_fn_names(old_blob, tagger)
+        self.current_fn_index = FileDifferences.index_fn_map(self.current_fn_map)
+        self.prev_fn_index = FileDifferences.index_fn_map(self.prev_fn_map)
         self.fn_to_changed_lines = {}
         self.patch_commit = patch
 
@@ -151,25 +109,18 @@ class FileDifferences:
         else:
             return 'none'
 
-    def get_fn_names(self, path):
-        proc = subprocess.Popen(
-            [self.ctags, '-x', '--c-kinds=fp', '--fields=+ne', '--output-format=json', os.path.join(path, self.filename)],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        out, err = proc.communicate()
+    def get_fn_names(self, blob, tagger):
+        if blob is None:
+            return {} # file does not exist on this side of the patch
 
-        if err:
-            sys.stderr.write(err.decode('utf-8'))
+        tags = tagger.tags(self.filename, blob)
+        if tags is None:
             return {} # no content
 
         fn_map = {}
-        fn_table = out.decode('utf-8').strip().split('\n')
 
         # TODO: only looks at function code excluding prototypes - maybe sometime changing prototypes would be useful
-        for obj in fn_table:
-            if not obj:
-                continue
-            fn_data = json.loads(obj)
+        for fn_data in tags:
             new_item = FnAttributes(fn_data['name'], fn_data['line'],
                                     fn_data['end'] if 'end' in fn_data else fn_data['line'], fn_data['pattern'])
             if fn_data['name'] in fn_map and 'kind' in fn_data and fn_data['kind'] == 'function':
@@ -179,104 +130,69 @@ class FileDifferences:
 
         return fn_map
 
-    def match_lines_to_fn(self, new_lines, old_lines):
-        success = False
-
-        for fn_name in set(self.current_fn_map.keys()).union(set(self.prev_fn_map.keys())):
+    @staticmethod
+    def index_fn_map(fn_map):
+        return intervals.FunctionIndex([(fn_name, fn_attr.start_line, fn_attr.end_line)
+                                        for fn_name, fn_attrs in fn_map.items() for fn_attr in fn_attrs])
 
-            added, removed = [], []
+    def match_lines_to_fn(self, new_lines, old_lines):
+        success = bool(self.fn_to_changed_lines)
 
-            if fn_name in self.current_fn_map:
-                for new_fn_attr in self.current_fn_map[fn_name]:
-                    for new_line_no in new_lines:
-                        if new_line_no >= new_fn_attr.start_line and new_line_no <= new_fn_attr.end_line:
-                            added.append(new_line_no)
+        added_per_fn = self.current_fn_index.assign(new_lines)
+        removed_per_fn = self.prev_fn_index.assign(old_lines)
 
-            if fn_name in self.prev_fn_map:
-                for old_fn_attr in self.prev_fn_map[fn_name]:
-                    for old_line_no in old_lines:
-                        if old_line_no >= old_fn_attr.start_line and old_line_no <= old_fn_attr.end_line:
-                            removed.append(old_line_no)
+        for fn_name in list(added_per_fn) + [fn for fn in removed_per_fn if fn not in added_per_fn]:
+            added = added_per_fn.get(fn_name, [])
+            removed = removed_per_fn.get(fn_name, [])
 
             if fn_name in self.fn_to_changed_lines:
                 self.fn_to_changed_lines[fn_name].added_lines.extend(added)
                 self.fn_to_changed_lines[fn_name].removed_lines.extend(removed)
-                success = True
-            elif added or removed:
-                self.fn_to_changed_lines[fn_name] = ChangedLinesManager(added, removed, self.patch_commit)
-                success = True
+            else:
+                self.fn_to_changed_lines[sys.intern(fn_name)] = ChangedLinesManager(added, removed)
+            success = True
 
         return success
 
-    # Prints all the data that this object has
-    def print(self, pretty):
-        fn_list_file = None
-
-        if not pretty:
-            OutputManager.print('Updated functions:')
-            fn_list_file = open('./updated_functions', 'a')
-
-        for fn_name, lines in self.fn_to_changed_lines.items():
-            if pretty and lines:
-                if hasColourSupport:
-                    print('%s: In function %s' % (colored(self.filename, 'blue'), colored(fn_name, 'green')))
-                else:
-                    print('{}: In function {}'.format(self.filename, fn_name))
-                self.fn_to_changed_lines[fn_name].print_added_lines()
-                self.fn_to_changed_lines[fn_name].print_removed_lines()
-            elif lines:
-                if hasColourSupport:
-                    print('%s' % colored(fn_name, 'green'))
-                else:
-                    print('%s' % fn_name)
-                fn_list_file.write('%s\n' % fn_name)
-
-        if not pretty:
-            fn_list_file.close()
-
-    def print_functions(self, only_added, with_hash):
-        for fn_name,_ in self.fn_to_changed_lines.items():
-            if not only_added or self.fn_to_changed_lines[fn_name].added_lines:
-                output = "{},{}".format(self.filename, fn_name)
-                if with_hash:
-                    output += ',' + self.patch_commit
-                print(output)
-
-    def print_simple(self, only_added):
-        print('# Commit: %s' % self.patch_commit)
-        fn_names = list(self.fn_to_changed_lines.keys())
-        fn_names.sort()
-        for fn_name in fn_names:
-            line_manager = self.fn_to_changed_lines[fn_name]
-            lines = line_manager.added_lines
-            if not only_added:
-                lines += line_manager.removed_lines
-                lines = list(set(lines))
-            lines.sort()
-            for line in lines:
-                if hasColourSupport:
-                    print('%s,%s,%s' % (colored(self.filename, 'blue'),(colored(fn_name, 'yellow')), line))
-                else:
-                    print('{},{},{}'.format(self.filename, fn_name, line))
+    # The functions of both file versions are only needed while matching lines, drop them once
+    # all the hunks of the file are matched
+    def release_fn_maps(self):
+        self.current_fn_map = self.prev_fn_map = None
+        self.current_fn_index = self.prev_fn_index = None
 
 
 class DiffSummary:
-    # file_diffs is a list of FileDifferences
-    def __init__(self):
+    __slots__ = ('commit', 'file_diffs', 'updated_fn_count', 'other_extensions')
+
+    # file_diffs is a list of FileDifferences, commit the id of the analysed commit. other_extensions are the
+    # extensions of the changed files that are not analysed, plus '.c' if no function of the C files changed
+    def __init__(self, commit=None):
+        self.commit = commit
         self.file_diffs = []
         self.updated_fn_count = 0
+        self.other_extensions = set()
 
     def add_file_diff(self, file_diff):
         self.file_diffs.append(file_diff)
         self.updated_fn_count += len(file_diff.fn_to_changed_lines)
 
+    # Number of added and removed lines in functions
+    def changed_line_counts(self):
+        added = removed = 0
+        for file_diff in self.file_diffs:
+            for lines in file_diff.fn_to_changed_lines.values():
+                added += len(lines.added_lines)
+                removed += len(lines.removed_lines)
+        return added, removed
+
     def diff_for_json(self):
         file_to_changed_lines = {}
         for file_diff in self.file_diffs:
             for fn_name, lines in file_diff.fn_to_changed_lines.items():
                 if lines and lines.added_lines:
                     if not file_diff.filename in file_to_changed_lines:
-                        file_to_changed_lines[file_diff.filename] = file_diff.fn_to_changed_lines[fn_name].added_lines
+                        file_to_changed_lines[file_diff.filename] = list(
+                            file_diff.fn_to_changed_lines[fn_name].added_lines)
                     else:
                         file_to_changed_lines[file_diff.filename].extend(
                             file_diff.fn_to_changed_lines[fn_name].added_lines)
@@ -284,295 +200,510 @@ class DiffSummary:
         return file_to_changed_lines
 
 
+# A C file changed by a commit: both sides of the patch (None if the file does not exist on that side), the
+# (new line numbers, old line numbers) changed by every hunk and, with --incremental, the hunks of
+# incremental.hunks_from_patch
+ChangedFile = collections.namedtuple('ChangedFile', ['filename', 'old_blob', 'new_blob', 'changed_lines', 'hunks'])
+
+
 # Handles all interactions with the git repository
 class RepoManager:
 
-    def __init__(self, repo_url, print_mode, save_json, track_json, path_filter):
+    def __init__(self, repo_url, print_mode, save_json, track_json, path_filter, tag_cache=None, ctags_workers=None,
+                 jobs=1, analyzer=analyzers.DEFAULT_ANALYZER, profiler=profiling.NULL, sink=None, mirror_dir=None,
+                 incremental=False, pipeline_depth=0, tagger=None, prompt=True):
         self.repo_url = repo_url
+        self.mirror_dir = mirror_dir
+        # Whether credentials are asked on the terminal when fetching the remote fails; unattended runs
+        # (diffbatch.py, diffserver.py) fail instead
+        self.prompt = prompt
+        self.profiler = profiler
+        self.tag_cache = tag_cache
+        self.ctags_workers = ctags_workers
+        self.analyzer = analyzer
+        self.incremental = incremental
+        self.pipeline_depth = pipeline_depth
+        # ctagspool.BlobTagger, started on first use unless shared with other RepoManagers (see diffbatch.py)
+        self.tagger = tagger
+        self.jobs = jobs or 1
         self.allowed_extensions = ['.c']  # , '.h']
         self.print_mode = print_mode
-        self.fn_updated_per_commit = {}
-        self.other_changed = {}
+        self.sink = sink or outputsink.create_sink(print_mode)
+        # Rows of the commits seen by get_updated_fn_per_commit, read by the summary and the plots
+        self.stats = statstore.CommitStats()
+        self.skip_initial = False
         self.original_commit = None
         self.save_json = save_json
         self.track_json = track_json
         self.path_filter = None if not path_filter else re.compile(path_filter)
 
-    def get_repo_paths(self):
-        # Path where repo is supposed to be
-        cwd = os.getcwd()
-        return os.path.join(cwd, 'repo'), os.path.join(cwd, 'repo_prev')
-
-    # Handles the cloning of a repo
-    def clone_repo(self, repo_path, rev=''):
+    # Returns the mirror of the remote repository, cloned on first use and only fetched by later runs
+    def get_repo(self):
         try:
-            return pygit2.clone_repository(self.repo_url, repo_path, bare=True)
+            return mirrors.open_mirror(self.repo_url, self.mirror_dir)
         except pygit2.GitError:
+            if not self.prompt:
+                raise
             username = input('Enter git username: ')
             password = getpass.getpass('Enter git password: ')
             cred = pygit2.UserPass(username, password)
             try:
-                return pygit2.clone_repository(self.repo_url, repo_path, bare=True,
-                                               callbacks=pygit2.RemoteCallbacks(credentials=cred))
+                return mirrors.open_mirror(self.repo_url, self.mirror_dir,
+                                           callbacks=pygit2.RemoteCallbacks(credentials=cred))
             except ValueError:
                 print("Invalid URL!")
                 sys.exit(1)
-        except Exception as e:
-
+        except ValueError as e:
             print(e)
 
         print("Could not clone repository")
         sys.exit(1)
 
-    def get_repo(self, repo_path, rev=''):
-        # Check if we have a repo
-        try:
-            discover_repo_path = pygit2.discover_repository(repo_path, 0, repo_path)
-        except KeyError:
-            discover_repo_path = None
-
-        repo = None
-
-        # No repo found
-        if discover_repo_path is None:
-            OutputManager.print("No repo found. Cloning...")
-
-            # Clone as bare repository
-            repo = self.clone_repo(repo_path)
-            OutputManager.print("Cloned repo.")
-
-            repo = pygit2.Repository(pygit2.discover_repository(repo_path, 0, dirname(os.getcwd())))
-            return repo
-
-        # If not repo:
-        repo = pygit2.Repository(discover_repo_path)
-
-        # A different repo is found
-        if repo.remotes['origin'].url != self.repo_url and repo.remotes['origin'].url != os.path.abspath(self.repo_url) :
-            OutputManager.print("Found repo is incorrect. Should be:", self.repo_url, "but is:", repo.remotes['origin'].url)
-            sys.exit(1)
-
-        return repo
-
-    def compute_diffs(self, patches, commit_new, commit_old, old_repo, new_repo, clone_old_path, clone_new_path):
-        diff_summary = DiffSummary()
+    @staticmethod
+    def read_blob(repo, diff_file):
+        # Returns one side of a patch straight from the object database
+        if str(diff_file.id) == GIT_NULL_OID:
+            return None
+        return repo[diff_file.id]
+
+    def get_tagger(self):
+        # The analyzer (e.g. the ctags workers) is started on first use and kept until cleanup()
+        if not self.tagger:
+            try:
+                pool, cache_flavour = analyzers.create_pool(self.analyzer, FileDifferences.CTAGS_FLAGS,
+                                                            self.ctags_workers, self.profiler)
+            except FileNotFoundError:
+                sys.exit('package universal-ctags not found.')
+            self.tagger = ctagspool.BlobTagger(pool, self.tag_cache, cache_flavour, self.profiler,
+                                               incremental=self.incremental)
+        return self.tagger
+
+    # diff is the pygit2.Diff of the commit. Files are selected from the deltas alone, hunks are
+    # only generated for the files that are analysed
+    def compute_diffs(self, repo, diff, commit_new):
+        diff_summary, changed_files = self.prepare_diffs(repo, diff, commit_new)
+
+        # Tag both sides of all the files of the commit with a single request to the ctags workers
+        tagger = self.get_tagger()
+        for changed in changed_files:
+            if changed.hunks is not None:
+                # The new version of the file is derived from the functions of the old one and the hunks
+                tagger.register_base(changed.new_blob.id, changed.old_blob.id, changed.hunks)
+        tagger.prefetch(RepoManager.blobs_to_tag(changed_files))
+
+        self.match_diffs(diff_summary, changed_files, tagger)
+        tagger.forget()
+        return diff_summary
 
-        has_c_files = False
-        has_updated_fn = False
+    # Everything compute_diffs reads from the repository: returns the DiffSummary, holding the extensions
+    # of the other files so far, and a ChangedFile for every analysed file
+    def prepare_diffs(self, repo, diff, commit_new):
+        diff_summary = DiffSummary(str(commit_new.id))
 
-        for patch in patches:
-            filename = patch.delta.new_file.path
+        profiler = self.profiler
+        changed_files = []
+        for index, delta in enumerate(diff.deltas):
+            filename = delta.new_file.path
             if self.path_filter and not self.path_filter.match(filename):
                 continue
 
             extension = FileDifferences.get_extension(filename)
             if extension not in self.allowed_extensions:
-                if extension not in self.other_changed:
-                    self.other_changed[extension] = set()
-
-                self.other_changed[extension].add(commit_new.hex)
+                diff_summary.other_extensions.add(extension)
                 continue
 
-            has_c_files = True
-            proc = subprocess.Popen(
-                ['git', '-C', clone_old_path, 'checkout', str(commit_old.id)],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = proc.communicate()
-
-            if proc.returncode and err:
-                print(err)
-
-            proc = subprocess.Popen(
-                ['git', '-C', clone_new_path, 'checkout', str(commit_new.id)],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = proc.communicate()
-
-            if proc.returncode and err:
-                print(err)
-
-            diff_data = FileDifferences(filename, commit_new.hex, old_path=clone_old_path, new_path=clone_new_path)
+            read_start = time.perf_counter()
+            old_blob = RepoManager.read_blob(repo, delta.old_file)
+            new_blob = RepoManager.read_blob(repo, delta.new_file)
+            profiler.add('read_blob', time.perf_counter() - read_start, 2,
+                         sum(blob.size for blob in (old_blob, new_blob) if blob is not None))
+
+            with profiler.stage('patch'):
+                patch = diff[index]
+                changed_lines = RepoManager.changed_lines(patch)
+                hunks = None
+                if self.incremental and old_blob is not None and new_blob is not None:
+                    hunks = incremental.hunks_from_patch(patch)
+            changed_files.append(ChangedFile(filename, old_blob, new_blob, changed_lines, hunks))
+        return diff_summary, changed_files
+
+    # The (new line numbers, old line numbers) of the non-blank lines changed by every hunk of a pygit2.Patch
+    @staticmethod
+    def changed_lines(patch):
+        changed_lines = []
+        for hunk in patch.hunks:
+            new_fn_lines = []
+            old_fn_lines = []
+
+            for diff_line in hunk.lines:
+                # Check if the line contains non-whitespace changes
+                if not diff_line.content.strip():
+                    continue
+
+                if diff_line.new_lineno > -1:
+                    new_fn_lines.append(diff_line.new_lineno)
+                else:
+                    old_fn_lines.append(diff_line.old_lineno)
+            changed_lines.append((new_fn_lines, old_fn_lines))
+        return changed_lines
 
-            for hunk in patch.hunks:
-                new_fn_lines = []
-                old_fn_lines = []
+    @staticmethod
+    def blobs_to_tag(changed_files):
+        return [(changed.filename, blob) for changed in changed_files
+                for blob in (changed.old_blob, changed.new_blob) if blob is not None]
 
-                for diff_line in hunk.lines:
-                    # Check if the line contains non-whitespace changes
-                    if not diff_line.content.strip():
-                        continue
+    # Matches the changed lines of the files prepared by prepare_diffs to the functions given by the tagger
+    def match_diffs(self, diff_summary, changed_files, tagger):
+        profiler = self.profiler
+        has_updated_fn = False
+        for filename, old_blob, new_blob, changed_lines, _ in changed_files:
+            file_start = time.perf_counter()
 
-                    if diff_line.new_lineno > -1:
-                        new_fn_lines.append(diff_line.new_lineno)
-                    else:
-                        old_fn_lines.append(diff_line.old_lineno)
+            with profiler.stage('function_index'):
+                diff_data = FileDifferences(filename, diff_summary.commit, old_blob=old_blob, new_blob=new_blob,
+                                            tagger=tagger)
 
-                if diff_data.match_lines_to_fn(new_fn_lines, old_fn_lines):
-                    has_updated_fn = True
+            with profiler.stage('match'):
+                for new_fn_lines, old_fn_lines in changed_lines:
+                    if diff_data.match_lines_to_fn(new_fn_lines, old_fn_lines):
+                        has_updated_fn = True
+            diff_data.release_fn_maps()
 
             diff_summary.add_file_diff(diff_data)
+            profiler.record('files', time.perf_counter() - file_start, commit=diff_summary.commit, file=filename,
+                            bytes=new_blob.size if new_blob is not None else 0)
 
-        if has_c_files and not has_updated_fn:
-            c_ext = '.c'
-            if c_ext not in self.other_changed:
-                self.other_changed[c_ext] = set()
-            self.other_changed[c_ext].add(commit_new.hex)
-
+        if changed_files and not has_updated_fn:
+            diff_summary.other_extensions.add('.c')
         return diff_summary
 
-    def compare_patches_in_range(self, start_revision, end_revision=None):
-        curr_repo_path, _ = self.get_repo_paths()
-        curr_repo = self.get_repo(curr_repo_path, start_revision)
-
-        commit_new = curr_repo.revparse_single(start_revision)
-        commit_old = curr_repo.revparse_single(end_revision if end_revision else start_revision+"~1")
-
-        clone_old = tempfile.mkdtemp()
-        clone_new = tempfile.mkdtemp()
-
-        # create clones:
-        orig_path, _ = self.get_repo_paths()
-
-        proc = subprocess.Popen(
-            ['git', 'clone', "file://" + orig_path, clone_old],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = proc.communicate()
-
-        if proc.returncode and err:
-            print(err)
-
-        proc = subprocess.Popen(
-            ['git', 'clone', "file://" + orig_path, clone_new],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = proc.communicate()
-
-        if proc.returncode and err:
-            print(err)
+    # Opens the repository to analyse without touching any working copy: a local repository is used
+    # in place, a remote one through its mirror (see mirrors.py)
+    def open_repo(self):
+        if mirrors.local_path(self.repo_url) is not None:
+            return mirrors.open_repository(self.repo_url)
+
+        OutputManager.print('Updating the mirror of', self.repo_url, 'in',
+                            mirrors.mirror_path(self.repo_url, self.mirror_dir))
+        with self.profiler.stage('clone'):
+            return self.get_repo()
+
+    def compare_patches_in_range(self, start_revision, end_revision=None, times=0):
+        curr_repo = self.open_repo()
+        walker = RepoManager.revision_range(curr_repo, start_revision, end_revision, times)
+        # Each summary is printed and dropped, memory does not grow with the length of the range
+        commit_count = 0
+        for _ in self.diff_commits(curr_repo, self.profiler.iterate('walk', walker), emit=self.print_summary):
+            commit_count += 1
 
+        return commit_count
 
-        old_repo = pygit2.repository.Repository(clone_old)
-        new_repo = pygit2.repository.Repository(clone_new)
+    def print_summary(self, diff_summary):
+        with self.profiler.stage('print'):
+            self.sink.write(diff_summary)
 
+    # Records the changed functions of the commits of the range in a changeindex.ChangeIndex, skipping those
+    # already indexed. Without end_revision and times, the whole history of start_revision is indexed
+    def index_commits(self, index, start_revision='HEAD', end_revision=None, times=0):
+        curr_repo = self.open_repo()
+        if end_revision or times:
+            walker = RepoManager.revision_range(curr_repo, start_revision, end_revision, times)
+        else:
+            walker = RepoManager.commit_range(curr_repo, RepoManager.resolve(curr_repo, start_revision).id, (), 0,
+                                              pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE)
+        indexed = index.indexed_commits()
+        # Times of the commits handed to diff_commits and not indexed yet
+        commit_times = {}
+
+        def new_commits():
+            for commit in walker:
+                commit_hash = str(commit.id)
+                if commit_hash not in indexed:
+                    commit_times[commit_hash] = commit.commit_time
+                    yield commit
 
-        # Initialise a commit walker from the the newest
-        walker = curr_repo.walk(commit_new.id, pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE)
-        prev_commit = curr_repo.revparse_single(commit_old.hex)
-        # Stop at the selected oldest
-        walker.hide(commit_old.id)
-        diff_summaries = []
-        for commit in walker:
-            diff = curr_repo.diff(commit.parents[0], commit, context_lines=0)
-            diff_summary = self.compute_diffs(diff, commit, prev_commit, old_repo, new_repo, clone_old, clone_new)
-            diff_summaries.append(diff_summary)
-            prev_commit = commit
-            OutputManager.print_relevant_diff(diff_summary, self.print_mode)
+        commit_count = 0
+        for diff_summary in self.diff_commits(curr_repo, self.profiler.iterate('walk', new_commits())):
+            with self.profiler.stage('index'):
+                index.add(diff_summary.commit, commit_times.pop(diff_summary.commit), diff_summary)
+            commit_count += 1
+        index.flush()
+        return commit_count
+
+    # Prints the commits that changed `function` in `filename`, the newest first, from start_revision back to
+    # end_revision or to the commit that introduced the function. Only the commits that changed the blob of the
+    # file are analysed, and every version of the file only once. Returns the number of analysed commits
+    def function_history(self, function, filename, start_revision='HEAD', end_revision=None):
+        curr_repo = self.open_repo()
+        profiler = self.profiler
+        hide = [RepoManager.resolve(curr_repo, end_revision).id] if end_revision else ()
+        walker = RepoManager.commit_range(curr_repo, RepoManager.resolve(curr_repo, start_revision).id, hide, 0,
+                                          pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME)
+        tagger = self.get_tagger()
 
-        shutil.rmtree(clone_old)
-        shutil.rmtree(clone_new)
+        commit_count = 0
+        for commit in profiler.iterate('walk', walker):
+            with profiler.stage('diff'):
+                new_id = RepoManager.file_id(commit.tree, filename)
+                parent_ids = [RepoManager.file_id(parent.tree, filename) for parent in commit.parents]
+            # Same version as in a parent: a change, if any, is found when walking that parent
+            if new_id in parent_ids or (new_id is None and not parent_ids):
+                continue
 
-        return diff_summaries
+            commit_count += 1
+            old_id = parent_ids[0] if parent_ids else None
+            read_start = time.perf_counter()
+            old_blob = curr_repo[old_id] if old_id else None
+            new_blob = curr_repo[new_id] if new_id else None
+            profiler.add('read_blob', time.perf_counter() - read_start, 2,
+                         sum(blob.size for blob in (old_blob, new_blob) if blob is not None))
+
+            with profiler.stage('patch'):
+                patch = pygit2.Patch.create_from(old_blob, new_blob, old_as_path=filename, new_as_path=filename,
+                                                 context_lines=0)
+                changed_lines = RepoManager.changed_lines(patch)
+                if self.incremental and old_blob is not None and new_blob is not None:
+                    # The walk goes back in time: the old version is derived from the new one, known from the
+                    # previous commit
+                    reverse = pygit2.Patch.create_from(new_blob, old_blob, context_lines=0)
+                    tagger.register_base(old_blob.id, new_blob.id, incremental.hunks_from_patch(reverse))
+            tagger.prefetch([(filename, blob) for blob in (old_blob, new_blob) if blob is not None])
+
+            diff_summary = DiffSummary(str(commit.id))
+            with profiler.stage('function_index'):
+                diff_data = FileDifferences(filename, diff_summary.commit, old_blob=old_blob, new_blob=new_blob,
+                                            tagger=tagger)
+            introduced = function in diff_data.current_fn_map and function not in diff_data.prev_fn_map
+            with profiler.stage('match'):
+                for new_fn_lines, old_fn_lines in changed_lines:
+                    diff_data.match_lines_to_fn(new_fn_lines, old_fn_lines)
+            diff_data.release_fn_maps()
+
+            diff_data.fn_to_changed_lines = {fn_name: lines for fn_name, lines in diff_data.fn_to_changed_lines.items()
+                                             if fn_name == function}
+            if diff_data.fn_to_changed_lines:
+                diff_summary.add_file_diff(diff_data)
+                with profiler.stage('print'):
+                    self.sink.write(diff_summary)
+
+            # The old version of the file is the new one of the next commit that changes it
+            tagger.forget(keep=[str(old_id)] if old_id else ())
+            # A merge may bring the function from another parent, whose history is still to be walked
+            if introduced and len(commit.parents) <= 1:
+                break
+        return commit_count
+
+    # The id of the blob at `path` in a tree, None if there is no such file
+    @staticmethod
+    def file_id(tree, path):
+        try:
+            entry = tree[path]
+        except KeyError:
+            return None
+        return entry.id if entry.type_str == 'blob' else None
+
+    def diff_commit(self, repo, commit):
+        start = time.perf_counter()
+        diff_summary = self.compute_diffs(repo, self.commit_diff(repo, commit), commit)
+        self.profiler.record('commits', time.perf_counter() - start, commit=str(commit.id),
+                             files=len(diff_summary.file_diffs))
+        return diff_summary
 
+    def commit_diff(self, repo, commit):
+        with self.profiler.stage('diff'):
+            # The initial commit is compared with an empty tree
+            parent_tree = commit.parents[0].tree if commit.parents else repo.revparse_single(GIT_EMPTY_TREE_ID)
+            return repo.diff(parent_tree, commit.tree, context_lines=0)
+
+    # The git stage of the pipeline: (DiffSummary, changed files) of prepare_diffs
+    def prepare_commit(self, repo, commit):
+        return self.prepare_diffs(repo, self.commit_diff(repo, commit), commit)
+
+    # Settings needed to rebuild this RepoManager in a worker process
+    def worker_config(self):
+        return {
+            'repo_url': self.repo_url,
+            'print_mode': self.print_mode,
+            'path_filter': self.path_filter.pattern if self.path_filter else None,
+            'tag_cache': (self.tag_cache.cache_dir, self.tag_cache.max_size) if self.tag_cache else None,
+            'ctags_workers': self.ctags_workers or 1,
+            'analyzer': self.analyzer,
+            'incremental': self.incremental,
+            'profile_top': self.profiler.top,
+        }
+
+    # Yields the DiffSummary of every commit, in the order of commits, once passed to emit if given. With more
+    # than one job the commits are analysed by a pool of processes, each with its own repository and ctags
+    # workers; with a pipeline depth, by the stages of commitpipeline.py, whose emitter calls emit
+    def diff_commits(self, repo, commits, emit=None):
+        if self.pipeline_depth:
+            yield from commitpipeline.run(commits, functools.partial(self.prepare_commit, repo),
+                                          lambda job: RepoManager.blobs_to_tag(job[1]),
+                                          lambda job, tagger: self.match_diffs(job[0], job[1], tagger),
+                                          self.get_tagger(), self.pipeline_depth, self.profiler, emit)
+            return
+        if emit:
+            for diff_summary in self.diff_commits(repo, commits):
+                emit(diff_summary)
+                yield diff_summary
+            return
 
+        if self.jobs <= 1:
+            for commit in commits:
+                yield self.diff_commit(repo, commit)
+            return
 
+        outputsink.flush_before_fork()
+        pool = multiprocessing.Pool(self.jobs, initializer=init_diff_worker, initargs=(repo.path, self.worker_config()))
+        try:
+            for diff_summary, profile in pool.imap(diff_worker_task, (str(c.id) for c in commits), chunksize=4):
+                self.profiler.merge(profile)
+                yield diff_summary
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    # The commits of --revision, --range and -ri, from the oldest to the newest. Without a range, only
+    # start_revision itself is compared with its parent
     @staticmethod
-    def repo_to_commit(repo, commit_hash):
-        repo.reset(pygit2.Oid(hex=commit_hash), pygit2.GIT_RESET_HARD)
-
-    def commit_list(self, repo, start_hash, end_hash=None, times=0):
-        commits_range = []
+    def revision_range(repo, start_revision, end_revision=None, times=0):
+        commit_new = RepoManager.resolve(repo, start_revision)
+        if end_revision:
+            hide = [RepoManager.resolve(repo, end_revision).id]
+        else:
+            hide = [] if times else commit_new.parent_ids
+        return RepoManager.commit_range(repo, commit_new.id, hide, times,
+                                        pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE)
 
-        if end_hash:
-            for commit in list(repo.walk(repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL)):
-                if commit.hex == end_hash:
-                    break
-                commits_range.append(commit)
-            commits_range.append(repo.revparse_single(end_hash))
-            return commits_range
+    @staticmethod
+    def resolve(repo, revision):
+        return repo.revparse_single(str(revision)).peel(pygit2.Commit)
 
+    # Every range option ends up here: a single lazy walk from start, which excludes the commits of hide and
+    # their ancestors. With times, only first parents are followed and the walk stops after that many commits
+    @staticmethod
+    def commit_range(repo, start, hide=(), times=0, sorting=pygit2.GIT_SORT_TOPOLOGICAL):
+        if times and not sorting & pygit2.GIT_SORT_REVERSE:
+            # A first-parent chain is walked in order without sorting, so the walk streams and stops early
+            walker = repo.walk(start, pygit2.GIT_SORT_NONE)
+            walker.simplify_first_parent()
+            for commit_id in hide:
+                walker.hide(commit_id)
+            return itertools.islice(walker, times)
+
+        walker = repo.walk(start, sorting)
+        for commit_id in hide:
+            walker.hide(commit_id)
         if times:
-            count = 0
-            while times > 0:
-                commits_range.append(repo.revparse_single(str(start_hash) + "~" + str(count)))
-                count += 1
-                times -= 1
-            return commits_range
-
-    def get_updated_fn_per_commit(self, skip_initial=False, testing=False, end_hash=None, times=0):
-        RepoManager.initial_cleanup()
+            # Oldest first: hide everything past the last of the N first-parent commits
+            walker.simplify_first_parent()
+            commit = repo[start]
+            for _ in range(times):
+                if not commit.parents:
+                    break
+                commit = commit.parents[0]
+            else:
+                walker.hide(commit.id)
+        return walker
+
+    # Aggregates of get_updated_fn_per_commit saved in checkpoints
+    def checkpoint_data(self, updates_json):
+        return {
+            'stats': self.stats.state(),
+            'updates_json': updates_json,
+        }
+
+    def restore_checkpoint_data(self, data):
+        if 'stats' not in data:
+            raise CheckpointError('Checkpoint written by an older version, start the scan again without --resume')
+        self.stats = statstore.CommitStats.from_state(data['stats'])
+        return data['updates_json']
+
+    def get_updated_fn_per_commit(self, skip_initial=False, testing=False, end_hash=None, times=0, checkpoint=None,
+                                  resume=False):
+        state = checkpoint.load() if checkpoint and resume else None
+        self.skip_initial = skip_initial
 
         updates_json = {}
 
-        curr_repo_path, prev_repo_path = self.get_repo_paths()
-
-        patch_repo = self.get_repo(curr_repo_path)
-        original_repo = self.get_repo(prev_repo_path)
-
-        empty_tree = None
+        # Commits are diffed tree to tree straight from the object database, no working copy is involved
+        repo = self.open_repo()
 
         commit_count = 0
 
-        if not end_hash and not times:
-            commits = list(patch_repo.walk(patch_repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL))
-        else:
-            commits = self.commit_list(patch_repo, 'HEAD', end_hash, times)
-
-        for commit in commits:
-            patch_hash, original_hash = commit.hex, commit.parents[0].hex if commit.parents else None
-
-            commit_count += 1
-
-            if not original_hash:
-                empty_tree = original_repo.revparse_single(GIT_EMPTY_TREE_ID)
-
-            RepoManager.repo_to_commit(patch_repo, patch_hash)
-            if original_hash:
-                RepoManager.repo_to_commit(original_repo, original_hash)
-
-            diff = patch_repo.diff(original_repo.revparse_single('HEAD'),
-                                   patch_repo.revparse_single('HEAD') if original_hash else empty_tree, context_lines=0)
-            diff_summary = self.compute_diffs(diff, patch_hash)
-
-            updated_fn = diff_summary.updated_fn_count
-
-            if self.save_json:
-                diffs = diff_summary.diff_for_json()
-                if diffs:
-                    if self.track_json == 'loc':
-                        lines_no = 0
-                        for _, lines in diffs.items():
-                            lines_no += len(lines)
-                        updates_json[patch_hash] = lines_no
-                    elif self.track_json == 'diff':
-                        updates_json[patch_hash] = diffs
-
-            if not original_hash and skip_initial:
-                print('Skipping original commit...')
-                continue
+        # The scan continues from the same commit even if the branch moved since the interruption
+        start = state['start'] if state else str(repo.head.target)
+        if state:
+            updates_json = self.restore_checkpoint_data(state['data'])
+            commit_count = state['done']
 
-            if updated_fn in self.fn_updated_per_commit:
-                self.fn_updated_per_commit[updated_fn].append(patch_hash)
-            else:
-                self.fn_updated_per_commit[updated_fn] = [patch_hash]
+        # end_hash is part of the range
+        hide = RepoManager.resolve(repo, end_hash).parent_ids if end_hash else []
+        commits = RepoManager.commit_range(repo, pygit2.Oid(hex=start), hide, times)
 
-            if testing:
-                print('Seen %s commits out of %s' % (commit_count, len(commits)))
+        last_commit = state['last_commit'] if state else None
+        remaining = self.profiler.iterate('walk', skip_processed(commits, last_commit))
+        try:
+            for diff_summary in self.diff_commits(repo, remaining):
+                patch_hash = diff_summary.commit
+                commit = repo[patch_hash]
+                is_initial = not commit.parent_ids
+
+                commit_count += 1
+
+                updated_fn = diff_summary.updated_fn_count
+
+                if self.save_json:
+                    diffs = diff_summary.diff_for_json()
+                    if diffs:
+                        if self.track_json == 'loc':
+                            lines_no = 0
+                            for _, lines in diffs.items():
+                                lines_no += len(lines)
+                            updates_json[patch_hash] = lines_no
+                        elif self.track_json == 'diff':
+                            updates_json[patch_hash] = diffs
+
+                if is_initial and skip_initial:
+                    print('Skipping original commit...')
+                self.stats.append(patch_hash, commit.commit_time, updated_fn, *diff_summary.changed_line_counts(),
+                                  extensions=diff_summary.other_extensions, initial=is_initial)
+
+                last_commit = patch_hash
+                if checkpoint and checkpoint.due():
+                    checkpoint.save(start, last_commit, commit_count, self.checkpoint_data(updates_json))
+
+                if testing:
+                    print('Seen %s commits' % (commit_count,))
+        except BaseException:
+            if checkpoint and last_commit:
+                checkpoint.save(start, last_commit, commit_count, self.checkpoint_data(updates_json))
+            raise
 
         if self.save_json:
             with open('output.json', 'w') as fp:
                 json.dump(updates_json, fp)
 
-    def order_results(self, other=False):
-        target = None
-        if other:
-            target = self.other_changed.items()
-        else:
-            target = self.fn_updated_per_commit.items()
+        if checkpoint:
+            checkpoint.remove()
 
-        ordered = collections.OrderedDict(sorted(target))
+    # Commits per number of updated functions, the initial commit is left out with -i
+    @property
+    def fn_updated_per_commit(self):
+        return self.stats.commits_by_functions(self.skip_initial)
 
-        for fn_no, commits in ordered.items():
-            ordered[fn_no] = len(commits)
+    # Commits per extension of the changed files that are not analysed
+    @property
+    def other_changed(self):
+        return self.stats.commits_by_extension()
 
-        return ordered
+    def order_results(self, other=False):
+        if other:
+            return self.stats.extension_counts()
+        return self.stats.functions_histogram(self.skip_initial)
 
     @staticmethod
     def check_dirs():
@@ -651,17 +782,37 @@ class RepoManager:
                 fn_no))
         print('Commits seen: %s' % (s,))
 
-    @staticmethod
-    def initial_cleanup():
-        cwd = os.getcwd()
-        if (os.path.isdir('repo')):
-            shutil.rmtree(cwd + '/repo')
-        if (os.path.isdir('repo_prev')):
-            shutil.rmtree(cwd + '/repo_prev')
-
     def cleanup(self):
-        pass
+        if self.tagger:
+            self.tagger.pool.close()
+            self.tagger = None
+
+
+
+# State of a process analysing commits for RepoManager.diff_commits
+diff_worker = {}
+
 
+def init_diff_worker(repo_path, config):
+    tag_cache = tagcache.TagCache(*config['tag_cache']) if config['tag_cache'] else None
+    repo_manager = RepoManager(config['repo_url'], config['print_mode'], False, None, config['path_filter'],
+                               tag_cache=tag_cache, ctags_workers=config['ctags_workers'], analyzer=config['analyzer'],
+                               incremental=config['incremental'],
+                               profiler=profiling.Profiler(config['profile_top']) if config['profile_top'] else profiling.NULL)
+    diff_worker['repo'] = pygit2.Repository(repo_path)
+    diff_worker['manager'] = repo_manager
+
+    def shutdown():
+        repo_manager.cleanup()
+        if tag_cache:
+            tag_cache.close()
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=10)
+
+
+def diff_worker_task(commit_hash):
+    repo, repo_manager = diff_worker['repo'], diff_worker['manager']
+    diff_summary = repo_manager.diff_commit(repo, repo.revparse_single(commit_hash))
+    return diff_summary, repo_manager.profiler.snapshot()
 
 
 ##### Main program #####
@@ -672,10 +823,11 @@ def main(main_args):
 
     parser.add_argument('gitrepo', metavar='repo', help='git repo url or local path file:///')
     parser.add_argument('--revision', help='repository revision')
-    parser.add_argument('--print-mode', dest='print', choices=['full', 'simple', 'only-fn', 'functions'], default='full',
+    parser.add_argument('--print-mode', dest='print', choices=list(outputsink.SINKS), default='full',
                         help='print format')
     parser.add_argument('--with-hash', action='store_true', help='print git hashes in --print-mode=functions')
-    parser.add_argument('--only-added', action='store_true', help='print only added lines in --print-mode=functions')
+    parser.add_argument('--only-added', action='store_true',
+                        help='print only added lines in --print-mode=functions, simple, csv and jsonl')
     parser.add_argument('--verbose', action='store_true', help='display helpful progress messages')
     parser.add_argument('-s', '--summary', action='store_true', help='prints a summary of the data')
     parser.add_argument('-p', '--plot', action='store_true', help='save graphs of the generated data')
@@ -689,30 +841,116 @@ def main(main_args):
                         help='output function update information in JSON format')
     parser.add_argument('--track', dest='track', choices=['loc', 'diff'], default='diff', help='what data to save')
     parser.add_argument('--path-filter', dest='path_filter', help='restrict output to paths matched by filter')
+    parser.add_argument('--cache-dir', dest='cache_dir', help='directory of the persistent ctags cache')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=tagcache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        metavar='MB', help='maximum size of the ctags cache')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='do not use the ctags cache')
+    parser.add_argument('--mirror-dir', dest='mirror_dir', metavar='DIR',
+                        help='directory of the mirrors of remote repositories')
+    parser.add_argument('--ctags-workers', dest='ctags_workers', type=int, metavar='N',
+                        help='number of persistent ctags processes')
+    parser.add_argument('--analyzer', choices=analyzers.ANALYZERS, default=analyzers.DEFAULT_ANALYZER,
+                        help='how functions are extracted: universal-ctags or the built-in C scanner')
+    parser.add_argument('--incremental', action='store_true',
+                        help='derive the functions of a changed file from its previous version and the hunks')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='number of processes analysing commits in parallel')
+    parser.add_argument('--pipeline', nargs='?', type=int, const=commitpipeline.DEFAULT_DEPTH, default=0,
+                        metavar='DEPTH', help='overlap walking, diffing, analysing and printing of consecutive commits, '
+                                              'with at most DEPTH commits between two stages')
+    parser.add_argument('--checkpoint', metavar='FILE', help='periodically save the progress of -s/-p to FILE')
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval', type=int, default=30, metavar='SECONDS',
+                        help='seconds between checkpoints')
+    parser.add_argument('--resume', action='store_true', help='continue the scan saved in --checkpoint')
+    parser.add_argument('--stats-dir', dest='stats_dir', metavar='DIR',
+                        help='write the per-commit statistics of -s/-p to DIR')
+    parser.add_argument('--from-stats', dest='from_stats', metavar='DIR',
+                        help='compute -s/-p from the statistics in DIR instead of scanning the repository')
+    parser.add_argument('--function', metavar='NAME', help='print the history of function NAME of --file')
+    parser.add_argument('--file', metavar='PATH', help='file of --function')
+    parser.add_argument('--index', metavar='DB',
+                        help='record the changed functions of the commits not indexed yet in DB, see changeindex.py')
+    parser.add_argument('--profile', metavar='FILE', help='write a JSON report of the time spent in each stage to FILE')
+    parser.add_argument('--profile-top', dest='profile_top', type=int, default=profiling.DEFAULT_TOP, metavar='N',
+                        help='number of slowest commits and files in the --profile report')
 
     # Dictionary of arguments
     args_orig = parser.parse_args(main_args)
     args = vars(args_orig)
 
     # Handle printing
+    outputsink.buffer_stdout()
     OutputManager.should_print = bool(args['verbose'])
-    OutputManager.with_hash = bool(args['with_hash'])
-    OutputManager.only_added = bool(args['only_added'])
-
-    repo_manager = RepoManager(args['gitrepo'], args['print'], bool(args['json']), args['track'], args['path_filter'])
-
-    if args['revision']:
-        repo_manager.compare_patches_in_range(args['revision'],args['range'])
+    sink = outputsink.create_sink(args['print'], verbose=bool(args['verbose']), only_added=bool(args['only_added']),
+                                  with_hash=bool(args['with_hash']))
+
+    tag_cache = None
+    if not args['no_cache']:
+        tag_cache = tagcache.TagCache(args['cache_dir'], args['cache_size'] * 1024 * 1024)
+
+    profiler = profiling.for_report(args['profile'], args['profile_top'])
+
+    repo_manager = RepoManager(args['gitrepo'], args['print'], bool(args['json']), args['track'], args['path_filter'],
+                               tag_cache=tag_cache, ctags_workers=args['ctags_workers'], jobs=args['jobs'],
+                               analyzer=args['analyzer'], profiler=profiler, sink=sink, mirror_dir=args['mirror_dir'],
+                               incremental=args['incremental'], pipeline_depth=args['pipeline'])
+
+    if args['resume'] and not args['checkpoint']:
+        parser.error('--resume requires --checkpoint')
+    if args['pipeline'] and (args['jobs'] > 1 or args['incremental']):
+        parser.error('--pipeline cannot be combined with --jobs or --incremental')
+
+    checkpoint = None
+    if args['checkpoint']:
+        run = {'tool': 'diffanalyze', 'repo': args['gitrepo'], 'range': args['range'], 'rangeInt': args['rangeInt'],
+               'skip': args['skip'], 'json': args['json'], 'track': args['track'], 'path_filter': args['path_filter'],
+               'analyzer': args['analyzer']}
+        checkpoint = Checkpoint(args['checkpoint'], run, args['checkpoint_interval'])
+
+    if bool(args['function']) != bool(args['file']):
+        parser.error('--function and --file must be given together')
+
+    if args['function']:
+        repo_manager.function_history(args['function'], args['file'], args['revision'] or 'HEAD', args['range'])
+    elif args['index']:
+        try:
+            index = changeindex.ChangeIndex(args['index'], {'path_filter': args['path_filter']})
+        except changeindex.ChangeIndexError as e:
+            parser.error(str(e))
+        try:
+            commit_count = repo_manager.index_commits(index, args['revision'] or 'HEAD', args['range'],
+                                                      args['rangeInt'] or 0)
+            OutputManager.print('Indexed {} new commits, {} holds {commits} commits and {changes} function changes'
+                                .format(commit_count, args['index'], **index.stats()))
+        finally:
+            index.close()
+    elif args['revision']:
+        repo_manager.compare_patches_in_range(args['revision'], args['range'], args['rangeInt'] or 0)
+    elif args['from_stats']:
+        try:
+            repo_manager.stats, _ = statstore.CommitStats.load(args['from_stats'])
+        except statstore.StatsError as e:
+            parser.error(str(e))
+        repo_manager.skip_initial = args['skip']
     elif args['plot'] or args['summary']:
-        if args['range']:
-            repo_manager.get_updated_fn_per_commit(args['skip'], end_hash=args['range'])
-        elif args['rangeInt']:
-            repo_manager.get_updated_fn_per_commit(args['skip'], times=int(args['rangeInt']))
-        else:
-            repo_manager.get_updated_fn_per_commit(args['skip'])
+        try:
+            if args['range']:
+                repo_manager.get_updated_fn_per_commit(args['skip'], end_hash=args['range'], checkpoint=checkpoint,
+                                                       resume=args['resume'])
+            elif args['rangeInt']:
+                repo_manager.get_updated_fn_per_commit(args['skip'], times=int(args['rangeInt']),
+                                                       checkpoint=checkpoint, resume=args['resume'])
+            else:
+                repo_manager.get_updated_fn_per_commit(args['skip'], checkpoint=checkpoint, resume=args['resume'])
+        except CheckpointError as e:
+            parser.error(str(e))
+        if args['stats_dir']:
+            repo_manager.stats.save(args['stats_dir'], repo=args['gitrepo'], range=args['range'],
+                                    rangeInt=args['rangeInt'], path_filter=args['path_filter'])
 
     if args['summary']:
-        repo_manager.summary()
+        with profiler.stage('summary'):
+            repo_manager.summary()
 
     if args['plot']:
         assert(hasMatplotlib)
@@ -724,9 +962,14 @@ def main(main_args):
         repo_manager.plot_fn_per_commit_restricted(args['skip'], args['limit'])
         repo_manager.plot_other_changed(args['skip'])
 
-    OutputManager.print_all(args['print'] == 'only-fn')
+    with profiler.stage('print'):
+        sink.close()
     repo_manager.cleanup()
 
+    if tag_cache:
+        OutputManager.print('ctags cache: {hits} hits, {misses} misses'.format(**tag_cache.stats()))
+        tag_cache.close()
+
 
 if __name__ == '__main__':
     main(sys.argv[1:])
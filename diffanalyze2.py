@@ -1,29 +1,62 @@
 #!/usr/bin/env python3
-import contextlib
 import json
 import logging
-import shutil
-import subprocess
-import tempfile
+import multiprocessing
+import multiprocessing.util
+import time
 from collections import OrderedDict
-from pathlib import Path
 
 import pygit2
 import os
 import sys
 
+import analyzers
+import ctagspool
+import incremental
+import intervals
+import mirrors
+import profiling
+import tagcache
+from checkpoint import Checkpoint, CheckpointError, skip_processed
+
 GIT_EMPTY_TREE_ID = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
 
+# How merge commits are analysed:
+# - all: diff against every parent, as if each were a separate commit
+# - first-parent: diff against the first parent only, i.e. everything the merge brought into the mainline
+# - combined: only the lines that differ from every parent (`git diff -c`), e.g. conflict resolutions
+# - skip: leave merge commits out
+MERGE_POLICIES = ('all', 'first-parent', 'combined', 'skip')
+DEFAULT_MERGE_POLICY = 'all'
+
 
 class FileAnalyzer:
-    def __init__(self):
-        # find ctags
-        self.ctags = shutil.which('universalctags')
-        if not self.ctags:
-            self.ctags = shutil.which('ctags')
-        if not self.ctags:
-            raise FileNotFoundError(
-                "universalctags or ctags not found make sure its executable is available in the searchable path")
+    CTAGS_FLAGS = ['--quiet=yes',  # Don't print any additional info
+                   '--C-kinds=fp',  # Generate: function definitions (f), function prototypes (p),
+                   '--C++-kinds=fp',  # Generate: function definitions (f), function prototypes (p)
+                   '--fields=+ne',  # Add line number and end of type information in output
+                   '--languages=C,C++',  # Restrict to C and C++
+                   '--output-format=json']  # Output ctags format as json
+
+    # File name patterns universal-ctags maps to C and C++ by default (`ctags --list-maps=C,C++`)
+    SOURCE_EXTENSIONS = frozenset(['.c', '.c++', '.cc', '.cp', '.cpp', '.cxx', '.h', '.h++', '.hh', '.hp', '.hpp',
+                                   '.hxx', '.inl', '.C', '.H', '.CPP', '.CXX'])
+
+    @staticmethod
+    def handles(path):
+        """
+        Check whether ctags analyses the given file, without looking at its content
+        :param path: file name
+        :return: True for C and C++ sources
+        """
+        return os.path.splitext(path)[1] in FileAnalyzer.SOURCE_EXTENSIONS
+
+    def __init__(self, tag_cache=None, workers=None, analyzer=analyzers.DEFAULT_ANALYZER, profiler=profiling.NULL,
+                 incremental=False):
+        # find ctags and start the persistent ctags processes, or use the in-process scanner
+        self.profiler = profiler
+        self.pool, cache_flavour = analyzers.create_pool(analyzer, FileAnalyzer.CTAGS_FLAGS, workers, profiler)
+        self.tagger = ctagspool.BlobTagger(self.pool, tag_cache, cache_flavour, profiler, incremental)
 
     def analyse_file(self, path):
         """
@@ -33,104 +66,294 @@ class FileAnalyzer:
         """
         if not os.path.isfile(path):
             raise FileNotFoundError("File '{}' to analyse does not exist or is not accessible.".format(path))
-        proc = subprocess.Popen(
-            [self.ctags,
-             '--quiet=yes',  # Don't print any additional info
-             '--C-kinds=fp',  # Generate: function definitions (f), function prototypes (p),
-             '--C++-kinds=fp',  # Generate: function definitions (f), function prototypes (p)
-             '--fields=+ne',  # Add line number and end of type information in output
-             '--languages=C,C++',  # Restrict to C and C++
-             '--output-format=json',  # Output ctags format as json
-             path],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        out, err = proc.communicate()
-
-        if err:
-            raise RuntimeError(err.decode('utf-8'))
-
-        # ctags output format contains each entry as a dict per single line
-        # Parse each line independently
-        result = []
-        for line in out.decode('utf-8').split('\n'):
-            # skip empty lines - not parseable
-            if not len(line):
-                continue
-            result += [json.loads(line)]
+        with open(path, 'rb') as f:
+            result = self.pool.generate([(path, f.read())])[0]
+
+        if result is None:
+            raise RuntimeError("Failed to analyse '{}'".format(path))
         return result
 
-    def analyse_blob(self, blob, filename):
+    def prefetch(self, blobs):
+        """
+        Analyse the provided blobs with a single request to the ctags processes.
+        The results are returned by subsequent calls to `analyse_blob`
+        :param blobs: list of pygit2.Blob
+        :return:
+        """
+        self.tagger.prefetch([(blob.name, blob) for blob in blobs])
+
+    def analyse_blob(self, blob, filename, blob_id=None):
         """
         Analyse the provided blob and associated filename
         :param blob:
         :param filename:
+        :param blob_id: id of the blob, used to look up the result in the tag cache
         :return:
         """
-        # Create tempfile for analysis
-        with tempfile.NamedTemporaryFile(suffix=filename, dir=Path.home()) as tf:
-            # Write content
-            tf.write(blob)
-            tf.flush()
-            return self.analyse_file(tf.name)
+        if blob_id is None:
+            result = self.pool.generate([(filename, blob)])[0]
+        else:
+            result = self.tagger.tags(filename, ctagspool.BlobData(blob_id, blob))
 
+        if result is None:
+            raise RuntimeError("Failed to analyse '{}'".format(filename))
+        return result
+
+    def close(self):
+        self.pool.close()
 
-@contextlib.contextmanager
-def temporary_repository(url):
+
+def open_repository(url, mirror_dir=None, profiler=profiling.NULL):
     """
-    Create a temporary repository of the provided url if needed.
-    If the object goes out-of-scope remove the temporary directory
+    Open a local repository in place, or the mirror of a remote one (see mirrors.py).
+    The mirror is cloned on first use; later calls only fetch what is new upstream
 
-    :param url:
-    :return:
+    :param url: local path, file:// URL or URL of the remote
+    :param mirror_dir: directory of the mirrors, mirrors.default_mirror_dir() if None
+    :param profiler: receives the time spent cloning and fetching
+    :return: pygit2.Repository
     """
-    delete_on_exit = False
-    temporary_path = None
-    try:
-        if os.path.exists(url) and os.path.isdir(url):
-            logging.info("Use existing path {}...".format(url))
-            yield pygit2.Repository(url)
-        else:
-            temporary_path = tempfile.mkdtemp()
-            delete_on_exit = True
-            logging.info("Clone {} into {} ...".format(url, temporary_path))
-            repository_clone = pygit2.clone_repository(url, temporary_path)
-            yield repository_clone
-    finally:
-        if delete_on_exit and temporary_path:
-            # Remove the directory if requested
-            shutil.rmtree(temporary_path)
+    if mirrors.local_path(url) is not None:
+        logging.info("Use existing path {}...".format(url))
+        return mirrors.open_repository(url)
+
+    logging.info("Update mirror of {} in {} ...".format(url, mirrors.mirror_path(url, mirror_dir)))
+    with profiler.stage('clone'):
+        return mirrors.open_repository(url, mirror_dir)
+
+
+def generate_repository_changes(url, new_revision, old_revision, tag_cache=None, ctags_workers=None, jobs=1,
+                                checkpoint=None, resume=False, keep_results=True, analyzer=analyzers.DEFAULT_ANALYZER,
+                                profiler=profiling.NULL, mirror_dir=None, merges=DEFAULT_MERGE_POLICY,
+                                incremental=False):
+    """
+    Analyse the commits of a repository from the newest to the oldest
+    :param analyzer: backend extracting the functions, one of analyzers.ANALYZERS
+    :param profiler: profiling.Profiler collecting the time spent in each stage
+    :param checkpoint: Checkpoint to save the progress to, None to disable checkpoints
+    :param resume: continue after the last commit of the checkpoint
+    :param keep_results: store the results in the checkpoint and emit them again when resuming
+    :param mirror_dir: directory of the mirrors of remote repositories, see open_repository
+    :param merges: how merge commits are analysed, one of MERGE_POLICIES
+    :param incremental: derive the functions of a file from its version in the previously analysed commit
+    :return: generator of (commit id, commit change) tuples, each yielded as soon as it is computed
+    """
+    repository = open_repository(url, mirror_dir, profiler)
+    state = checkpoint.load() if checkpoint and resume else None
 
+    # Set start commit to parse from, a resumed scan keeps its original start
+    start_commit = repository.revparse_single(state['start'] if state else new_revision)
 
-def generate_repository_changes(url, new_revision, old_revision):
-    with temporary_repository(url) as repository:
-        # Set start commit to parse from
-        start_commit = repository.revparse_single(new_revision)
+    # Iterate from the newest commit to the oldest
+    walker = repository.walk(start_commit.id)  # type: pygit2.Walker
 
-        # Iterate from the newest commit to the oldest
-        walker = repository.walk(start_commit.id)  # type: pygit2.Walker
+    # Mark commit and ancestors as not interesting if provided
+    if old_revision:
+        end_commit = repository.revparse_single(old_revision)
+        walker.hide(end_commit.id)
 
-        # Mark commit and ancestors as not interesting if provided
-        if old_revision:
-            end_commit = repository.revparse_single(old_revision)
-            walker.hide(end_commit.id)
+    logging.info("Analyse")
 
-        fa = FileAnalyzer()
+    commits = walker
+    if merges == 'skip':
+        commits = (commit for commit in walker if len(commit.parent_ids) < 2)
+    commits = profiler.iterate('walk', skip_processed(commits, state['last_commit'] if state else None))
+    if jobs > 1:
+        results = analyse_commits_in_parallel(repository, commits, tag_cache, ctags_workers, jobs, analyzer,
+                                              profiler, merges, incremental)
+    else:
+        results = analyse_commits(repository, commits, tag_cache, ctags_workers, analyzer, profiler, merges,
+                                  incremental)
 
-        logging.info("Analyse")
+    if checkpoint:
+        results = checkpoint_results(results, checkpoint, str(start_commit.id), state, keep_results)
+    yield from results
+
+
+def analyse_commits(repository, commits, tag_cache, ctags_workers, analyzer, profiler,
+                    merges=DEFAULT_MERGE_POLICY, incremental=False):
+    fa = FileAnalyzer(tag_cache, ctags_workers, analyzer, profiler, incremental)
+
+    try:
+        for commit in commits:  # type: pygit2.Commit
+            commit_change = generate_commit_change(fa, repository, commit, merges)
+            yield str(commit.id), commit_change
+    finally:
+        fa.close()
+
+
+def checkpoint_results(results, checkpoint, start, state, keep_results):
+    """
+    Pass the results through, saving the progress periodically and when interrupted
+    :param results: generator of (commit id, commit change)
+    :param checkpoint: Checkpoint
+    :param start: id of the first commit of the scan
+    :param state: state loaded from the checkpoint when resuming, otherwise None
+    :param keep_results: store the results in the checkpoint and emit the stored ones first
+    :return: generator of (commit id, commit change)
+    """
+    done = state['done'] if state else 0
+    last_commit = state['last_commit'] if state else None
+    stored = 0
+    if keep_results:
+        if state and not isinstance(state['data'], dict):
+            raise CheckpointError('Checkpoint written by an older version, start the scan again without --resume')
+        stored = state['data']['results'] if state else 0
+        for commit_id, commit_change in checkpoint.load_results(stored):
+            yield commit_id, commit_change
+    # Results not in the results file of the checkpoint yet
+    pending = []
+
+    def save():
+        nonlocal stored
+        checkpoint.append_results(pending)
+        stored += len(pending)
+        pending.clear()
+        checkpoint.save(start, last_commit, done, {'results': stored} if keep_results else None)
 
-        changes = []
-        for commit in walker:  # type: pygit2.Commit
-            commit_change = generate_commit_change(fa, repository, commit)
-            changes.append((str(commit.id), commit_change))
+    try:
+        for commit_id, commit_change in results:
+            yield commit_id, commit_change
+            # The consumer has written the result when asking for the next one
+            last_commit = commit_id
+            done += 1
+            if keep_results:
+                pending.append((commit_id, commit_change))
+            if checkpoint.due():
+                save()
+    except BaseException:
+        if last_commit is not None:
+            save()
+        raise
+
+    checkpoint.remove()
+
+
+def write_results(results, out, output_format, profiler=profiling.NULL):
+    """
+    Write the commit changes while they are generated
+    :param results: iterable of (commit id, commit change)
+    :param out: text stream
+    :param output_format: `json` writes a single indented array, `jsonl` one compact array per line
+    :param profiler: receives the time spent writing
+    :return:
+    """
+    if output_format == 'jsonl':
+        for result in results:
+            start = time.perf_counter()
+            line = json.dumps(result) + '\n'
+            out.write(line)
+            out.flush()
+            profiler.add('output', time.perf_counter() - start, 1, len(line))
+        return
+
+    # Same bytes as json.dumps(list(results), indent=1), without keeping all the results in memory
+    separator = '[\n'
+    for result in results:
+        start = time.perf_counter()
+        record = separator + '\n'.join(' ' + line for line in json.dumps(result, indent=1).split('\n'))
+        out.write(record)
+        out.flush()
+        profiler.add('output', time.perf_counter() - start, 1, len(record))
+        separator = ',\n'
+    out.write('[]\n' if separator == '[\n' else '\n]\n')
+    out.flush()
+
+
+# State of a process started by analyse_commits_in_parallel
+worker_state = {}
+
+
+def init_worker(repository_path, cache_config, ctags_workers, analyzer, profile_top, log_level,
+                merges=DEFAULT_MERGE_POLICY, incremental=False):
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=log_level)
+    tag_cache = tagcache.TagCache(*cache_config) if cache_config else None
+    profiler = profiling.Profiler(profile_top) if profile_top else profiling.NULL
+    fa = FileAnalyzer(tag_cache, ctags_workers, analyzer, profiler, incremental)
+    worker_state['repository'] = pygit2.Repository(repository_path)
+    worker_state['fa'] = fa
+    worker_state['merges'] = merges
+
+    def shutdown():
+        fa.close()
+        if tag_cache:
+            tag_cache.close()
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=10)
+
+
+def analyse_commit_in_worker(commit_id):
+    repository = worker_state['repository']
+    commit = repository.revparse_single(commit_id)
+    fa = worker_state['fa']
+    return commit_id, generate_commit_change(fa, repository, commit, worker_state['merges']), fa.profiler.snapshot()
+
+
+def analyse_commits_in_parallel(repository, commits, tag_cache, ctags_workers, jobs, analyzer, profiler,
+                                merges=DEFAULT_MERGE_POLICY, incremental=False):
+    """
+    Analyse the commits with a pool of processes, each opening its own repository and ctags processes
+    :param repository:
+    :param commits: iterable of pygit2.Commit
+    :param tag_cache: the cache is shared with the workers through its directory
+    :param ctags_workers: number of ctags processes per worker
+    :param jobs: number of worker processes
+    :param analyzer: backend extracting the functions
+    :param profiler: merges the profiles of the workers
+    :param merges: how merge commits are analysed, one of MERGE_POLICIES
+    :param incremental: derive the functions of the files from their versions in the commit analysed before
+    :return: generator of (commit id, commit change), in the order of `commits`
+    """
+    cache_config = (tag_cache.cache_dir, tag_cache.max_size) if tag_cache else None
+    pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                initargs=(repository.path, cache_config, ctags_workers or 1, analyzer, profiler.top,
+                                          logging.getLogger().level, merges, incremental))
+    try:
+        for commit_id, commit_change, profile in pool.imap(analyse_commit_in_worker, (str(c.id) for c in commits),
+                                                           chunksize=4):
+            profiler.merge(profile)
+            yield commit_id, commit_change
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
-    return changes
 
-def generate_commit_change(fa, repository, commit):
+def generate_commit_change(fa, repository, commit, merges=DEFAULT_MERGE_POLICY):
     commit_change = {}
+    profiler = fa.profiler
+    commit_start = time.perf_counter()
+
+    # Only the new versions of C and C++ files can contain changed functions, skip the hunks of all other files
+    def analysed(delta):
+        return delta.status != pygit2.GIT_DELTA_DELETED and FileAnalyzer.handles(delta.new_file.path)
 
     # Get parent commit if available otherwise use an empty tree commit
-    for parent_commit in get_parent_or_empty_commit(repository, commit):
-        patch_summary = gather_diff_information(repository, parent_commit, commit)
+    parents = get_parent_or_empty_commit(repository, commit)
+    if merges == 'first-parent':
+        parents = parents[:1]
+    patch_summaries = [gather_diff_information(repository, parent_commit, commit, analysed, profiler)
+                       for parent_commit in parents]
+    if merges == 'combined' and len(patch_summaries) > 1:
+        patch_summaries = [combine_patch_summaries(patch_summaries)]
+
+    # Retrieve the new version of every changed file and analyse them all with a single request
+    file_blobs = {}
+    read_start = time.perf_counter()
+    for patch_summary in patch_summaries:
+        for single_change in patch_summary:
+            if "new_file" in single_change and single_change['new_file'] not in file_blobs:
+                file_blobs[single_change['new_file']] = retrieve_file_from_commit(commit, single_change['new_file'])
+    blobs = [blob for blob in file_blobs.values() if not isinstance(blob, pygit2.Commit)]
+    profiler.add('read_blob', time.perf_counter() - read_start, len(file_blobs), sum(blob.size for blob in blobs))
+    if fa.tagger.incremental and commit.parents:
+        register_parent_versions(fa, commit, file_blobs)
+    fa.prefetch(blobs)
+
+    # The functions of every file, shared by the patches against the different parents of a merge
+    file_functions = {}
+    for patch_summary in patch_summaries:
         logging.debug("Commit {}".format(commit.id))
 
         for single_change in patch_summary:
@@ -140,49 +363,30 @@ def generate_commit_change(fa, repository, commit):
                 continue
 
             file_name = single_change['new_file']
-            file_blob = retrieve_file_from_commit(commit, file_name)
+            file_blob = file_blobs[file_name]
 
             if isinstance(file_blob, pygit2.Commit):
                 logging.warning(
                     "Submodule update detected {} but currently not supported.".format(file_blob.name))
                 continue
 
-            # Extract all the functions from the file, their start and their end
-            # TODO Add name demangling to fully support C++
-            file_structure = fa.analyse_blob(file_blob.data, file_blob.name)
-            # Select name, start line and end line. `end line` might not be available assume large file
-            functions = [{'name': f.get('name'), 'start': f.get('line'), 'end': f.get('end')} for f in
-                         file_structure if f.get("kind", "") == "function"]
+            file_start = time.perf_counter()
+            if file_name not in file_functions:
+                file_functions[file_name] = extract_functions(fa, file_blob, commit)
+            functions, function_index = file_functions[file_name]
+            match_start = time.perf_counter()
+            profiler.add('function_index', match_start - file_start)
 
             # Iterate over all patch changes and check to which function they map
             for change in single_change['changes']:
                 # Skip removals
                 if change['add'] == -1:
                     continue
-                for f in functions:
-                    if not f['end']:
-                        logging.warning(
-                            "Function end for {} unknown in commit {}. Ignoring.".format(f['name'], commit.id))
-                        continue
-                    match = False
-                    change_start = change['add']
-                    change_end = change_start + change['nr']
-
-                    # Check if the beginning of patch inside of the function
-                    if f['start'] <= change_start <= f['end']:
-                        match = True
-
-                    # Check if the end of the patch is inside the function
-                    if f['start'] <= change_end <= f['end']:
-                        match = True
-
-                    # Check if the function is inside the patch
-                    if change_start <= f['start'] <= change_end:
-                        match = True
-
-                    if not match:
-                        continue
+                change_start = change['add']
+                change_end = change_start + change['nr']
 
+                # Functions overlapping the patch, in the order reported by ctags
+                for f in (functions[i] for i in function_index.overlapping(change_start, change_end)):
                     diff_entry = commit_change.setdefault(file_name, {}).setdefault(f['name'], [])
 
                     # Check if the last entry overlaps with this, in this case just update the end
@@ -194,9 +398,89 @@ def generate_commit_change(fa, repository, commit):
 
                     diff_entry.append(
                         (change_start, change_end))
+
+            file_end = time.perf_counter()
+            profiler.add('match', file_end - match_start)
+            profiler.record('files', file_end - file_start, commit=str(commit.id), file=file_name, bytes=file_blob.size)
+
+    fa.tagger.forget()
+    profiler.record('commits', time.perf_counter() - commit_start, commit=str(commit.id), files=len(file_blobs))
     return commit_change
 
 
+def register_parent_versions(fa, commit, file_blobs):
+    """
+    The walk goes from the newest commit to the oldest: let the versions of the files in the first parent be
+    derived from the versions of this commit when the parent is analysed (`--incremental`)
+    :param fa: FileAnalyzer
+    :param commit: pygit2.Commit with at least one parent
+    :param file_blobs: dict path -> pygit2.Blob of the changed files of this commit
+    """
+    parent = commit.parents[0]
+    for file_name, blob in file_blobs.items():
+        try:
+            parent_blob = retrieve_file_from_commit(parent, file_name)
+        except KeyError:
+            continue
+        if not isinstance(blob, pygit2.Blob) or not isinstance(parent_blob, pygit2.Blob) or parent_blob.id == blob.id:
+            continue
+        with fa.profiler.stage('patch'):
+            patch = blob.diff(parent_blob, context_lines=0)
+        fa.tagger.register_base(parent_blob.id, blob.id, incremental.hunks_from_patch(patch))
+
+
+def extract_functions(fa, file_blob, commit):
+    """
+    Extract all the functions from the file, their start and their end
+    :param fa: FileAnalyzer
+    :param file_blob: pygit2.Blob of the file
+    :param commit: commit the file belongs to, for the log
+    :return: (list of dicts with name, start and end, intervals.IntervalIndex of the functions)
+    """
+    # TODO Add name demangling to fully support C++
+    file_structure = fa.analyse_blob(file_blob.data, file_blob.name, file_blob.id)
+    # Select name, start line and end line. `end line` might not be available assume large file
+    functions = []
+    for f in file_structure:
+        if f.get("kind", "") != "function":
+            continue
+        if not f.get('end'):
+            logging.warning(
+                "Function end for {} unknown in commit {}. Ignoring.".format(f.get('name'), commit.id))
+            continue
+        functions.append({'name': f.get('name'), 'start': f.get('line'), 'end': f.get('end')})
+    return functions, intervals.IntervalIndex([(f['start'], f['end']) for f in functions])
+
+
+def combine_patch_summaries(patch_summaries):
+    """
+    Combine the patches of a merge against each of its parents, as `git diff -c` does: only the lines
+    added with respect to every parent are kept
+    :param patch_summaries: list of patch summaries, see gather_diff_information
+    :return: patch summary
+    """
+    added_per_parent = []
+    for patch_summary in patch_summaries:
+        added = {}
+        for single_change in patch_summary:
+            if 'new_file' not in single_change:
+                continue
+            lines = added.setdefault(single_change['new_file'], set())
+            for change in single_change['changes']:
+                if change['add'] != -1:
+                    lines.update(range(change['add'], change['add'] + change['nr']))
+        added_per_parent.append(added)
+
+    combined = []
+    for file_name, lines in added_per_parent[0].items():
+        for added in added_per_parent[1:]:
+            lines = lines & added.get(file_name, set())
+        if lines:
+            combined.append({'new_file': file_name,
+                             'changes': [{'add': line, 'remove': -1, 'nr': 1, 'origin': '+'} for line in sorted(lines)]})
+    return combined
+
+
 def retrieve_file_from_commit(commit, file_name) -> pygit2.Blob:
     """
     Retrieves the file associated with the commit
@@ -230,34 +514,44 @@ def get_parent_or_empty_commit(repository, child_commit):
     return child_commit.parents if len(child_commit.parents) else [repository.revparse_single(GIT_EMPTY_TREE_ID)]
 
 
-def gather_diff_information(repository, left_side_commit, right_side_commit):
+def gather_diff_information(repository, left_side_commit, right_side_commit, delta_filter=None,
+                            profiler=profiling.NULL):
     """
     Generate the diff information of two commits for the provided repository
     :param repository:
     :param left_side_commit:
     :param right_side_commit:
+    :param delta_filter: optional predicate on pygit2.DiffDelta, files it rejects are left out before
+                         their hunks are generated
+    :param profiler: receives the time spent diffing and generating hunks
     :return: list of commit summaries
     """
-    diff: pygit2.Diff = repository.diff(left_side_commit, right_side_commit, context_lines=0, flags=pygit2.GIT_DIFF_IGNORE_WHITESPACE)
+    with profiler.stage('diff'):
+        diff: pygit2.Diff = repository.diff(left_side_commit, right_side_commit, context_lines=0, flags=pygit2.GIT_DIFF_IGNORE_WHITESPACE)
 
     commit_summary = []
-    for patch in diff:  # type: pygit2.Patch
+    for index, delta in enumerate(diff.deltas):  # type: pygit2.DiffDelta
+        if delta_filter and not delta_filter(delta):
+            continue
+
         patch_summary = dict({'changes': []})
-        new_file: pygit2.DiffFile = patch.delta.new_file
-        old_file: pygit2.DiffFile = patch.delta.old_file
+        new_file: pygit2.DiffFile = delta.new_file
+        old_file: pygit2.DiffFile = delta.old_file
 
         # Check if the file has been deleted, in that case `new_file` won't be set
-        if patch.delta.status != pygit2.GIT_DELTA_DELETED:
+        if delta.status != pygit2.GIT_DELTA_DELETED:
             patch_summary['new_file'] = new_file.path
 
         # If the file has just been added, `old_file` won't be set
-        if patch.delta.status != pygit2.GIT_DELTA_ADDED:
+        if delta.status != pygit2.GIT_DELTA_ADDED:
             patch_summary['old_file'] = old_file.path
 
-        for hunk in patch.hunks:  # type: pygit2.DiffHunk
-            for line in hunk.lines:  # type: pygit2.DiffLine
-                patch_summary['changes'].append(
-                    {'add': line.new_lineno, 'remove': line.old_lineno, 'nr': line.num_lines, 'origin': line.origin})
+        with profiler.stage('patch'):
+            patch: pygit2.Patch = diff[index]
+            for hunk in patch.hunks:  # type: pygit2.DiffHunk
+                for line in hunk.lines:  # type: pygit2.DiffLine
+                    patch_summary['changes'].append(
+                        {'add': line.new_lineno, 'remove': line.old_lineno, 'nr': line.num_lines, 'origin': line.origin})
 
         commit_summary.append(patch_summary)
     return commit_summary
@@ -272,16 +566,74 @@ def main(main_args):
     parser.add_argument('--new-revision', help='newest target revision (including) [HEAD]', default="HEAD")
     parser.add_argument('--old-revision', help='oldest target revision (excluding) [First]', default=None)
     parser.add_argument('--log', help='Set the log level', default="WARNING")
+    parser.add_argument('--cache-dir', help='directory of the persistent ctags cache', default=None)
+    parser.add_argument('--cache-size', help='maximum size of the ctags cache in MB', type=int,
+                        default=tagcache.DEFAULT_MAX_SIZE // (1024 * 1024))
+    parser.add_argument('--no-cache', help='do not use the ctags cache', action='store_true')
+    parser.add_argument('--mirror-dir', help='directory of the mirrors of remote repositories', default=None)
+    parser.add_argument('--ctags-workers', help='number of persistent ctags processes', type=int, default=None)
+    parser.add_argument('--analyzer', help='how functions are extracted: universal-ctags or the built-in C scanner',
+                        choices=analyzers.ANALYZERS, default=analyzers.DEFAULT_ANALYZER)
+    parser.add_argument('-j', '--jobs', help='number of processes analysing commits in parallel', type=int, default=1)
+    parser.add_argument('--merges', help='how merge commits are analysed: against each parent, against the first '
+                                         'parent, only lines differing from all parents, or not at all',
+                        choices=MERGE_POLICIES, default=DEFAULT_MERGE_POLICY)
+    parser.add_argument('--incremental', help='derive the functions of a changed file from its version in the '
+                                              'previously analysed commit and the hunks', action='store_true')
+    parser.add_argument('--format', help='output format: json array or one json record per line', dest='output_format',
+                        choices=['json', 'jsonl'], default='json')
+    parser.add_argument('--checkpoint', help='file to periodically save the progress of the scan to', default=None)
+    parser.add_argument('--checkpoint-interval', help='seconds between checkpoints', type=int, default=30)
+    parser.add_argument('--resume', help='continue the scan saved in --checkpoint; with jsonl only the remaining '
+                                         'commits are written', action='store_true')
+    parser.add_argument('--profile', help='file to write a JSON report of the time spent in each stage to',
+                        default=None)
+    parser.add_argument('--profile-top', help='number of slowest commits and files in the --profile report', type=int,
+                        default=profiling.DEFAULT_TOP)
     args = parser.parse_args(main_args)
 
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+
     # Setup logging
     numeric_level = getattr(logging, args.log.upper())
     if not isinstance(numeric_level, int):
         raise ValueError('Invalid log level: %s' % args.log)
     logging.basicConfig(format='%(levelname)s:%(message)s', level=numeric_level)
 
-    results = generate_repository_changes(args.repo, args.new_revision, args.old_revision)
-    print(json.dumps(results, indent=1))
+    tag_cache = None if args.no_cache else tagcache.TagCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    checkpoint = None
+    if args.checkpoint:
+        run = {'tool': 'diffanalyze2', 'repo': args.repo, 'new_revision': args.new_revision,
+               'old_revision': args.old_revision, 'format': args.output_format,
+               'analyzer': args.analyzer, 'merges': args.merges}
+        checkpoint = Checkpoint(args.checkpoint, run, args.checkpoint_interval)
+
+    profiler = profiling.for_report(args.profile, args.profile_top)
+
+    results = generate_repository_changes(args.repo, args.new_revision, args.old_revision, tag_cache,
+                                          args.ctags_workers, args.jobs, checkpoint, args.resume,
+                                          keep_results=args.output_format == 'json', analyzer=args.analyzer,
+                                          profiler=profiler, mirror_dir=args.mirror_dir, merges=args.merges,
+                                          incremental=args.incremental)
+    status = 0
+    try:
+        write_results(results, sys.stdout, args.output_format, profiler)
+    except CheckpointError as e:
+        parser.error(str(e))
+    except BrokenPipeError:
+        # The reader stopped early, e.g. `| head`. Python flushes stdout again when exiting, which must not fail too
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        # Saves the checkpoint and stops the analyzers
+        results.close()
+        status = 1
+
+    if tag_cache:
+        logging.info("ctags cache: {hits} hits, {misses} misses".format(**tag_cache.stats()))
+        tag_cache.close()
+    if status:
+        sys.exit(status)
 
 
 if __name__ == '__main__':
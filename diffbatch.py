@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Batch mode: analyse many repositories listed in a manifest.
+
+The manifest is a JSON Lines file, one repository per line (empty lines and
+lines starting with `#` are ignored):
+
+    {"repo": "https://git.savannah.gnu.org/git/findutils.git", "range": "v4.6.0"}
+    {"repo": "/src/zlib", "name": "zlib", "revision": "develop", "times": 50}
+
+- `repo`: URL or local path, required
+- `name`: name of the result file, by default the last part of `repo`; characters
+  other than letters, digits, `.`, `_` and `-` are replaced by `_`
+- `revision`: newest commit to analyse, HEAD by default
+- `range`: oldest commit, excluded, like `--range` of diffanalyze
+- `times`: number of commits to analyse instead of `range`, like `-ri`
+- `path_filter`: like `--path-filter`
+
+Without `range` and `times` only `revision` is compared with its parent.
+The repositories are analysed by `--jobs` processes. Each process keeps its
+analyzer across the repositories it handles, all processes share the tag
+cache and the mirrors of remote repositories, and nothing is written to the
+current directory. Every repository gets its own result file in the output
+directory, `summary.json` describes the whole run.
+"""
+import argparse
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import re
+import sys
+import time
+
+import analyzers
+import diffanalyze
+import outputsink
+import tagcache
+
+ENTRY_FIELDS = frozenset(['repo', 'name', 'revision', 'range', 'times', 'path_filter'])
+
+EXTENSIONS = {'csv': '.csv', 'jsonl': '.jsonl'}
+
+SUMMARY_FILE = 'summary.json'
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def safe_name(name):
+    # Names are joined to the output directory: no path separators, no '..'
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', name)
+    return '_' + name if name.strip('.') == '' else name
+
+
+def default_name(repo):
+    name = os.path.basename(repo.rstrip('/'))
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    return safe_name(name) if name else 'repo'
+
+
+def read_manifest(path):
+    """
+    Read and check a manifest, see the module documentation
+    :return: list of entry dicts, each with a unique `name`
+    """
+    entries = []
+    names = set()
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ManifestError('{}:{}: {}'.format(path, number, e))
+            if not isinstance(entry, dict) or 'repo' not in entry:
+                raise ManifestError("{}:{}: an object with a 'repo' is expected".format(path, number))
+            unknown = set(entry) - ENTRY_FIELDS
+            if unknown:
+                raise ManifestError('{}:{}: unknown fields {}'.format(path, number, ', '.join(sorted(unknown))))
+
+            name = safe_name(str(entry['name'])) if entry.get('name') else default_name(entry['repo'])
+            unique, count = name, 1
+            while unique in names:
+                count += 1
+                unique = '{}-{}'.format(name, count)
+            names.add(unique)
+            entries.append(dict(entry, name=unique))
+    return entries
+
+
+# State of a process analysing repositories
+batch_worker = {}
+
+
+def init_batch_worker(config):
+    batch_worker['config'] = config
+    batch_worker['tag_cache'] = tagcache.TagCache(*config['tag_cache']) if config['tag_cache'] else None
+    # Started by the first repository, used by all the following ones
+    batch_worker['tagger'] = None
+
+    def shutdown():
+        if batch_worker['tagger']:
+            batch_worker['tagger'].pool.close()
+        if batch_worker['tag_cache']:
+            batch_worker['tag_cache'].close()
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=10)
+
+
+def analyse_repository(entry):
+    """
+    Analyse the commits of one manifest entry and write them to its result file
+    :return: dict describing the result, an entry of the run summary
+    """
+    config = batch_worker['config']
+    print_mode = config['print_mode']
+    output = os.path.join(config['output_dir'], entry['name'] + EXTENSIONS.get(print_mode, '.txt'))
+    result = {'name': entry['name'], 'repo': entry['repo'], 'output': os.path.basename(output)}
+    start = time.perf_counter()
+    try:
+        with open(output, 'w') as f:
+            options = {}
+            if print_mode == 'only-fn':
+                options['functions_file'] = os.path.join(config['output_dir'], entry['name'] + '.updated_functions')
+            sink = outputsink.create_sink(print_mode, stream=f, colour=False, only_added=config['only_added'],
+                                          with_hash=config['with_hash'], **options)
+            manager = diffanalyze.RepoManager(entry['repo'], print_mode, False, None, entry.get('path_filter'),
+                                              tag_cache=batch_worker['tag_cache'],
+                                              ctags_workers=config['ctags_workers'], analyzer=config['analyzer'],
+                                              sink=sink, mirror_dir=config['mirror_dir'],
+                                              incremental=config['incremental'], tagger=batch_worker['tagger'],
+                                              prompt=False)
+            try:
+                result['commits'] = manager.compare_patches_in_range(entry.get('revision', 'HEAD'),
+                                                                     entry.get('range'), entry.get('times', 0))
+            finally:
+                sink.close()
+                batch_worker['tagger'] = manager.tagger
+        result['status'] = 'ok'
+    except (Exception, SystemExit) as e:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(entries, config, jobs=1):
+    """
+    Analyse the repositories of a manifest
+    :param entries: list of entries of read_manifest
+    :param config: settings shared by all the repositories, see main
+    :param jobs: number of repositories analysed at the same time, each by its own process
+    :return: generator of the result of every repository, in the order they complete
+    """
+    if jobs <= 1 or len(entries) <= 1:
+        init_batch_worker(config)
+        for entry in entries:
+            yield analyse_repository(entry)
+        return
+
+    outputsink.flush_before_fork()
+    pool = multiprocessing.Pool(min(jobs, len(entries)), initializer=init_batch_worker, initargs=(config,))
+    try:
+        yield from pool.imap_unordered(analyse_repository, entries)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def main(main_args):
+    parser = argparse.ArgumentParser(description='Analyses the repositories listed in a manifest.')
+    parser.add_argument('manifest', help='JSON Lines file, one repository per line')
+    parser.add_argument('-o', '--output-dir', dest='output_dir', required=True, metavar='DIR',
+                        help='directory of the result files and of ' + SUMMARY_FILE)
+    parser.add_argument('--print-mode', dest='print', choices=list(outputsink.SINKS), default='jsonl',
+                        help='format of the result files')
+    parser.add_argument('--with-hash', action='store_true', help='print git hashes in --print-mode=functions')
+    parser.add_argument('--only-added', action='store_true',
+                        help='print only added lines in --print-mode=functions, simple, csv and jsonl')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='number of repositories analysed at the same time')
+    parser.add_argument('--ctags-workers', dest='ctags_workers', type=int, default=1, metavar='N',
+                        help='number of persistent ctags processes of every job')
+    parser.add_argument('--analyzer', choices=analyzers.ANALYZERS, default=analyzers.DEFAULT_ANALYZER,
+                        help='how functions are extracted: universal-ctags or the built-in C scanner')
+    parser.add_argument('--incremental', action='store_true',
+                        help='derive the functions of a changed file from its previous version and the hunks')
+    parser.add_argument('--cache-dir', dest='cache_dir', help='directory of the persistent ctags cache')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=tagcache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        metavar='MB', help='maximum size of the ctags cache')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='do not use the ctags cache')
+    parser.add_argument('--mirror-dir', dest='mirror_dir', metavar='DIR',
+                        help='directory of the mirrors of remote repositories')
+    args = vars(parser.parse_args(main_args))
+
+    try:
+        entries = read_manifest(args['manifest'])
+    except (OSError, ManifestError) as e:
+        parser.error(str(e))
+    os.makedirs(args['output_dir'], exist_ok=True)
+
+    tag_cache = None
+    if not args['no_cache']:
+        # Opened here so that the cache directory exists before the workers start
+        tag_cache = tagcache.TagCache(args['cache_dir'], args['cache_size'] * 1024 * 1024)
+    config = {
+        'output_dir': args['output_dir'],
+        'print_mode': args['print'],
+        'only_added': args['only_added'],
+        'with_hash': args['with_hash'],
+        'ctags_workers': args['ctags_workers'],
+        'analyzer': args['analyzer'],
+        'incremental': args['incremental'],
+        'mirror_dir': args['mirror_dir'],
+        'tag_cache': (tag_cache.cache_dir, tag_cache.max_size) if tag_cache else None,
+    }
+    if tag_cache:
+        tag_cache.close()
+
+    start = time.perf_counter()
+    results = []
+    for result in run_batch(entries, config, args['jobs']):
+        results.append(result)
+        if result['status'] == 'ok':
+            print('{name}: {commits} commits in {seconds}s'.format(**result))
+        else:
+            print('{name}: failed: {error}'.format(**result))
+        sys.stdout.flush()
+
+    # In the order of the manifest
+    order = {entry['name']: i for i, entry in enumerate(entries)}
+    results.sort(key=lambda result: order[result['name']])
+    failed = sum(result['status'] != 'ok' for result in results)
+    summary = {
+        'manifest': os.path.abspath(args['manifest']),
+        'seconds': round(time.perf_counter() - start, 3),
+        'repositories': len(results),
+        'failed': failed,
+        'commits': sum(result.get('commits', 0) for result in results),
+        'results': results,
+    }
+    with open(os.path.join(args['output_dir'], SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
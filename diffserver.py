@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Server mode: answer the queries of diffanalyze from a long-running process.
+
+Running `diffanalyze.py --revision X` once per commit pays every time for the
+start of Python, the imports, opening (or fetching) the repository and
+analysing the files again. The server opens its repositories once, keeps the
+ctags processes running and the tags of recently analysed blobs in memory (in
+front of the persistent tag cache), and answers HTTP requests on a TCP port
+or a Unix socket:
+
+    GET /changes?revision=X[&range=A | &times=N][&print_mode=simple][&only_added=1]
+                [&with_hash=1][&path_filter=REGEX][&repo=URL]
+    GET /stats
+
+`/changes` returns what `diffanalyze.py REPO --revision X [--range A | -ri N]
+--print-mode MODE` prints; `revision=A..B` is the same as `revision=B&range=A`.
+`repo` selects one of the served repositories and may be left out when there
+is only one. `/stats` returns the state of the server as JSON.
+
+The mirror of a remote repository is fetched before resolving a branch, a tag
+or HEAD, unless it was fetched less than `--fetch-interval` seconds ago. A
+commit hash cannot move: the mirror is only fetched when it does not have the
+commit yet.
+
+Requests are handled concurrently, each in its own thread. The git work on a
+repository (walk, diff, blob reads) is serialised by a lock per repository;
+the analysis and the matching of different requests run in parallel.
+"""
+import argparse
+import collections
+import http.server
+import io
+import json
+import os
+import re
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+import pygit2
+
+import analyzers
+import ctagspool
+import diffanalyze
+import mirrors
+import outputsink
+import tagcache
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8421
+DEFAULT_FETCH_INTERVAL = 60
+
+# A full or abbreviated commit hash, possibly followed by ancestry operators (abc123~2)
+HASH_PATTERN = re.compile(r'([0-9a-fA-F]{4,40})(?:[~^][0-9]*)*$')
+
+# Commits of a range read from the repository and analysed together
+CHUNK_SIZE = 64
+
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+TRUE_VALUES = frozenset(['1', 'true', 'yes', 'on'])
+
+
+class QueryError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Repository:
+    """
+    A served repository: the pygit2.Repository and the lock serialising the work on it
+    """
+
+    def __init__(self, url, mirror_dir=None, fetch_interval=DEFAULT_FETCH_INTERVAL):
+        self.url = url
+        self.mirror_dir = mirror_dir
+        self.fetch_interval = fetch_interval
+        self.lock = threading.Lock()
+        self.manager = diffanalyze.RepoManager(url, 'simple', False, None, None, mirror_dir=mirror_dir, prompt=False)
+        self.repo = self.manager.open_repo()
+        self.remote = mirrors.local_path(url) is None
+        # open_repo fetched the mirror
+        self.fetched = time.monotonic()
+
+    def refresh(self, max_age=0):
+        """
+        Fetch what is new upstream. Local repositories are read in place
+        :param max_age: seconds, the mirror is not fetched if it was fetched more recently
+        :return: True if the repository was fetched
+        """
+        if not self.remote or time.monotonic() - self.fetched < max_age:
+            return False
+        try:
+            self.repo = mirrors.open_mirror(self.url, self.mirror_dir)
+        except pygit2.GitError as e:
+            raise QueryError(502, 'Cannot fetch {}: {}'.format(self.url, e))
+        self.fetched = time.monotonic()
+        return True
+
+
+class AnalysisServer:
+    """
+    The state shared by all requests: repositories, analyzer and cached tags
+    """
+
+    def __init__(self, urls, analyzer=analyzers.DEFAULT_ANALYZER, ctags_workers=None, tag_cache=None,
+                 memory_entries=tagcache.DEFAULT_MEMORY_ENTRIES, mirror_dir=None,
+                 fetch_interval=DEFAULT_FETCH_INTERVAL):
+        """
+        :param urls: URLs or paths of the served repositories, opened (cloned or fetched) right away
+        :param analyzer: one of analyzers.ANALYZERS
+        :param ctags_workers: number of ctags processes shared by all requests
+        :param tag_cache: tagcache.TagCache opened with threads=True, or None
+        :param memory_entries: number of tag lists kept in memory
+        :param mirror_dir: directory of the mirrors of remote repositories
+        :param fetch_interval: seconds during which the references of a fetched mirror are used as they are
+        """
+        self.repositories = collections.OrderedDict((url, Repository(url, mirror_dir, fetch_interval))
+                                                    for url in urls)
+        self.pool, self.cache_flavour = analyzers.create_pool(analyzer, diffanalyze.FileDifferences.CTAGS_FLAGS,
+                                                              ctags_workers)
+        self.cache = tagcache.MemoryTagCache(memory_entries, tag_cache)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.commits = 0
+
+    def repository(self, url):
+        if url is None:
+            if len(self.repositories) != 1:
+                raise QueryError(400, "'repo' is required, this server serves several repositories")
+            return next(iter(self.repositories.values()))
+        if url not in self.repositories:
+            raise QueryError(404, "Repository '{}' is not served".format(url))
+        return self.repositories[url]
+
+    def changes(self, params):
+        """
+        Answer a /changes request
+        :param params: dict of the query parameters
+        :return: (content type, text)
+        """
+        revision = params.get('revision')
+        if not revision:
+            raise QueryError(400, "'revision' is required")
+        end_revision = params.get('range')
+        if '..' in revision and not end_revision:
+            end_revision, revision = revision.split('..', 1)
+            revision = revision or 'HEAD'
+        try:
+            times = int(params.get('times', 0))
+        except ValueError:
+            raise QueryError(400, "'times' must be a number")
+        print_mode = params.get('print_mode', 'simple')
+        if print_mode not in outputsink.SINKS:
+            raise QueryError(400, "Unknown print mode '{}'".format(print_mode))
+        if params.get('path_filter'):
+            try:
+                re.compile(params['path_filter'])
+            except re.error as e:
+                raise QueryError(400, "Invalid 'path_filter': {}".format(e))
+
+        repository = self.repository(params.get('repo'))
+        out = io.StringIO()
+        options = {'functions_file': None} if print_mode == 'only-fn' else {}
+        sink = outputsink.create_sink(print_mode, stream=out, colour=False,
+                                      only_added=params.get('only_added', '').lower() in TRUE_VALUES,
+                                      with_hash=params.get('with_hash', '').lower() in TRUE_VALUES, **options)
+        # Every request has its own tagger, they share the ctags processes and the cached tags
+        tagger = ctagspool.BlobTagger(self.pool, self.cache, self.cache_flavour)
+        manager = diffanalyze.RepoManager(repository.url, print_mode, False, None, params.get('path_filter'),
+                                          sink=sink, tagger=tagger)
+
+        with repository.lock:
+            commits = self.revision_range(repository, revision, end_revision, times)
+        for first in range(0, len(commits), CHUNK_SIZE):
+            with repository.lock:
+                prepared = [manager.prepare_commit(repository.repo, commit)
+                            for commit in commits[first:first + CHUNK_SIZE]]
+            tagger.prefetch([entry for _, changed_files in prepared
+                             for entry in diffanalyze.RepoManager.blobs_to_tag(changed_files)])
+            for diff_summary, changed_files in prepared:
+                sink.write(manager.match_diffs(diff_summary, changed_files, tagger))
+            tagger.forget()
+        sink.close()
+
+        with self.lock:
+            self.requests += 1
+            self.commits += len(commits)
+        return CONTENT_TYPES.get(print_mode, 'text/plain'), out.getvalue()
+
+    @staticmethod
+    def revision_range(repository, revision, end_revision, times):
+        fetched = False
+        if not all(AnalysisServer.is_commit_id(repository.repo, name) for name in (revision, end_revision) if name):
+            # References move upstream
+            fetched = repository.refresh(repository.fetch_interval)
+        for attempt in range(2):
+            try:
+                return list(diffanalyze.RepoManager.revision_range(repository.repo, revision, end_revision, times))
+            except KeyError as e:
+                # Unknown revision: it may be new upstream
+                if attempt or fetched or not repository.refresh():
+                    raise QueryError(404, 'Unknown revision {}'.format(e))
+            except (ValueError, pygit2.GitError) as e:
+                raise QueryError(400, 'Invalid revision: {}'.format(e))
+
+    @staticmethod
+    def is_commit_id(repo, revision):
+        """
+        :return: True if the revision is the id of a commit of the repository, or relative to one (abc123~2).
+                 A fetch cannot move it, unlike a branch or a tag, even one with a hexadecimal name
+        """
+        match = HASH_PATTERN.match(revision)
+        if not match:
+            return False
+        prefix = match.group(1).lower()
+        try:
+            repo.lookup_reference_dwim(prefix)
+            return False
+        except (KeyError, pygit2.InvalidSpecError):
+            pass
+        try:
+            return str(repo.revparse_single(prefix).id).startswith(prefix)
+        except (KeyError, ValueError, pygit2.GitError):
+            # Unknown or ambiguous
+            return False
+
+    def stats(self):
+        with self.lock:
+            requests, commits = self.requests, self.commits
+        return {
+            'repositories': list(self.repositories),
+            'requests': requests,
+            'commits': commits,
+            'analysed_files': self.pool.calls,
+            'tags_in_memory': self.cache.stats(),
+        }
+
+    def close(self):
+        self.pool.close()
+        self.cache.close()
+
+
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'diffanalyze'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        analysis = self.server.analysis
+        try:
+            if url.path == '/changes':
+                content_type, text = analysis.changes(params)
+            elif url.path == '/stats':
+                content_type, text = 'application/json', json.dumps(analysis.stats()) + '\n'
+            else:
+                raise QueryError(404, "Unknown path '{}'".format(url.path))
+            status = 200
+        except QueryError as e:
+            status, content_type, text = e.status, 'text/plain', str(e) + '\n'
+        except Exception as e:
+            status, content_type, text = 500, 'text/plain', '{}: {}\n'.format(type(e).__name__, e)
+
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(analysis, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False):
+    """
+    Create the server answering the requests, see serve_forever of socketserver
+    :param analysis: AnalysisServer
+    :param socket_path: listen on this Unix socket instead of a TCP port
+    """
+    if socket_path:
+        # Left over by a previous server
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        server = UnixServer(socket_path, QueryHandler)
+    else:
+        server = TCPServer((host, port), QueryHandler)
+    server.analysis = analysis
+    server.verbose = verbose
+    return server
+
+
+def main(main_args):
+    parser = argparse.ArgumentParser(description='Answers diffanalyze queries over HTTP, keeping repositories and '
+                                                 'analysis results in memory.')
+    parser.add_argument('repos', metavar='repo', nargs='+', help='git repo url or local path file:/// to serve')
+    parser.add_argument('--socket', metavar='PATH', help='listen on a Unix socket instead of a TCP port')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--analyzer', choices=analyzers.ANALYZERS, default=analyzers.DEFAULT_ANALYZER,
+                        help='how functions are extracted: universal-ctags or the built-in C scanner')
+    parser.add_argument('--ctags-workers', dest='ctags_workers', type=int, metavar='N',
+                        help='number of persistent ctags processes')
+    parser.add_argument('--memory-entries', dest='memory_entries', type=int, default=tagcache.DEFAULT_MEMORY_ENTRIES,
+                        metavar='N', help='number of analysed file versions kept in memory')
+    parser.add_argument('--cache-dir', dest='cache_dir', help='directory of the persistent ctags cache')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=tagcache.DEFAULT_MAX_SIZE // (1024 * 1024),
+                        metavar='MB', help='maximum size of the ctags cache')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='do not use the ctags cache')
+    parser.add_argument('--mirror-dir', dest='mirror_dir', metavar='DIR',
+                        help='directory of the mirrors of remote repositories')
+    parser.add_argument('--fetch-interval', dest='fetch_interval', type=float, default=DEFAULT_FETCH_INTERVAL,
+                        metavar='SECONDS', help='minimum time between two fetches of a remote repository resolving '
+                                                'a branch, tag or HEAD; 0 fetches for every request')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = vars(parser.parse_args(main_args))
+
+    tag_cache = None
+    if not args['no_cache']:
+        tag_cache = tagcache.TagCache(args['cache_dir'], args['cache_size'] * 1024 * 1024, threads=True)
+    try:
+        analysis = AnalysisServer(args['repos'], args['analyzer'], args['ctags_workers'], tag_cache,
+                                  args['memory_entries'], args['mirror_dir'], args['fetch_interval'])
+    except FileNotFoundError:
+        sys.exit('package universal-ctags not found.')
+
+    server = create_server(analysis, args['socket'], args['host'], args['port'], args['verbose'])
+    where = args['socket'] or 'http://{}:{}'.format(*server.server_address[:2])
+    sys.stderr.write('Serving {} on {}\n'.format(', '.join(args['repos']), where))
+    # Stopped by a service manager: clean up as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        analysis.close()
+        if args['socket'] and os.path.exists(args['socket']):
+            os.unlink(args['socket'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
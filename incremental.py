@@ -0,0 +1,183 @@
+"""
+Incremental function boundaries (`--incremental`).
+
+When a new version of a file differs from a version whose tags are known by a
+few hunks, most functions are unchanged: they only move by the number of lines
+added or removed above them. `plan` shifts the tags of those functions and
+cuts out the regions around the hunks; only these regions are analysed again
+and `Derivation.finish` puts the result together.
+
+The regions always lie between two unchanged top level definitions, so they
+can be analysed on their own. Whenever that is in doubt the derivation is
+abandoned and the whole file is analysed, i.e. when:
+- a changed line contains a preprocessor directive, a block comment delimiter
+  or a line continuation, which can change how the unchanged code is parsed
+- the braces of a region do not balance, a region does not end with a complete
+  declaration (`;` or `}`), which would continue into the unchanged code after
+  it, or a region contains a conditional preprocessor directive
+- a function found in a region does not end inside it
+- a tag of the known version has no end line
+- the regions add up to more than MAX_REANALYSED of the file
+
+A hunk is a tuple (base start, base lines, target start, target lines, text),
+the first four as in a unified diff without context and `text` the content of
+the removed and added lines.
+"""
+import re
+
+# Above this share of reanalysed lines, analysing the whole file is as cheap
+MAX_REANALYSED = 0.5
+
+_UNSAFE_RE = re.compile(rb'#|/\*|\*/|\\\s*$', re.MULTILINE)
+
+_CONDITIONAL_RE = re.compile(rb'^[ \t]*#[ \t]*(?:if|el|endif)', re.MULTILINE)
+
+_COMMENT_RE = re.compile(rb'//[^\n]*|/\*.*?\*/', re.DOTALL)
+
+_BRACES_RE = re.compile(rb'''
+      //[^\n]*
+    | /\*.*?\*/
+    | "(?:\\.|[^"\\\n])*"
+    | '(?:\\.|[^'\\\n])*'
+    | (?P<open>\{)
+    | (?P<close>\})
+''', re.VERBOSE | re.DOTALL)
+
+
+def hunks_from_patch(patch):
+    """
+    :param patch: pygit2.Patch without context lines, from the base to the target version
+    :return: list of hunk tuples, see the module documentation
+    """
+    return [(hunk.old_start, hunk.old_lines, hunk.new_start, hunk.new_lines,
+             b''.join(line.raw_content for line in hunk.lines))
+            for hunk in patch.hunks]
+
+
+def balanced(fragment):
+    depth = 0
+    for m in _BRACES_RE.finditer(fragment):
+        if m.lastgroup == 'open':
+            depth += 1
+        elif m.lastgroup == 'close':
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def complete(fragment):
+    """
+    Whether the fragment can be analysed on its own: balanced braces, ends with a complete declaration
+    and contains no conditional preprocessor directives
+    """
+    if _CONDITIONAL_RE.search(fragment) or not balanced(fragment):
+        return False
+    code = _COMMENT_RE.sub(b' ', fragment).rstrip()
+    return not code or code.endswith((b';', b'}'))
+
+
+def by_name(tags):
+    """
+    Whether the tags are sorted by name (ctags --sort=yes) rather than by line
+    """
+    return len(tags) > 1 and all(a['name'] <= b['name'] for a, b in zip(tags, tags[1:])) and \
+        any(a['line'] > b['line'] for a, b in zip(tags, tags[1:]))
+
+
+class Derivation:
+    """
+    Tags of a target version in the making: the shifted unchanged tags and the regions to analyse again
+    """
+
+    def __init__(self, tags, regions, fragments, name_order):
+        self.tags = tags
+        # (first line, last line) of every region, in the target version
+        self.regions = regions
+        self.fragments = fragments
+        self.name_order = name_order
+
+    def finish(self, results):
+        """
+        :param results: tags of every fragment, as returned by the analyzer
+        :return: tags of the target version, None if the whole file must be analysed
+        """
+        tags = list(self.tags)
+        for (first, last), fragment_tags in zip(self.regions, results):
+            if fragment_tags is None:
+                return None
+            for tag in fragment_tags:
+                end = tag.get('end', tag['line'])
+                if end > last - first + 1:
+                    return None
+                tag = dict(tag, line=tag['line'] + first - 1)
+                if 'end' in tag:
+                    tag['end'] += first - 1
+                tags.append(tag)
+
+        tags.sort(key=(lambda tag: (tag['name'], tag['line'])) if self.name_order else (lambda tag: tag['line']))
+        return tags
+
+
+def plan(base_tags, hunks, data):
+    """
+    Prepare the tags of a target version from the tags of a base version
+    :param base_tags: tags of the base version
+    :param hunks: hunks from the base to the target version
+    :param data: content of the target version
+    :return: Derivation, None if the whole file must be analysed
+    """
+    if any(_UNSAFE_RE.search(text) for _, _, _, _, text in hunks):
+        return None
+    if any('end' not in tag and tag.get('kind') == 'function' for tag in base_tags):
+        return None
+
+    lines = data.split(b'\n')
+    if lines and lines[-1] == b'':
+        lines.pop()
+
+    clean = []
+    for tag in base_tags:
+        first, last = tag['line'], tag.get('end', tag['line'])
+        delta = 0
+        for base_start, base_lines, target_start, target_lines, _ in hunks:
+            if base_lines:
+                if base_start + base_lines - 1 < first:
+                    delta += target_lines - base_lines
+                elif base_start <= last:
+                    break
+            elif base_start < first:
+                delta += target_lines
+            elif base_start < last:
+                break
+        else:
+            shifted = dict(tag, line=first + delta)
+            if 'end' in tag:
+                shifted['end'] = last + delta
+            clean.append(shifted)
+
+    # Lines of the target version touched by the hunks
+    touched = [(target_start, target_start + target_lines - 1) if target_lines else (target_start, target_start + 1)
+               for _, _, target_start, target_lines, _ in hunks]
+
+    spans = sorted((tag['line'], tag.get('end', tag['line'])) for tag in clean)
+    regions = []
+    previous_end = 0
+    for first, last in spans + [(len(lines) + 1, len(lines) + 1)]:
+        if first <= previous_end:
+            return None
+        gap = (previous_end + 1, first - 1)
+        if gap[0] <= gap[1] and any(start <= gap[1] and end >= gap[0] for start, end in touched):
+            regions.append(gap)
+        previous_end = last
+
+    if sum(last - first + 1 for first, last in regions) > MAX_REANALYSED * len(lines):
+        return None
+
+    fragments = []
+    for first, last in regions:
+        fragment = b'\n'.join(lines[first - 1:last]) + b'\n'
+        if not complete(fragment):
+            return None
+        fragments.append(fragment)
+    return Derivation(clean, regions, fragments, by_name(base_tags))
@@ -0,0 +1,87 @@
+"""
+Sorted interval index used to map changed lines to the functions containing them.
+
+Both engines used to compare every changed line with every function of a file,
+which is quadratic on generated or amalgamated sources with thousands of
+functions. The index is built once per file version and answers each query by
+binary search over the sorted function starts.
+"""
+import bisect
+
+
+class IntervalIndex:
+    """
+    Index over closed intervals [start, end].
+
+    Intervals are sorted by start; `max_end[i]` is the largest end among the
+    first i + 1 intervals, which bounds the backwards scan of a query. For
+    disjoint intervals (function bodies) a query touches O(log n + k) entries.
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: list of (start, end) tuples
+        """
+        order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        self.ids = order
+        self.starts = [intervals[i][0] for i in order]
+        self.ends = [intervals[i][1] for i in order]
+        self.max_end = []
+        current = None
+        for end in self.ends:
+            current = end if current is None or end > current else current
+            self.max_end.append(current)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def overlapping(self, lo, hi):
+        """
+        Return the indices (in the list given to the constructor) of all intervals overlapping [lo, hi]
+        :param lo: first line of the query
+        :param hi: last line of the query
+        :return: sorted list of indices
+        """
+        found = []
+        i = bisect.bisect_right(self.starts, hi) - 1
+        while i >= 0 and self.max_end[i] >= lo:
+            if self.ends[i] >= lo:
+                found.append(self.ids[i])
+            i -= 1
+        found.sort()
+        return found
+
+    def containing(self, line):
+        return self.overlapping(line, line)
+
+
+class FunctionIndex:
+    """
+    Maps line numbers to the functions of one file version.
+    """
+
+    def __init__(self, functions):
+        """
+        :param functions: list of (name, start, end) tuples, in the order reported by ctags
+        """
+        self.names = [name for name, _, _ in functions]
+        self.index = IntervalIndex([(start, end) for _, start, end in functions])
+
+    def assign(self, lines):
+        """
+        Group the given lines by the functions containing them. A line inside several
+        definitions is reported once per definition, like a pairwise comparison would.
+        :param lines: list of line numbers
+        :return: dict of function name to list of lines, functions in definition order,
+                 lines in the order of the definitions and then of `lines`
+        """
+        hits = []
+        for position, line in enumerate(lines):
+            for definition in self.index.containing(line):
+                hits.append((definition, position))
+        hits.sort()
+
+        result = {}
+        for definition, position in hits:
+            result.setdefault(self.names[definition], []).append(lines[position])
+        return result
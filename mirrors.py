@@ -0,0 +1,118 @@
+"""
+Persistent bare mirrors of remote repositories.
+
+Both engines analyse remote repositories from a mirror kept in a cache
+directory shared by all runs, one mirror per remote URL. The first run clones
+the remote; later runs only fetch the objects and references that are new
+upstream. The mirror fetches `+refs/*:refs/*`, so every branch and tag of the
+remote is available under its own name, and HEAD follows the default branch
+of the remote.
+
+Local repositories, given as a directory or a `file://` URL of one, are used in
+place and never mirrored.
+
+A mirror is first created in a temporary directory and renamed into place once
+the initial fetch is complete, so an interrupted clone never leaves a broken
+mirror behind. Concurrent runs serialise their updates with a lock file.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pygit2
+
+import tagcache
+
+MIRROR_REFSPEC = '+refs/*:refs/*'
+
+
+def default_mirror_dir():
+    return os.path.join(tagcache.default_cache_dir(), 'mirrors')
+
+
+def mirror_path(url, mirror_dir=None):
+    """
+    Return the directory of the mirror of a remote
+    :param url: URL of the remote
+    :param mirror_dir: directory of the mirrors, default_mirror_dir() if None
+    """
+    key = hashlib.sha1(url.rstrip('/').encode('utf-8')).hexdigest()[:16]
+    return os.path.join(mirror_dir or default_mirror_dir(), key + '.git')
+
+
+def local_path(url):
+    """
+    :param url: path or URL of a repository
+    :return: the directory of a local repository, None for a remote one
+    """
+    path = url[len('file://'):] if url.startswith('file://') else url
+    return path if os.path.isdir(path) else None
+
+
+@contextlib.contextmanager
+def locked(path):
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def fetch(repo, callbacks=None):
+    """
+    Bring the mirror up to date: fetch new objects, update and prune the references, follow the remote HEAD
+    :param repo: pygit2.Repository of the mirror
+    :param callbacks: pygit2.RemoteCallbacks, e.g. with credentials
+    """
+    remote = repo.remotes['origin']
+    remote.fetch(callbacks=callbacks, prune=pygit2.enums.FetchPrune.PRUNE)
+    for head in remote.list_heads(callbacks=callbacks):
+        if head.name == 'HEAD' and head.symref_target and head.symref_target in repo.references:
+            repo.set_head(head.symref_target)
+            break
+
+
+def open_mirror(url, mirror_dir=None, callbacks=None):
+    """
+    Return the mirror of a remote, cloning it on first use and fetching what is new otherwise
+    :param url: URL of the remote
+    :param mirror_dir: directory of the mirrors, default_mirror_dir() if None
+    :param callbacks: pygit2.RemoteCallbacks, e.g. with credentials
+    :return: pygit2.Repository
+    """
+    path = mirror_path(url, mirror_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with locked(path):
+        if os.path.isdir(path):
+            repo = pygit2.Repository(path)
+            if repo.remotes['origin'].url.rstrip('/') != url.rstrip('/'):
+                raise ValueError("Mirror '{}' belongs to {}, not {}".format(path, repo.remotes['origin'].url, url))
+            fetch(repo, callbacks)
+            return repo
+
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.mirror-')
+        try:
+            repo = pygit2.init_repository(tmp, bare=True)
+            repo.remotes.create('origin', url, MIRROR_REFSPEC)
+            fetch(repo, callbacks)
+            os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return pygit2.Repository(path)
+
+
+def open_repository(url, mirror_dir=None, callbacks=None):
+    """
+    Open a local repository in place, or the mirror of a remote one, see open_mirror
+    :param url: local path, file:// URL or URL of the remote
+    :return: pygit2.Repository
+    """
+    path = local_path(url)
+    if path is not None:
+        return pygit2.Repository(path)
+    return open_mirror(url, mirror_dir, callbacks)
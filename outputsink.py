@@ -0,0 +1,236 @@
+"""
+Output sinks of diffanalyze.
+
+A sink formats the DiffSummary of every analysed commit in one print mode and
+writes it to a stream. The format is chosen once, when the sink is created;
+each summary is rendered into a single string and written with one call, and
+side files (`./updated_functions` in only-fn mode) are opened once per run.
+
+Formats:
+- `full`: file, function and the added/removed line numbers, for humans
+- `simple`: `file,function,line` for every changed line
+- `functions`: `file,function[,commit]` for every changed function
+- `only-fn`: the names of the changed functions, each printed once
+- `csv`: `commit,file,function,change,line` rows with a header
+- `jsonl`: one JSON object per commit
+"""
+import csv
+import io
+import json
+import sys
+
+try:
+    from termcolor import colored
+except ImportError:
+    colored = None
+
+# Buffer of the standard output when it is not a terminal
+STDOUT_BUFFER_SIZE = 1024 * 1024
+
+UPDATED_FUNCTIONS_FILE = './updated_functions'
+
+
+def buffer_stdout(size=STDOUT_BUFFER_SIZE):
+    """
+    Replace sys.stdout by a writer with a large buffer if the output goes to a file or a pipe.
+    Everything printed, including the progress messages, keeps its order.
+    """
+    if sys.stdout.isatty():
+        return
+    sys.stdout.flush()
+    sys.stdout = open(sys.stdout.fileno(), 'w', buffering=size, encoding=sys.stdout.encoding,
+                      errors=sys.stdout.errors, closefd=False)
+
+
+def flush_before_fork():
+    """
+    Flush sys.stdout before starting worker processes. Forked workers inherit the buffer of the parent and flush it
+    when they exit, so anything still pending in it would be written once per worker.
+    """
+    sys.stdout.flush()
+
+
+def colour_support(stream):
+    return colored is not None and stream.isatty()
+
+
+class OutputSink:
+    """
+    Base class of the sinks: subclasses implement `format`, returning the text of one DiffSummary
+    """
+
+    def __init__(self, stream=None, colour=None, verbose=False, only_added=False, with_hash=False):
+        """
+        :param stream: text stream to write to, sys.stdout (looked up on every write) if None
+        :param colour: colour file and function names, by default if termcolor is installed and the stream is a tty
+        :param verbose: also write the messages only shown with --verbose
+        :param only_added: ignore removed lines
+        :param with_hash: add the commit to every line in the functions format
+        """
+        self.stream = stream
+        self.colour = colour_support(stream or sys.stdout) if colour is None else colour
+        self.verbose = verbose
+        self.only_added = only_added
+        self.with_hash = with_hash
+
+    def paint(self, text, colour):
+        return colored(text, colour) if self.colour else text
+
+    def write(self, diff_summary):
+        text = self.format(diff_summary)
+        if text:
+            (self.stream or sys.stdout).write(text)
+
+    def format(self, diff_summary):
+        raise NotImplementedError
+
+    def close(self):
+        (self.stream or sys.stdout).flush()
+
+
+class FullSink(OutputSink):
+
+    def format(self, diff_summary):
+        parts = []
+        for file_diff in diff_summary.file_diffs:
+            filename = self.paint(file_diff.filename, 'blue')
+            commit = file_diff.patch_commit
+            for fn_name, lines in file_diff.fn_to_changed_lines.items():
+                parts.append('{}: In function {}\n'.format(filename, self.paint(fn_name, 'green')))
+                if lines.added_lines:
+                    parts.append('Patch {} has added lines (new line indices): [{}]\n'.format(
+                        commit, ' '.join(map(str, lines.added_lines))))
+                if lines.removed_lines:
+                    parts.append('Patch {} has added lines (rem line indices): [{}]\n'.format(
+                        commit, ' '.join(map(str, lines.removed_lines))))
+        if self.verbose:
+            if diff_summary.updated_fn_count == 0:
+                parts.append('No relevant changes detected.\n')
+            parts.append('\n')
+        return ''.join(parts)
+
+
+class SimpleSink(OutputSink):
+
+    def format(self, diff_summary):
+        parts = []
+        for file_diff in diff_summary.file_diffs:
+            parts.append('# Commit: {}\n'.format(file_diff.patch_commit))
+            filename = self.paint(file_diff.filename, 'blue')
+            for fn_name in sorted(file_diff.fn_to_changed_lines):
+                lines = file_diff.fn_to_changed_lines[fn_name]
+                if self.only_added:
+                    numbers = sorted(lines.added_lines)
+                else:
+                    numbers = sorted(set(lines.added_lines) | set(lines.removed_lines))
+                prefix = '{},{},'.format(filename, self.paint(fn_name, 'yellow'))
+                parts.extend('{}{}\n'.format(prefix, line) for line in numbers)
+        return ''.join(parts)
+
+
+class FunctionsSink(OutputSink):
+
+    def format(self, diff_summary):
+        parts = []
+        for file_diff in diff_summary.file_diffs:
+            suffix = ',' + file_diff.patch_commit + '\n' if self.with_hash else '\n'
+            for fn_name, lines in file_diff.fn_to_changed_lines.items():
+                if not self.only_added or lines.added_lines:
+                    parts.append('{},{}{}'.format(file_diff.filename, fn_name, suffix))
+        return ''.join(parts)
+
+
+class OnlyFnSink(OutputSink):
+    """
+    Writes every changed function name once, and all of them to `updated_functions`
+    """
+
+    def __init__(self, *args, functions_file=UPDATED_FUNCTIONS_FILE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.functions_file = functions_file
+        self.file = None
+        self.seen = set()
+
+    def format(self, diff_summary):
+        parts = []
+        names = []
+        for file_diff in diff_summary.file_diffs:
+            if self.verbose:
+                parts.append('Updated functions:\n')
+            for fn_name in file_diff.fn_to_changed_lines:
+                names.append(fn_name + '\n')
+                if fn_name not in self.seen:
+                    self.seen.add(fn_name)
+                    parts.append(self.paint(fn_name, 'green') + '\n')
+        if self.verbose:
+            parts.append('\n')
+
+        if names and self.functions_file:
+            if self.file is None:
+                self.file = open(self.functions_file, 'a')
+            self.file.write(''.join(names))
+        return ''.join(parts)
+
+    def close(self):
+        super().close()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class CsvSink(OutputSink):
+    HEADER = ('commit', 'file', 'function', 'change', 'line')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.header_written = False
+
+    def format(self, diff_summary):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        if not self.header_written:
+            writer.writerow(CsvSink.HEADER)
+            self.header_written = True
+        for file_diff in diff_summary.file_diffs:
+            for fn_name, lines in file_diff.fn_to_changed_lines.items():
+                writer.writerows((file_diff.patch_commit, file_diff.filename, fn_name, 'added', line)
+                                 for line in lines.added_lines)
+                if not self.only_added:
+                    writer.writerows((file_diff.patch_commit, file_diff.filename, fn_name, 'removed', line)
+                                     for line in lines.removed_lines)
+        return out.getvalue()
+
+
+class JsonlSink(OutputSink):
+
+    def format(self, diff_summary):
+        files = {}
+        for file_diff in diff_summary.file_diffs:
+            functions = {}
+            for fn_name, lines in file_diff.fn_to_changed_lines.items():
+                functions[fn_name] = {'added': list(lines.added_lines)}
+                if not self.only_added:
+                    functions[fn_name]['removed'] = list(lines.removed_lines)
+            if functions:
+                files[file_diff.filename] = functions
+        return json.dumps({'commit': diff_summary.commit, 'files': files}) + '\n'
+
+
+SINKS = {
+    'full': FullSink,
+    'simple': SimpleSink,
+    'functions': FunctionsSink,
+    'only-fn': OnlyFnSink,
+    'csv': CsvSink,
+    'jsonl': JsonlSink,
+}
+
+
+def create_sink(print_mode, **options):
+    """
+    Create the sink of a print mode
+    :param print_mode: one of SINKS
+    :param options: see OutputSink
+    :return: OutputSink
+    """
+    return SINKS[print_mode](**options)
@@ -0,0 +1,172 @@
+"""
+Per-stage profiling of an analysis run (`--profile FILE`).
+
+The engines wrap each stage of their work (commit walk, diff, patch
+generation, blob reads, ctags, JSON decoding, tag cache, line matching,
+output) in `profiler.stage(name)`. The profiler accumulates wall time, call
+counts and bytes processed per stage, keeps the slowest commits and files and
+writes everything, together with the peak memory, as a JSON report.
+
+Without `--profile` the engines use NULL, whose methods do nothing.
+"""
+import atexit
+import contextlib
+import heapq
+import json
+import resource
+import sys
+import threading
+import time
+
+DEFAULT_TOP = 10
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Profiler:
+    """
+    Collects stage timings; safe to use from several threads (the ctags pool
+    decodes the answers of its workers concurrently).
+    """
+    enabled = True
+
+    def __init__(self, top=DEFAULT_TOP):
+        self.top = top
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # name -> [seconds, calls, bytes]
+        self.stages = {}
+        # Min-heaps of the `top` slowest entries: (seconds, details)
+        self.slowest = {'commits': [], 'files': []}
+
+    def add(self, name, seconds, calls=1, nbytes=0):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0.0, 0, 0])
+            stage[0] += seconds
+            stage[1] += calls
+            stage[2] += nbytes
+
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, 1, nbytes)
+
+    def iterate(self, name, iterable):
+        """
+        Iterate over `iterable`, timing every step as one call of the given stage
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, 0)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def record(self, kind, seconds, **details):
+        """
+        Remember a commit or file if it is among the `top` slowest ones
+        :param kind: 'commits' or 'files'
+        :param seconds: time spent on it
+        :param details: JSON serializable description, e.g. the commit id
+        """
+        details['seconds'] = round(seconds, 6)
+        entry = (seconds, sorted(details.items()))
+        with self.lock:
+            heap = self.slowest[kind]
+            if len(heap) < self.top:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    def snapshot(self):
+        """
+        Return the data collected so far and start again from scratch, see `merge`
+        """
+        with self.lock:
+            data = {'stages': self.stages, 'slowest': self.slowest}
+            self.stages = {}
+            self.slowest = {kind: [] for kind in self.slowest}
+        return data
+
+    def merge(self, data):
+        """
+        Add the snapshot of another profiler, e.g. of a worker process
+        """
+        for name, (seconds, calls, nbytes) in data['stages'].items():
+            self.add(name, seconds, calls, nbytes)
+        for kind, entries in data['slowest'].items():
+            for seconds, details in entries:
+                details = dict(details)
+                del details['seconds']
+                self.record(kind, seconds, **details)
+
+    def report(self):
+        stages = sorted(self.stages.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'stages': {name: {'seconds': round(seconds, 6), 'calls': calls, 'bytes': nbytes}
+                       for name, (seconds, calls, nbytes) in stages},
+            'slowest_commits': [dict(details) for _, details in sorted(self.slowest['commits'], reverse=True)],
+            'slowest_files': [dict(details) for _, details in sorted(self.slowest['files'], reverse=True)],
+            'peak_rss_kb': peak_rss_kb(),
+            'children_peak_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN),
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+            f.write('\n')
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is disabled
+    """
+    enabled = False
+    top = None
+    _context = contextlib.nullcontext()
+
+    def add(self, name, seconds, calls=1, nbytes=0):
+        pass
+
+    def stage(self, name, nbytes=0):
+        return NullProfiler._context
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def record(self, kind, seconds, **details):
+        pass
+
+    def snapshot(self):
+        return None
+
+    def merge(self, data):
+        pass
+
+
+NULL = NullProfiler()
+
+
+def for_report(path, top=DEFAULT_TOP):
+    """
+    :param path: file the report is written to when the process exits, None to disable profiling
+    :return: a Profiler, or NULL without a path
+    """
+    if not path:
+        return NULL
+    profiler = Profiler(top)
+    # Registered at exit rather than written at the end of the run, so an interrupted run still gets its report
+    atexit.register(profiler.write, path)
+    return profiler
@@ -14,7 +14,9 @@ setup(
     author_email='',
     version='0.1',
     packages=[],
-    scripts=['diffanalyze.py'],
+    py_modules=['analyzers', 'changeindex', 'checkpoint', 'commitpipeline', 'cscan', 'ctagspool', 'incremental',
+                'intervals', 'mirrors', 'outputsink', 'profiling', 'statstore', 'tagcache'],
+    scripts=['diffanalyze.py', 'diffbatch.py', 'diffserver.py', 'changeindex.py'],
     install_requires=['pygit2'],
     python_requires='>2.7',
 )
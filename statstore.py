@@ -0,0 +1,254 @@
+"""
+Columnar store of per-commit statistics (`--stats-dir`, `--from-stats`).
+
+The histogram/summary scan records one row per analysed commit. The rows are
+kept as typed columns and written as one NumPy `.npy` file per column, next to
+a `meta.json` describing them:
+
+- `commit.npy`: commit ids, `|S40` (hex)
+- `time.npy`: commit times, `<i8` (seconds since the epoch)
+- `functions.npy`: number of changed functions, `<u4`
+- `added.npy`, `removed.npy`: changed lines inside functions, `<u4`
+- `flags.npy`: `<u1`, FLAG_INITIAL for the initial commit
+- `extensions.npy`: `<u8` of shape (commits, words), bit i of a row is set if
+  the commit touched a file whose extension is `meta.json['extensions'][i]`
+  (files of unanalysed extensions, `.c` when no function was updated)
+
+The files can be loaded (or memory-mapped) with `numpy.load`; this module
+reads and writes them without NumPy. The summary and the plots are computed
+from the columns alone, so `--from-stats` re-summarises a scan without
+opening the repository.
+"""
+import array
+import ast
+import collections
+import json
+import os
+import struct
+import sys
+
+VERSION = 1
+
+FLAG_INITIAL = 1
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+# column name -> (array typecode, npy descr)
+COLUMNS = collections.OrderedDict([
+    ('time', ('q', '<i8')),
+    ('functions', ('I', '<u4')),
+    ('added', ('I', '<u4')),
+    ('removed', ('I', '<u4')),
+    ('flags', ('B', '|u1')),
+])
+
+
+class StatsError(Exception):
+    pass
+
+
+def write_npy(path, data, descr, shape):
+    """
+    Write a .npy file (format version 1.0)
+    :param data: bytes in the byte order of descr
+    :param shape: tuple
+    """
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(descr, repr(shape))
+    # The data starts at a multiple of 64 bytes, the header ends with a newline
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    with open(path, 'wb') as f:
+        f.write(NPY_MAGIC)
+        f.write(struct.pack('<H', len(header)))
+        f.write(header)
+        f.write(data)
+
+
+def read_npy(path):
+    """
+    Read a .npy file written by write_npy
+    :return: (descr, shape, data bytes)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise StatsError("'{}' is not a version 1.0 .npy file".format(path))
+        header_len, = struct.unpack('<H', f.read(2))
+        header = ast.literal_eval(f.read(header_len).decode('latin1'))
+        return header['descr'], header['shape'], f.read()
+
+
+def little_endian(values):
+    if sys.byteorder == 'big' and values.itemsize > 1:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big' and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+class CommitStats:
+    """
+    Per-commit statistics, one row per commit in the order they were analysed
+    """
+
+    def __init__(self):
+        self.commits = bytearray()
+        self.columns = {name: array.array(typecode) for name, (typecode, _) in COLUMNS.items()}
+        self.extensions = []
+        self.extension_ids = {}
+        # Bitmask of the extensions of every commit
+        self.extension_masks = []
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def append(self, commit, time, functions, added, removed, extensions=(), initial=False):
+        """
+        Add the row of a commit
+        :param commit: hex id
+        :param time: commit time
+        :param functions: number of changed functions
+        :param added: number of added lines in functions
+        :param removed: number of removed lines in functions
+        :param extensions: extensions of the files touched that were not analysed
+        :param initial: the commit has no parent
+        """
+        mask = 0
+        for extension in extensions:
+            if extension not in self.extension_ids:
+                self.extension_ids[extension] = len(self.extensions)
+                self.extensions.append(extension)
+            mask |= 1 << self.extension_ids[extension]
+
+        self.commits += commit.encode('ascii')
+        columns = self.columns
+        columns['time'].append(time)
+        columns['functions'].append(functions)
+        columns['added'].append(added)
+        columns['removed'].append(removed)
+        columns['flags'].append(FLAG_INITIAL if initial else 0)
+        self.extension_masks.append(mask)
+
+    def commit(self, row):
+        return self.commits[row * 40:(row + 1) * 40].decode('ascii')
+
+    def functions_histogram(self, skip_initial=False):
+        """
+        :param skip_initial: leave the initial commit out
+        :return: OrderedDict number of changed functions -> number of commits, by number of functions
+        """
+        counts = collections.Counter(self.columns['functions'])
+        if skip_initial:
+            for functions, flags in zip(self.columns['functions'], self.columns['flags']):
+                if flags & FLAG_INITIAL:
+                    counts[functions] -= 1
+        return collections.OrderedDict(sorted((functions, count) for functions, count in counts.items() if count))
+
+    def extension_counts(self):
+        """
+        :return: OrderedDict extension -> number of commits touching it, by extension
+        """
+        counts = [0] * len(self.extensions)
+        for mask in self.extension_masks:
+            while mask:
+                bit = mask & -mask
+                counts[bit.bit_length() - 1] += 1
+                mask ^= bit
+        return collections.OrderedDict(sorted(zip(self.extensions, counts)))
+
+    def commits_by_functions(self, skip_initial=False):
+        """
+        :return: dict number of changed functions -> list of commit ids
+        """
+        result = {}
+        for row, (functions, flags) in enumerate(zip(self.columns['functions'], self.columns['flags'])):
+            if not (skip_initial and flags & FLAG_INITIAL):
+                result.setdefault(functions, []).append(self.commit(row))
+        return result
+
+    def commits_by_extension(self):
+        """
+        :return: dict extension -> set of commit ids
+        """
+        result = {}
+        for row, mask in enumerate(self.extension_masks):
+            for extension_id, extension in enumerate(self.extensions):
+                if mask >> extension_id & 1:
+                    result.setdefault(extension, set()).add(self.commit(row))
+        return result
+
+    def state(self):
+        """
+        JSON serializable copy, e.g. for checkpoints, see from_state
+        """
+        state = {name: values.tolist() for name, values in self.columns.items()}
+        state['commit'] = self.commits.decode('ascii')
+        state['extensions'] = self.extensions
+        state['extension_masks'] = self.extension_masks
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.commits = bytearray(state['commit'].encode('ascii'))
+        for name, (typecode, _) in COLUMNS.items():
+            stats.columns[name] = array.array(typecode, state[name])
+        stats.extensions = list(state['extensions'])
+        stats.extension_ids = {extension: i for i, extension in enumerate(stats.extensions)}
+        stats.extension_masks = list(state['extension_masks'])
+        return stats
+
+    def save(self, directory, **meta):
+        """
+        Write the columns to `directory`
+        :param meta: JSON serializable description of the scan, stored in meta.json
+        """
+        os.makedirs(directory, exist_ok=True)
+        rows = len(self)
+        write_npy(os.path.join(directory, 'commit.npy'), bytes(self.commits), '|S40', (rows,))
+        for name, (_, descr) in COLUMNS.items():
+            write_npy(os.path.join(directory, name + '.npy'), little_endian(self.columns[name]), descr, (rows,))
+
+        words = max(1, (len(self.extensions) + 63) // 64)
+        masks = array.array('Q', (mask >> (64 * word) & 0xFFFFFFFFFFFFFFFF
+                                  for mask in self.extension_masks for word in range(words)))
+        write_npy(os.path.join(directory, 'extensions.npy'), little_endian(masks), '<u8', (rows, words))
+
+        meta = dict(meta, version=VERSION, commits=rows, extensions=self.extensions)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Read the columns written by save
+        :return: (CommitStats, meta dict)
+        """
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise StatsError("No statistics in '{}'".format(directory))
+        if meta.get('version') != VERSION:
+            raise StatsError("Unsupported statistics version {} in '{}'".format(meta.get('version'), directory))
+
+        stats = cls()
+        stats.commits = bytearray(read_npy(os.path.join(directory, 'commit.npy'))[2])
+        for name, (typecode, _) in COLUMNS.items():
+            stats.columns[name] = from_little_endian(typecode, read_npy(os.path.join(directory, name + '.npy'))[2])
+        stats.extensions = meta['extensions']
+        stats.extension_ids = {extension: i for i, extension in enumerate(stats.extensions)}
+
+        _, (rows, words), data = read_npy(os.path.join(directory, 'extensions.npy'))
+        masks = from_little_endian('Q', data)
+        stats.extension_masks = [sum(masks[row * words + word] << (64 * word) for word in range(words))
+                                 for row in range(rows)]
+        if any(len(values) != rows for values in stats.columns.values()) or len(stats.commits) != rows * 40:
+            raise StatsError("Columns of different lengths in '{}'".format(directory))
+        return stats, meta
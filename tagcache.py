@@ -0,0 +1,226 @@
+"""
+Persistent cache of ctags results keyed by git blob id.
+
+Blobs are content addressed, so the tags of a blob never change for a given
+ctags binary and set of flags. Both diffanalyze engines use this cache to avoid
+running ctags again on file versions that were already analysed, e.g. the new
+side of a commit that is the old side of the next one, or re-runs over the
+same range of history.
+"""
+import collections
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+# Only the fields used by the analysis are stored
+TAG_FIELDS = ('name', 'kind', 'line', 'end', 'pattern')
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Seconds between two updates of the access time of an entry
+TOUCH_INTERVAL = 60
+
+DEFAULT_MEMORY_ENTRIES = 10000
+
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'diffanalyze')
+
+
+@functools.lru_cache(maxsize=None)
+def ctags_version(ctags):
+    """
+    Return the version line of the given ctags executable
+    :param ctags: path to ctags
+    :return: first line of `ctags --version`
+    """
+    try:
+        out = subprocess.check_output([ctags, '--version'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return out.decode('utf-8', 'replace').split('\n', 1)[0].strip()
+
+
+def flavour(*args):
+    """
+    Build the part of the cache key describing how the tags were generated,
+    e.g. the ctags version and the command line flags.
+    """
+    return hashlib.sha1('\0'.join(map(str, args)).encode('utf-8')).hexdigest()[:16]
+
+
+class TagCache:
+    """
+    Size-bounded LRU cache of tag lists stored in a SQLite database.
+
+    Keys are `(blob id, flavour)` pairs, values are lists of tag dicts restricted
+    to TAG_FIELDS.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE, threads=False):
+        """
+        :param threads: the cache is used from several threads, which serialise their calls
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.path = os.path.join(self.cache_dir, 'tags.sqlite')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # Several processes may share the cache, wait for each other's writes
+        self.db = sqlite3.connect(self.path, isolation_level=None, timeout=60, check_same_thread=not threads)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tags ('
+                        'key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tags_used ON tags (used)')
+        # Total size of the entries, kept up to date by the transactions changing them
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.execute('CREATE TABLE IF NOT EXISTS total ('
+                        'id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)')
+        self.db.execute('INSERT OR IGNORE INTO total (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM tags')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS tags_insert AFTER INSERT ON tags '
+                        'BEGIN UPDATE total SET size = size + NEW.size; END')
+        self.db.execute('CREATE TRIGGER IF NOT EXISTS tags_delete AFTER DELETE ON tags '
+                        'BEGIN UPDATE total SET size = size - OLD.size; END')
+        self.db.execute('COMMIT')
+
+    @staticmethod
+    def clock():
+        # Time of the accesses for the LRU eviction, in seconds: comparable across the processes sharing the cache
+        return int(time.time())
+
+    @property
+    def size(self):
+        # Read from the database, the other processes sharing the cache add and evict entries too
+        return self.db.execute('SELECT size FROM total').fetchone()[0]
+
+    @staticmethod
+    def make_key(oid, flavour):
+        return '{}:{}'.format(oid, flavour)
+
+    def get(self, oid, flavour):
+        """
+        Return the cached tags of a blob or None if the blob was not analysed yet
+        :param oid: blob id
+        :param flavour: see `flavour()`
+        :return: list of tag dicts or None
+        """
+        key = TagCache.make_key(oid, flavour)
+        row = self.db.execute('SELECT data, used FROM tags WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = self.clock()
+        # Reads only write, and wait for the write lock, when the access time is TOUCH_INTERVAL old
+        if now - row[1] >= TOUCH_INTERVAL:
+            self.db.execute('UPDATE tags SET used = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, oid, flavour, tags):
+        """
+        Store the tags of a blob, evicting the least recently used entries if the cache grows too large
+        :param oid: blob id
+        :param flavour: see `flavour()`
+        :param tags: list of tag dicts as produced by ctags
+        """
+        tags = [{k: tag[k] for k in TAG_FIELDS if k in tag} for tag in tags]
+        data = zlib.compress(json.dumps(tags, separators=(',', ':')).encode('utf-8'))
+        key = TagCache.make_key(oid, flavour)
+
+        # The size is read in the transaction writing the entry, so all processes evict against the same total
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # Not INSERT OR REPLACE: the rows it replaces do not fire the trigger maintaining the total size
+            self.db.execute('DELETE FROM tags WHERE key = ?', (key,))
+            self.db.execute('INSERT INTO tags (key, data, size, used) VALUES (?, ?, ?, ?)',
+                            (key, data, len(data), self.clock()))
+            size = self.size
+            if size > self.max_size:
+                self.evict(size, self.max_size * 9 // 10)
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def evict(self, size, target_size):
+        # Drop the least recently used entries until the cache fits in target_size, size being its current size
+        rows = self.db.execute('SELECT key, size FROM tags ORDER BY used, rowid')
+        dropped = []
+        for key, entry_size in rows:
+            if size <= target_size:
+                break
+            dropped.append((key,))
+            size -= entry_size
+        rows.close()
+        self.db.executemany('DELETE FROM tags WHERE key = ?', dropped)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size}
+
+    def close(self):
+        self.db.close()
+
+
+class MemoryTagCache:
+    """
+    Thread-safe in-memory LRU cache of tag lists in front of an optional TagCache,
+    for processes answering many requests (see diffserver.py). Same interface as TagCache.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES, backing=None):
+        """
+        :param max_entries: number of tag lists kept in memory
+        :param backing: TagCache opened with threads=True, looked up on a miss and written through
+        """
+        self.max_entries = max_entries
+        self.backing = backing
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, oid, flavour):
+        key = TagCache.make_key(oid, flavour)
+        with self.lock:
+            tags = self.entries.get(key)
+            if tags is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return tags
+            self.misses += 1
+            if self.backing:
+                tags = self.backing.get(oid, flavour)
+                if tags is not None:
+                    self.remember(key, tags)
+            return tags
+
+    def put(self, oid, flavour, tags):
+        tags = [{k: tag[k] for k in TAG_FIELDS if k in tag} for tag in tags]
+        with self.lock:
+            self.remember(TagCache.make_key(oid, flavour), tags)
+            if self.backing:
+                self.backing.put(oid, flavour, tags)
+
+    def remember(self, key, tags):
+        self.entries[key] = tags
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def close(self):
+        if self.backing:
+            self.backing.close()
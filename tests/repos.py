@@ -0,0 +1,36 @@
+"""
+Small git repositories built by the tests
+"""
+import pygit2
+
+# Signature time of the first commit, the following ones are one second apart
+START_TIME = 1577836800
+
+
+class RepoBuilder:
+  """
+  A bare repository whose commits are created from the contents of their files
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.repo = pygit2.init_repository(path, bare=True)
+    # Ids of the created commits, in order
+    self.commits = []
+
+  def commit(self, files=None, parents=None, ref='refs/heads/master', message='commit'):
+    """
+    :param files: dict of file name -> content (bytes) of the tree of the commit
+    :param parents: ids of the parents, the last created commit if None
+    :param ref: reference moved to the commit, None to leave the references alone. An existing reference must
+                point to the first parent
+    :return: pygit2.Oid of the commit
+    """
+    signature = pygit2.Signature('Test', 'test@example.com', START_TIME + len(self.commits), 0)
+    builder = self.repo.TreeBuilder()
+    for name, content in (files or {}).items():
+      builder.insert(name, self.repo.create_blob(content), pygit2.GIT_FILEMODE_BLOB)
+    if parents is None:
+      parents = self.commits[-1:]
+    self.commits.append(self.repo.create_commit(ref, signature, signature, message, builder.write(), list(parents)))
+    return self.commits[-1]
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import changeindex
+import diffanalyze
+from tests import repos
+
+A = b'int a(int x)\n{\n  return x;\n}\n'
+B = b'int b(int x)\n{\n  return x;\n}\n'
+
+
+def edit(source, line):
+  return source.replace(b'return x;', line)
+
+
+class ChangeIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.repo_path = os.path.join(self.tmp.name, 'project.git')
+    self.repo = repos.RepoBuilder(self.repo_path)
+    self.path = os.path.join(self.tmp.name, 'index.db')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def index(self, *args):
+    manager = diffanalyze.RepoManager(self.repo_path, 'simple', False, None, None, analyzer='cscan')
+    index = changeindex.ChangeIndex(self.path, {'path_filter': None})
+    try:
+      return manager.index_commits(index, *args)
+    finally:
+      index.close()
+      manager.cleanup()
+
+  def test_index(self):
+    first = str(self.repo.commit({'a.c': A}))
+    second = str(self.repo.commit({'a.c': edit(A, b'return x + 1;'), 'b.c': B}))
+    self.assertEqual(self.index(), 2)
+    # Only the new commits are analysed
+    third = str(self.repo.commit({'a.c': edit(A, b'x++;\n  return x + 2;'), 'b.c': edit(B, b'return 0;')}))
+    self.assertEqual(self.index(), 1)
+    self.assertEqual(self.index(), 0)
+
+    index = changeindex.ChangeIndex(self.path)
+    self.addCleanup(index.close)
+    self.assertEqual(index.stats(), {'commits': 3, 'changes': 5})
+    self.assertEqual([(commit, added, removed) for commit, _, _, _, added, removed in index.function_history('a')],
+                     [(first, 4, 0), (second, 1, 1), (third, 2, 1)])
+    self.assertEqual([row[3] for row in index.file_changes('b.c')], ['b', 'b'])
+    self.assertEqual([row[2:] for row in index.commit_changes(third[:10])], [('a.c', 'a', 2, 1), ('b.c', 'b', 1, 1)])
+    self.assertEqual(index.commit_changes('f' * 40), [])
+    self.assertEqual(index.hotspots(1), [('a.c', 'a', 3, 7, 2)])
+    self.assertEqual(index.hotspots(filename='b.c'), [('b.c', 'b', 2, 5, 1)])
+
+  def test_settings(self):
+    changeindex.ChangeIndex(self.path, {'path_filter': 'src/'}).close()
+    with self.assertRaises(changeindex.ChangeIndexError):
+      changeindex.ChangeIndex(self.path, {'path_filter': None})
+
+
+if __name__ == '__main__':
+  unittest.main()
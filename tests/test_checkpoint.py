@@ -0,0 +1,77 @@
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import checkpoint
+
+FakeCommit = collections.namedtuple('FakeCommit', ['id'])
+
+
+class CheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'scan.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_save_and_load(self):
+    cp = checkpoint.Checkpoint(self.path, {'repo': 'r'})
+    self.assertIsNone(cp.load())
+    cp.save('a' * 40, 'b' * 40, 3, {'fn_updated_per_commit': {'1': ['b' * 40]}})
+
+    state = checkpoint.Checkpoint(self.path, {'repo': 'r'}).load()
+    self.assertEqual(state['start'], 'a' * 40)
+    self.assertEqual(state['last_commit'], 'b' * 40)
+    self.assertEqual(state['done'], 3)
+    self.assertEqual(state['data'], {'fn_updated_per_commit': {'1': ['b' * 40]}})
+    # No temporary files are left behind
+    self.assertEqual(os.listdir(self.dir), ['scan.json'])
+
+    cp.remove()
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_other_scan_is_rejected(self):
+    checkpoint.Checkpoint(self.path, {'repo': 'r'}).save('a', 'b', 1, {})
+    with self.assertRaises(checkpoint.CheckpointError):
+      checkpoint.Checkpoint(self.path, {'repo': 'other'}).load()
+
+  def test_results(self):
+    cp = checkpoint.Checkpoint(self.path, {})
+    cp.append_results([['a', {}], ['b', {'f.c': {}}]])
+    cp.save('a', 'b', 2, {'results': 2})
+    # Appended by a run interrupted before its next save
+    cp.append_results([['c', {}]])
+
+    self.assertEqual(cp.load_results(2), [['a', {}], ['b', {'f.c': {}}]])
+    cp.append_results([['d', {}]])
+    self.assertEqual(cp.load_results(3), [['a', {}], ['b', {'f.c': {}}], ['d', {}]])
+    with self.assertRaises(checkpoint.CheckpointError):
+      cp.load_results(4)
+
+    # A new scan starts without results
+    self.assertEqual(cp.load_results(0), [])
+    self.assertFalse(os.path.exists(cp.results_path))
+    cp.append_results([['e', {}]])
+    cp.remove()
+    self.assertEqual(os.listdir(self.dir), [])
+
+  def test_due(self):
+    self.assertTrue(checkpoint.Checkpoint(self.path, {}, interval=0).due())
+    self.assertFalse(checkpoint.Checkpoint(self.path, {}, interval=3600).due())
+
+  def test_skip_processed(self):
+    commits = [FakeCommit(c) for c in 'abcd']
+    self.assertEqual([c.id for c in checkpoint.skip_processed(commits, None)], list('abcd'))
+    self.assertEqual([c.id for c in checkpoint.skip_processed(commits, 'b')], ['c', 'd'])
+    with self.assertRaises(checkpoint.CheckpointError):
+      list(checkpoint.skip_processed(commits, 'x'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pygit2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diffanalyze import RepoManager
+from tests import repos
+
+REVERSE = pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE
+
+
+class CommitRangeTest(unittest.TestCase):
+  """
+  History: c0 - c1 - c2 ------- m4 - c5
+                  \\            /
+                   s2 -------- s3
+  """
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    builder = repos.RepoBuilder(self.tmp.name)
+    self.repo = builder.repo
+    c0 = builder.commit(parents=[], ref=None, message='c0')
+    c1 = builder.commit(parents=[c0], ref=None, message='c1')
+    c2 = builder.commit(parents=[c1], ref=None, message='c2')
+    s2 = builder.commit(parents=[c1], ref=None, message='s2')
+    s3 = builder.commit(parents=[s2], ref=None, message='s3')
+    m4 = builder.commit(parents=[c2, s3], ref=None, message='m4')
+    self.head = builder.commit(parents=[m4], ref=None, message='c5')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def messages(self, commits):
+    return [commit.message for commit in commits]
+
+  def test_times_follows_first_parents(self):
+    self.assertEqual(self.messages(RepoManager.commit_range(self.repo, self.head, times=3)), ['c5', 'm4', 'c2'])
+    self.assertEqual(self.messages(RepoManager.commit_range(self.repo, self.head, times=3, sorting=REVERSE)),
+                     ['c2', 'm4', 'c5'])
+
+  def test_times_longer_than_history(self):
+    self.assertEqual(self.messages(RepoManager.commit_range(self.repo, self.head, times=10, sorting=REVERSE)),
+                     ['c0', 'c1', 'c2', 'm4', 'c5'])
+
+  def test_hide(self):
+    c1 = RepoManager.resolve(self.repo, str(self.head) + '~3')
+    self.assertEqual(c1.message, 'c1')
+    commits = RepoManager.commit_range(self.repo, self.head, [c1.id], sorting=REVERSE)
+    self.assertEqual(self.messages(commits), ['c2', 's2', 's3', 'm4', 'c5'])
+
+  def test_whole_history(self):
+    self.assertEqual(len(list(RepoManager.commit_range(self.repo, self.head))), 7)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzers
+import commitpipeline
+import ctagspool
+import tagcache
+
+FLAGS = ['--c-kinds=fp', '--fields=+ne', '--output-format=json']
+
+
+def source(i):
+  return b'int f%d(int x)\n{\n  return x;\n}\n' % i
+
+
+def analysed_fields(results):
+  # Other fields, e.g. the path of the temporary file in batch mode, differ from one run to the next
+  return [[{k: tag[k] for k in tagcache.TAG_FIELDS if k in tag} for tag in tags] for tags in results]
+
+
+def names(tagger, filename, blob):
+  return [tag['name'] for tag in tagger.tags(filename, blob)]
+
+
+class SlowPool(analyzers.ScanPool):
+
+  def generate(self, files):
+    # Long enough for the following commits to be prepared in the meantime
+    time.sleep(0.02)
+    return super().generate(files)
+
+
+class PipelineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = analyzers.ScanPool()
+    self.tagger = ctagspool.BlobTagger(self.pool)
+    self.git_threads = set()
+
+  def prepare(self, i):
+    self.git_threads.add(threading.get_ident())
+    return [('f%d.c' % i, ctagspool.BlobData('%040d' % i, source(i)))]
+
+  def run_pipeline(self, commits, prepare=None, depth=2):
+    return commitpipeline.run(commits, prepare or self.prepare, lambda job: job,
+                              lambda job, tagger: [names(tagger, *entry) for entry in job], self.tagger, depth)
+
+  def test_order(self):
+    results = list(self.run_pipeline(range(20)))
+    self.assertEqual(results, [[['f%d' % i]] for i in range(20)])
+    self.assertEqual(self.pool.calls, 20)
+    # All the commits are prepared in the same thread
+    self.assertEqual(len(self.git_threads), 1)
+
+  def test_shared_blobs(self):
+    self.tagger = ctagspool.BlobTagger(SlowPool())
+    # Every commit changes a file from the version of the previous commit
+    prepare = lambda i: [('f.c', ctagspool.BlobData('%040d' % j, source(j))) for j in (i, i + 1)]
+    results = list(self.run_pipeline(range(20), prepare, depth=4))
+    self.assertEqual(results, [[['f%d' % i], ['f%d' % (i + 1)]] for i in range(20)])
+    # Each version is analysed once, although it is on both sides of commits analysed concurrently
+    self.assertEqual(self.tagger.pool.calls, 21)
+
+  def test_emit(self):
+    emitted = []
+    threads = set()
+
+    def emit(result):
+      threads.add(threading.get_ident())
+      emitted.append(result)
+
+    results = commitpipeline.run(range(10), self.prepare, lambda job: job,
+                                 lambda job, tagger: [names(tagger, *entry) for entry in job], self.tagger, 2,
+                                 emit=emit)
+    for i, result in enumerate(results):
+      # A result is emitted before it is yielded
+      self.assertEqual(emitted[i], result)
+    self.assertEqual(emitted, [[['f%d' % i]] for i in range(10)])
+    self.assertNotIn(threading.get_ident(), threads)
+    self.assertTrue(threads.isdisjoint(self.git_threads))
+
+  def test_error(self):
+    def prepare(i):
+      if i == 3:
+        raise ValueError('broken commit')
+      return self.prepare(i)
+
+    results = self.run_pipeline(range(10), prepare)
+    self.assertEqual([next(results) for _ in range(3)], [[['f0']], [['f1']], [['f2']]])
+    with self.assertRaisesRegex(ValueError, 'broken commit'):
+      next(results)
+
+  def test_early_close(self):
+    results = self.run_pipeline(range(100))
+    self.assertEqual(next(results), [['f0']])
+    results.close()
+    # Only the commits that fit in the queues were prepared
+    self.assertLess(self.pool.calls, 20)
+
+
+@unittest.skipUnless(ctagspool.find_ctags(), 'ctags not available')
+class AsyncAnalyzerTest(unittest.TestCase):
+
+  def test_matches_pool(self):
+    pool = ctagspool.CtagsPool(FLAGS, size=2)
+    files = [('f%d.c' % i, source(i)) for i in range(10)] + [('empty.c', b'')]
+
+    async def generate():
+      analyzer = commitpipeline.AsyncAnalyzer(pool)
+      try:
+        return await analyzer.generate(files)
+      finally:
+        await analyzer.close()
+
+    try:
+      results = asyncio.run(generate())
+      # The pipeline runs its own processes, none of the pool
+      self.assertEqual(pool.workers, [])
+      self.assertEqual(analysed_fields(results), analysed_fields(pool.generate(files)))
+    finally:
+      pool.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,175 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzers
+import ctagspool
+import cscan
+
+FLAGS = ['--c-kinds=fp', '--fields=+ne', '--output-format=json']
+
+# Sources the scanner and ctags must agree on
+CORPUS = {
+  'plain.c': b'''#include <stdio.h>
+
+static int add(int a, int b)
+{
+  return a + b;
+}
+
+int main(void) {
+  printf("%d\\n", add(1, 2));
+  return 0;
+}
+''',
+  'declarations.c': b'''struct point { int x, y; };
+int table[] = { 1, 2, 3 };
+static const struct point origin = { 0, 0 };
+int prototype(int a);
+typedef int (*callback)(int);
+
+enum colour { RED, GREEN };
+
+void
+knr_style(a, b)
+  int a;
+  char *b;
+{
+  if (a) { b[0] = 0; }
+}
+''',
+  'tricky.c': b'''/* int commented(void) { return 0; } */
+#define BODY { return 1; }
+#if 0
+int disabled(void)
+{
+  return 0;
+}
+#endif
+
+static inline int __attribute__((always_inline)) attributed(int x)
+{
+  const char *s = "}{";
+  char c = '}';
+  return x + s[0] + c; // }
+}
+
+int *
+pointer_result(void)
+{
+  static int v;
+  return &v;
+}
+
+void (*signal_like(int sig, void (*handler)(int)))(int)
+{
+  return handler;
+}
+''',
+  'conditional.c': b'''#ifdef HAVE_CONFIG_H
+# include "config.h"
+#endif
+
+int checked(int a, int b) {
+#if defined(CHECK)
+  if (a > b) {
+#elif defined(WARN)
+  if (a >= b) {
+#else
+  if (a != b) {
+#endif
+    return 1;
+  }
+  return 0;
+}
+
+#ifndef NO_ALT
+int alternative(void)
+#else
+int replacement(void)
+#endif
+{
+  return 2;
+}
+
+#if 0
+int disabled(void) { return 0; }
+#elif 0
+int also_disabled(void) { return 0; }
+#else
+int enabled(void)
+{
+# ifdef DEBUG
+  return 3;
+# else
+  return 4;
+# endif
+}
+#endif
+''',
+}
+
+
+def functions(tags):
+  return sorted((t['name'], t['line'], t['end']) for t in tags if t.get('kind') == 'function')
+
+
+class ScannerTest(unittest.TestCase):
+
+  def test_plain_functions(self):
+    self.assertEqual(functions(cscan.scan(CORPUS['plain.c'])), [('add', 3, 6), ('main', 8, 11)])
+
+  def test_declarations_are_not_functions(self):
+    self.assertEqual(functions(cscan.scan(CORPUS['declarations.c'])), [('knr_style', 10, 15)])
+
+  def test_comments_strings_and_preprocessor(self):
+    self.assertEqual(functions(cscan.scan(CORPUS['tricky.c'])),
+                     [('attributed', 10, 15), ('pointer_result', 18, 22), ('signal_like', 24, 27)])
+
+  def test_first_conditional_branch(self):
+    self.assertEqual(functions(cscan.scan(CORPUS['conditional.c'])),
+                     [('alternative', 19, 25), ('checked', 5, 16), ('enabled', 32, 39)])
+    # Both branches open a brace, only one of them is closed
+    source = b'int f(void) {\n#if X\n if (a) {\n#else\n if (b) {\n#endif\n }\n}\nint g(void){}\n'
+    self.assertEqual(functions(cscan.scan(source)), [('f', 1, 8), ('g', 9, 9)])
+
+  def test_pattern(self):
+    tags = cscan.scan(CORPUS['plain.c'])
+    self.assertEqual(tags[0]['pattern'], '/^static int add(int a, int b)$/')
+
+  def test_extern_c_block(self):
+    source = b'extern "C" {\nint f(void)\n{\n  return 0;\n}\n}\n'
+    self.assertEqual(functions(cscan.scan(source)), [('f', 2, 5)])
+
+  def test_unterminated_function(self):
+    self.assertEqual(functions(cscan.scan(b'int f(void)\n{\n  return 0;\n')), [('f', 1, 4)])
+
+  def test_scan_pool(self):
+    pool, flavour = analyzers.create_pool('cscan', FLAGS)
+    result = pool.generate([('a.c', CORPUS['plain.c']), ('b.c', b'')])
+    self.assertEqual([functions(tags) for tags in result], [[('add', 3, 6), ('main', 8, 11)], []])
+    self.assertEqual(pool.calls, 2)
+    self.assertNotEqual(flavour, analyzers.tagcache.flavour(''))
+    pool.close()
+
+  def test_unknown_analyzer(self):
+    self.assertRaises(ValueError, analyzers.create_pool, 'clang', FLAGS)
+
+
+@unittest.skipUnless(ctagspool.find_ctags(), 'ctags not available')
+class AgreementTest(unittest.TestCase):
+
+  def test_agrees_with_ctags(self):
+    pool = ctagspool.CtagsPool(FLAGS, 1)
+    try:
+      names = sorted(CORPUS)
+      expected = pool.generate([(name, CORPUS[name]) for name in names])
+    finally:
+      pool.close()
+    for name, tags in zip(names, expected):
+      self.assertEqual(functions(cscan.scan(CORPUS[name])), functions(tags), name)
+
+
+if __name__ == '__main__':
+  unittest.main()
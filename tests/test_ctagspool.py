@@ -0,0 +1,108 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ctagspool
+import tagcache
+
+FLAGS = ['--c-kinds=fp', '--fields=+ne', '--output-format=json']
+
+SOURCE = b'''#include <stdio.h>
+
+static int add(int a, int b)
+{
+  return a + b;
+}
+
+int main(void)
+{
+  printf("%d\\n", add(1, 2));
+  return 0;
+}
+'''
+
+
+def functions(tags):
+  return sorted((t['name'], t['line'], t['end']) for t in tags if t.get('kind') == 'function')
+
+
+@unittest.skipUnless(ctagspool.find_ctags(), 'ctags not available')
+class CtagsPoolTest(unittest.TestCase):
+
+  def test_generate_many(self):
+    pool = ctagspool.CtagsPool(FLAGS, size=2)
+    # Nothing is started before the first request
+    self.assertEqual((pool.workers, pool.interactive), ([], None))
+    files = [('file%d.c' % i, SOURCE) for i in range(10)]
+    results = pool.generate(files)
+    pool.close()
+
+    self.assertEqual(len(results), 10)
+    for tags in results:
+      self.assertEqual(functions(tags), [('add', 3, 6), ('main', 8, 12)])
+
+  def test_generate_from_threads(self):
+    pool = ctagspool.CtagsPool(FLAGS, size=2)
+    results = []
+    executors = set()
+
+    def generate():
+      results.extend(pool.generate([('a.c', SOURCE), ('b.c', SOURCE)]))
+      executors.add(id(pool.executor))
+
+    threads = [threading.Thread(target=generate) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    pool.close()
+
+    self.assertEqual([functions(tags) for tags in results], [[('add', 3, 6), ('main', 8, 12)]] * 16)
+    # All the threads share one executor
+    self.assertEqual(len(executors), 1)
+
+  def test_batch_matches_interactive(self):
+    pool = ctagspool.CtagsPool(FLAGS, size=1)
+    interactive = pool.generate([('a.c', SOURCE), ('b.c', b'')])
+    batch = pool.generate_batch([('a.c', SOURCE), ('b.c', b'')])
+    pool.close()
+
+    self.assertEqual([functions(t) for t in interactive], [functions(t) for t in batch])
+
+  def test_tagger_deduplicates_blobs(self):
+    pool = ctagspool.CtagsPool(FLAGS, size=1)
+    tagger = ctagspool.BlobTagger(pool)
+    blob = ctagspool.BlobData('e69de29bb2d1d6434b8b29ae775ad8c2e48c5391', SOURCE)
+    tagger.prefetch([('a.c', blob), ('b.c', blob)])
+    self.assertEqual(functions(tagger.tags('a.c', blob)), [('add', 3, 6), ('main', 8, 12)])
+    self.assertEqual(pool.calls, 1)
+    pool.close()
+
+
+class FailingCtagsTest(unittest.TestCase):
+
+  def test_failure_is_not_cached(self):
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cache_dir)
+    cache = tagcache.TagCache(cache_dir)
+    self.addCleanup(cache.close)
+    # false has no interactive mode and fails every batch
+    pool = ctagspool.CtagsPool(FLAGS, size=1, ctags=shutil.which('false'))
+    self.addCleanup(pool.close)
+    tagger = ctagspool.BlobTagger(pool, cache, 'flavour')
+    blob = ctagspool.BlobData('e69de29bb2d1d6434b8b29ae775ad8c2e48c5391', SOURCE)
+
+    with redirect_stderr(io.StringIO()):
+      self.assertIsNone(tagger.tags('a.c', blob))
+    self.assertFalse(pool.interactive)
+    self.assertIsNone(cache.get(blob.id, 'flavour'))
+
+
+if __name__ == '__main__':
+  unittest.main()
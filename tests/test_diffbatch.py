@@ -0,0 +1,83 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diffbatch
+from tests import repos
+
+OLD = b'int a(int x)\n{\n  return x;\n}\n'
+NEW = b'int a(int x)\n{\n  return x + 1;\n}\n'
+
+
+class BatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.repo_path = os.path.join(self.tmp.name, 'project.git')
+    self.repo = repos.RepoBuilder(self.repo_path)
+    for content in (OLD, NEW):
+      self.head = str(self.repo.commit({'f.c': content}))
+    self.output = os.path.join(self.tmp.name, 'out')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def manifest(self, *entries):
+    path = os.path.join(self.tmp.name, 'manifest.jsonl')
+    with open(path, 'w') as f:
+      f.write('# repositories\n\n')
+      f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    return path
+
+  def run_batch(self, *entries):
+    with redirect_stdout(io.StringIO()):
+      status = diffbatch.main([self.manifest(*entries), '-o', self.output, '--analyzer', 'cscan', '--no-cache',
+                               '--mirror-dir', os.path.join(self.tmp.name, 'mirrors')])
+    with open(os.path.join(self.output, diffbatch.SUMMARY_FILE)) as f:
+      return status, json.load(f)
+
+  def test_batch(self):
+    status, summary = self.run_batch({'repo': self.repo_path}, {'repo': self.repo_path, 'revision': 'missing'},
+                                     {'repo': self.repo_path, 'name': 'all', 'times': 2})
+    self.assertEqual(status, 1)
+    self.assertEqual([(r['name'], r['status'], r.get('commits')) for r in summary['results']],
+                     [('project', 'ok', 1), ('project-2', 'failed', None), ('all', 'ok', 2)])
+    self.assertEqual((summary['repositories'], summary['failed'], summary['commits']), (3, 1, 3))
+
+    with open(os.path.join(self.output, 'project.jsonl')) as f:
+      self.assertEqual([json.loads(line) for line in f],
+                       [{'commit': self.head, 'files': {'f.c': {'a': {'added': [3], 'removed': [3]}}}}])
+
+  def test_unreachable_remote(self):
+    # A remote that cannot be fetched fails its entry instead of asking for credentials
+    missing = 'file://' + os.path.join(self.tmp.name, 'missing.git')
+    with mock.patch('builtins.input', side_effect=AssertionError('credentials asked')):
+      status, summary = self.run_batch({'repo': missing}, {'repo': self.repo_path})
+    self.assertEqual(status, 1)
+    self.assertEqual([r['status'] for r in summary['results']], ['failed', 'ok'])
+    self.assertTrue(summary['results'][0]['error'].startswith('GitError: '), summary['results'][0]['error'])
+
+  def test_names(self):
+    path = self.manifest({'repo': '/src/zlib.git'}, {'repo': 'r', 'name': '../../etc/x'}, {'repo': 'r', 'name': '..'},
+                         {'repo': 'https://host/zlib/'})
+    self.assertEqual([entry['name'] for entry in diffbatch.read_manifest(path)],
+                     ['zlib', '.._.._etc_x', '_..', 'zlib-2'])
+
+  def test_manifest_errors(self):
+    for line in ('{"name": "x"}', '[1]', '{"repo": "r", "branch": "b"}', 'not json'):
+      path = os.path.join(self.tmp.name, 'bad.jsonl')
+      with open(path, 'w') as f:
+        f.write(line + '\n')
+      with self.assertRaises(diffbatch.ManifestError):
+        diffbatch.read_manifest(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,132 @@
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diffserver
+import mirrors
+from tests import repos
+
+OLD = b'int a(int x)\n{\n  return x;\n}\n'
+NEW = b'int a(int x)\n{\n  return x + 1;\n}\n'
+
+
+class UnixConnection(http.client.HTTPConnection):
+
+  def __init__(self, path):
+    super().__init__('localhost')
+    self.path = path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self.path)
+
+
+class ServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.repo_path = os.path.join(self.tmp.name, 'project.git')
+    self.repo = repos.RepoBuilder(self.repo_path)
+    for content in (OLD, NEW, OLD):
+      self.head = str(self.repo.commit({'f.c': content}))
+    self.analysis = diffserver.AnalysisServer([self.repo_path], analyzer='cscan')
+
+  def tearDown(self):
+    self.analysis.close()
+    self.tmp.cleanup()
+
+  def serve(self, **options):
+    server = diffserver.create_server(self.analysis, **options)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def stop():
+      server.shutdown()
+      server.server_close()
+      thread.join()
+    self.addCleanup(stop)
+    return server
+
+  def get(self, connection, path):
+    connection.request('GET', path)
+    response = connection.getresponse()
+    return response.status, response.read().decode('utf-8')
+
+  def test_tcp(self):
+    server = self.serve(port=0)
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    self.addCleanup(connection.close)
+
+    self.assertEqual(self.get(connection, '/changes?revision=HEAD'),
+                     (200, '# Commit: {}\nf.c,a,3\n'.format(self.head)))
+    status, text = self.get(connection, '/changes?revision=HEAD~2..HEAD&print_mode=jsonl&only_added=1')
+    self.assertEqual(status, 200)
+    self.assertEqual([json.loads(line)['files'] for line in text.splitlines()],
+                     [{'f.c': {'a': {'added': [3]}}}] * 2)
+
+    self.assertEqual(self.get(connection, '/changes?revision=missing')[0], 404)
+    self.assertEqual(self.get(connection, '/changes?revision=HEAD&print_mode=xml')[0], 400)
+    self.assertEqual(self.get(connection, '/changes')[0], 400)
+    self.assertEqual(self.get(connection, '/changes?revision=HEAD&path_filter=%5B')[0], 400)
+    self.assertEqual(self.get(connection, '/other')[0], 404)
+
+    status, text = self.get(connection, '/stats')
+    stats = json.loads(text)
+    self.assertEqual((stats['requests'], stats['commits']), (2, 3))
+    # Both versions of f.c were analysed once, then served from memory
+    self.assertEqual(stats['analysed_files'], 2)
+
+  def test_mirror_refresh(self):
+    url = 'file://' + self.repo_path
+    mirror_dir = os.path.join(self.tmp.name, 'mirrors')
+    analysis = diffserver.AnalysisServer([url], analyzer='cscan', fetch_interval=3600)
+    self.addCleanup(analysis.close)
+    # Local repositories are read in place: serve this one from a mirror as if it was remote
+    repository = analysis.repository(None)
+    repository.remote, repository.mirror_dir = True, mirror_dir
+    repository.repo = mirrors.open_mirror(url, mirror_dir)
+
+    def head():
+      return analysis.changes({'revision': 'HEAD'})[1].splitlines()[0]
+
+    new = str(self.repo.commit({'f.c': NEW}))
+    # Fetched less than fetch_interval ago
+    self.assertEqual(head(), '# Commit: ' + self.head)
+    # An unknown hash fetches the mirror
+    self.assertEqual(analysis.changes({'revision': new})[1], '# Commit: {}\nf.c,a,3\n'.format(new))
+    self.assertEqual(head(), '# Commit: ' + new)
+
+    newer = str(self.repo.commit({'f.c': OLD}))
+    repository.fetched -= 3600
+    self.assertEqual(head(), '# Commit: ' + newer)
+    self.repo.repo.references['refs/heads/master'].set_target(new)
+    repository.fetch_interval = 0
+    self.assertEqual(head(), '# Commit: ' + new)
+
+    # A branch with a hexadecimal name moves like any other
+    branch = self.repo.repo.branches.local.create('cafe', self.repo.repo[newer])
+    self.assertEqual(analysis.changes({'revision': 'cafe'})[1].splitlines()[0], '# Commit: ' + newer)
+    branch.set_target(new)
+    self.assertEqual(analysis.changes({'revision': 'cafe'})[1].splitlines()[0], '# Commit: ' + new)
+    self.assertFalse(analysis.is_commit_id(repository.repo, 'cafe'))
+    self.assertTrue(analysis.is_commit_id(repository.repo, new[:7] + '~1'))
+    self.assertFalse(analysis.is_commit_id(repository.repo, 'HEAD'))
+
+  def test_unix_socket(self):
+    path = os.path.join(self.tmp.name, 'server.sock')
+    self.serve(socket_path=path)
+    connection = UnixConnection(path)
+    self.addCleanup(connection.close)
+    self.assertEqual(self.get(connection, '/changes?revision=HEAD&times=2&print_mode=functions'),
+                     (200, 'f.c,a\nf.c,a\n'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,72 @@
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzers
+import ctagspool
+import diffanalyze
+
+OLD = b'''int a(int x)
+{
+  return x;
+}
+
+int b(int x)
+{
+  return x + 1;
+}
+'''
+
+NEW = b'''int a(int x)
+{
+  x++;
+  return x;
+}
+
+int b(int x)
+{
+  return x + 2;
+}
+'''
+
+
+class FileDifferencesTest(unittest.TestCase):
+
+  def setUp(self):
+    tagger = ctagspool.BlobTagger(analyzers.ScanPool())
+    self.diff = diffanalyze.FileDifferences('src/f.c', 'c0ffee', ctagspool.BlobData('1' * 40, OLD),
+                                            ctagspool.BlobData('2' * 40, NEW), tagger)
+    self.assertTrue(self.diff.match_lines_to_fn([3], []))
+    self.assertTrue(self.diff.match_lines_to_fn([9], [8]))
+    self.diff.release_fn_maps()
+
+  def test_changed_lines(self):
+    changed = self.diff.fn_to_changed_lines
+    self.assertEqual(list(changed), ['a', 'b'])
+    self.assertEqual(list(changed['a'].added_lines), [3])
+    self.assertEqual(list(changed['b'].added_lines), [9])
+    self.assertEqual(list(changed['b'].removed_lines), [8])
+    self.assertIsNone(self.diff.current_fn_index)
+
+  def test_json_does_not_alias_records(self):
+    summary = diffanalyze.DiffSummary()
+    summary.add_file_diff(self.diff)
+    self.assertEqual(summary.diff_for_json(), {'src/f.c': [3, 9]})
+    self.assertEqual(list(self.diff.fn_to_changed_lines['a'].added_lines), [3])
+
+  def test_pickle(self):
+    summary = diffanalyze.DiffSummary()
+    summary.add_file_diff(self.diff)
+    copy = pickle.loads(pickle.dumps(summary))
+    self.assertEqual(copy.updated_fn_count, 2)
+    self.assertEqual(list(copy.file_diffs[0].fn_to_changed_lines['b'].removed_lines), [8])
+
+  def test_prototype(self):
+    fn = diffanalyze.FnAttributes('a', 1, 3, '/^int a(int x) {$/')
+    self.assertEqual(fn.prototype, 'int a(int x)')
+
+
+if __name__ == '__main__':
+  unittest.main()
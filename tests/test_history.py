@@ -0,0 +1,65 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diffanalyze
+import outputsink
+from tests import repos
+
+A = b'int a(int x)\n{\n  return x;\n}\n'
+B = b'\nint b(int x)\n{\n  return x;\n}\n'
+
+
+class FunctionHistoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.repo_path = os.path.join(self.tmp.name, 'project.git')
+    self.repo = repos.RepoBuilder(self.repo_path)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def history(self, function, filename, incremental=False):
+    out = io.StringIO()
+    manager = diffanalyze.RepoManager(self.repo_path, 'jsonl', False, None, None, analyzer='cscan',
+                                      incremental=incremental, sink=outputsink.create_sink('jsonl', stream=out))
+    try:
+      analysed = manager.function_history(function, filename)
+      calls = manager.tagger.pool.calls
+    finally:
+      manager.cleanup()
+    return analysed, calls, [(line['commit'], line['files'][filename][function])
+                             for line in map(json.loads, out.getvalue().splitlines())]
+
+  def test_history(self):
+    self.repo.commit({'a.c': A})
+    introduced = str(self.repo.commit({'a.c': A + B}))
+    changed = str(self.repo.commit({'a.c': A + B.replace(b'return x;', b'return -x;')}))
+    # Other files and other functions of the file
+    self.repo.commit({'a.c': A.replace(b'return x;', b'return 0;') + B.replace(b'return x;', b'return -x;'),
+                      'other.c': A})
+    self.repo.commit({'a.c': A.replace(b'return x;', b'return 0;') + B.replace(b'return x;', b'return -x;'),
+                      'other.c': B})
+
+    for incremental in (False, True):
+      analysed, calls, history = self.history('b', 'a.c', incremental)
+      self.assertEqual(history, [(changed, {'added': [8], 'removed': [8]}),
+                                 (introduced, {'added': [6, 7, 8, 9], 'removed': []})])
+      # The walk stops at the introduction of b, before the initial commit
+      self.assertEqual(analysed, 3)
+      # Every version of a.c is parsed once, or partly derived from the next one
+      self.assertLessEqual(calls, 4)
+      self.assertEqual(calls == 4, not incremental)
+
+  def test_missing(self):
+    self.repo.commit({'a.c': A})
+    self.assertEqual(self.history('b', 'missing.c')[::2], (0, []))
+
+
+if __name__ == '__main__':
+  unittest.main()
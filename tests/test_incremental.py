@@ -0,0 +1,124 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+import pygit2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzers
+import ctagspool
+import cscan
+import incremental
+
+
+def function(name, body_lines):
+  return [b'static int ' + name + b'(int x)', b'{'] + [b'  x += %d;' % i for i in range(body_lines)] + \
+         [b'  return x;', b'}', b'']
+
+
+def source(rng, count):
+  lines = [b'#include <stdio.h>', b'', b'struct s { int a; };', b'']
+  for i in range(count):
+    lines += function(b'f%d' % i, rng.randint(0, 4))
+    if rng.random() < 0.3:
+      lines += [b'static int v%d = %d;' % (i, i), b'']
+  return lines
+
+
+def edit(rng, lines):
+  lines = list(lines)
+  for _ in range(rng.randint(1, 3)):
+    position = rng.randint(0, len(lines))
+    choice = rng.random()
+    if choice < 0.4:
+      lines.insert(position, b'  x -= 1;')
+    elif choice < 0.6 and position < len(lines):
+      del lines[position:position + rng.randint(1, 4)]
+    elif choice < 0.8:
+      lines[position:position] = function(b'g%d' % rng.randint(0, 1000), rng.randint(0, 3))
+    elif position < len(lines):
+      lines[position] = lines[position] + b' /* changed */'
+  return lines
+
+
+class IncrementalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.repo = pygit2.init_repository(self.tmp.name, bare=True)
+    self.pool = analyzers.ScanPool()
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def blob(self, data):
+    return self.repo[self.repo.create_blob(data)]
+
+  def hunks(self, old, new):
+    return incremental.hunks_from_patch(self.blob(old).diff(self.blob(new), context_lines=0))
+
+  def derive(self, old, new):
+    derivation = incremental.plan(cscan.scan(old), self.hunks(old, new), new)
+    if derivation is None:
+      return None
+    return derivation.finish(self.pool.generate([('f.c', fragment) for fragment in derivation.fragments]))
+
+  def test_random_edits(self):
+    rng = random.Random(1)
+    derived = 0
+    for _ in range(300):
+      old = source(rng, rng.randint(1, 12))
+      new = edit(rng, old)
+      old, new = b'\n'.join(old) + b'\n', b'\n'.join(new) + b'\n'
+      tags = self.derive(old, new)
+      if tags is not None:
+        derived += 1
+        self.assertEqual(tags, cscan.scan(new))
+    self.assertGreater(derived, 100)
+
+  def test_shift(self):
+    others = [line for name in (b'b', b'c', b'd', b'e') for line in function(name, 1)]
+    old = b'\n'.join(function(b'a', 1) + others) + b'\n'
+    new = b'\n'.join(function(b'a', 3) + others) + b'\n'
+    derivation = incremental.plan(cscan.scan(old), self.hunks(old, new), new)
+    # Only `a` is analysed again, the other functions move down by two lines
+    self.assertEqual(derivation.regions, [(1, 8)])
+    self.assertEqual([tag['line'] for tag in derivation.tags], [9, 15, 21, 27])
+    self.assertEqual(derivation.finish(self.pool.generate([('f.c', derivation.fragments[0])])), cscan.scan(new))
+
+  def test_unsafe_hunks(self):
+    old = b'\n'.join(function(b'a', 1) + function(b'b', 1)) + b'\n'
+    for line in (b'#define X 1', b'/* open', b'int y = 1; \\'):
+      new = old.replace(b'  return x;', line, 1)
+      self.assertIsNone(incremental.plan(cscan.scan(old), self.hunks(old, new), new))
+
+  def test_unbalanced_region(self):
+    old = b'\n'.join(function(b'a', 1) + function(b'b', 1)) + b'\n'
+    new = old.replace(b'}\n\nstatic int b', b'}\n}\nstatic int b')
+    self.assertIsNone(incremental.plan(cscan.scan(old), self.hunks(old, new), new))
+
+  def test_blob_tagger(self):
+    old = b'\n'.join(function(b'a', 1) + function(b'b', 1) + function(b'c', 1)) + b'\n'
+    new = old.replace(b'static int b(int x)\n{\n  x += 0;', b'static int b2(int x)\n{\n  x += 5;')
+    old_blob, new_blob = self.blob(old), self.blob(new)
+    tagger = ctagspool.BlobTagger(self.pool, incremental=True)
+    tagger.prefetch([('f.c', old_blob)])
+    tagger.forget()
+
+    tagger.register_base(new_blob.id, old_blob.id, self.hunks(old, new))
+    tagger.prefetch([('f.c', new_blob)])
+    self.assertEqual(tagger.tags('f.c', new_blob), cscan.scan(new))
+    # The old version and the fragment around `b2`
+    self.assertEqual(self.pool.calls, 2)
+
+  def test_blob_tagger_without_base(self):
+    new_blob = self.blob(b'\n'.join(function(b'a', 1)) + b'\n')
+    tagger = ctagspool.BlobTagger(self.pool, incremental=True)
+    tagger.register_base(new_blob.id, '0' * 40, [(1, 1, 1, 1, b'  x += 0;\n')])
+    self.assertEqual(tagger.tags('f.c', new_blob), cscan.scan(new_blob.data))
+
+
+if __name__ == '__main__':
+  unittest.main()
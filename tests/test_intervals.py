@@ -0,0 +1,69 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import intervals
+
+
+class IntervalIndexTest(unittest.TestCase):
+
+  def test_overlapping_matches_pairwise_comparison(self):
+    rnd = random.Random(42)
+    for _ in range(50):
+      spans = []
+      for _ in range(rnd.randint(0, 40)):
+        start = rnd.randint(1, 500)
+        spans.append((start, start + rnd.randint(0, 60)))
+      index = intervals.IntervalIndex(spans)
+
+      for _ in range(50):
+        lo = rnd.randint(0, 560)
+        hi = lo + rnd.randint(0, 10)
+        expected = [i for i, (start, end) in enumerate(spans) if start <= hi and lo <= end]
+        self.assertEqual(index.overlapping(lo, hi), expected)
+
+  def test_empty(self):
+    index = intervals.IntervalIndex([])
+    self.assertEqual(index.containing(3), [])
+
+
+class FunctionIndexTest(unittest.TestCase):
+
+  @staticmethod
+  def pairwise(functions, lines):
+    # Reference implementation: every definition against every line
+    result = {}
+    for name in dict.fromkeys(name for name, _, _ in functions):
+      matched = []
+      for fn_name, start, end in functions:
+        if fn_name == name:
+          matched.extend(line for line in lines if start <= line <= end)
+      if matched:
+        result[name] = matched
+    return result
+
+  def test_assign_matches_pairwise_comparison(self):
+    rnd = random.Random(7)
+    for _ in range(50):
+      functions = []
+      line = 1
+      for i in range(rnd.randint(0, 30)):
+        line += rnd.randint(0, 5)
+        end = line + rnd.randint(0, 20)
+        # duplicated names, e.g. alternative definitions under #ifdef
+        functions.append(('fn%d' % rnd.randint(0, 10), line, end))
+        line = end + 1
+      lines = sorted(rnd.sample(range(1, line + 5), min(20, line + 4)))
+
+      result = intervals.FunctionIndex(functions).assign(lines)
+      self.assertEqual(result, self.pairwise(functions, lines))
+
+  def test_overlapping_definitions(self):
+    index = intervals.FunctionIndex([('a', 1, 10), ('b', 3, 5), ('a', 4, 8)])
+    self.assertEqual(index.assign([4, 9]), {'a': [4, 9, 4], 'b': [4]})
+
+
+if __name__ == '__main__':
+  unittest.main()
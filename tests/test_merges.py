@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import diffanalyze2
+from tests import repos
+
+BASE = b'int a(int x)\n{\n  return x;\n}\n\nint b(int x)\n{\n  return x;\n}\n'
+# Each branch changes one function, the merge also changes a line of `a` that neither branch has
+LEFT = b'int a(int x)\n{\n  return x + 1;\n}\n\nint b(int x)\n{\n  return x;\n}\n'
+RIGHT = b'int a(int x)\n{\n  return x;\n}\n\nint b(int x)\n{\n  return x + 2;\n}\n'
+MERGED = b'int a(int x)\n{\n  return x + 3;\n}\n\nint b(int x)\n{\n  return x + 2;\n}\n'
+
+
+class MergePolicyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    builder = repos.RepoBuilder(self.tmp.name)
+    self.repo = builder.repo
+    base = builder.commit({'f.c': BASE}, ref=None)
+    left = builder.commit({'f.c': LEFT}, [base], ref=None)
+    right = builder.commit({'f.c': RIGHT}, [base], ref=None)
+    self.merge = self.repo[builder.commit({'f.c': MERGED}, [left, right], ref=None)]
+    self.fa = diffanalyze2.FileAnalyzer(analyzer='cscan')
+
+  def tearDown(self):
+    self.fa.close()
+    self.tmp.cleanup()
+
+  def change(self, merges):
+    return diffanalyze2.generate_commit_change(self.fa, self.repo, self.merge, merges)
+
+  def test_all_parents(self):
+    # `a` differs from both parents
+    self.assertEqual(self.change('all'), {'f.c': {'a': [(3, 4), (3, 4)], 'b': [(8, 9)]}})
+
+  def test_first_parent(self):
+    self.assertEqual(self.change('first-parent'), {'f.c': {'a': [(3, 4)], 'b': [(8, 9)]}})
+
+  def test_combined(self):
+    self.assertEqual(self.change('combined'), {'f.c': {'a': [(3, 4)]}})
+
+  def test_combine_patch_summaries(self):
+    summaries = [
+      [{'new_file': 'f.c', 'changes': [{'add': 3, 'remove': -1, 'nr': 1, 'origin': '+'},
+                                       {'add': 8, 'remove': -1, 'nr': 1, 'origin': '+'}]},
+       {'new_file': 'g.c', 'changes': [{'add': 1, 'remove': -1, 'nr': 1, 'origin': '+'}]}],
+      [{'new_file': 'f.c', 'changes': [{'add': -1, 'remove': 3, 'nr': 1, 'origin': '-'},
+                                       {'add': 3, 'remove': -1, 'nr': 1, 'origin': '+'}]}],
+    ]
+    self.assertEqual(diffanalyze2.combine_patch_summaries(summaries),
+                     [{'new_file': 'f.c', 'changes': [{'add': 3, 'remove': -1, 'nr': 1, 'origin': '+'}]}])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import pygit2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mirrors
+from tests import repos
+
+
+class MirrorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.upstream = repos.RepoBuilder(os.path.join(self.tmp.name, 'upstream'))
+    self.url = 'file://' + self.upstream.path
+    self.mirror_dir = os.path.join(self.tmp.name, 'mirrors')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_clone_then_fetch(self):
+    first = self.upstream.commit({'f.c': b'int a;\n'})
+    self.upstream.commit({'f.c': b'int t;\n'}, [first], ref='refs/heads/topic')
+    mirror = mirrors.open_mirror(self.url, self.mirror_dir)
+    self.assertEqual(mirror.path.rstrip('/'), mirrors.mirror_path(self.url, self.mirror_dir))
+    self.assertTrue(mirror.is_bare)
+    self.assertEqual(mirror.head.target, first)
+    self.assertIn('refs/heads/topic', mirror.references)
+    marker = os.path.join(mirror.path, 'marker')
+    open(marker, 'w').close()
+
+    second = self.upstream.commit({'f.c': b'int b;\n'}, [first])
+    self.upstream.repo.references.delete('refs/heads/topic')
+    mirror = mirrors.open_mirror(self.url, self.mirror_dir)
+    # Updated in place, not cloned again
+    self.assertTrue(os.path.exists(marker))
+    self.assertEqual(mirror.head.target, second)
+    self.assertNotIn('refs/heads/topic', mirror.references)
+
+  def test_local_repository_in_place(self):
+    for url in (self.upstream.path, self.url):
+      self.assertEqual(mirrors.local_path(url), self.upstream.path)
+      repo = mirrors.open_repository(url, self.mirror_dir)
+      self.assertEqual(repo.path.rstrip('/'), self.upstream.path)
+    self.assertFalse(os.path.exists(self.mirror_dir))
+    self.assertIsNone(mirrors.local_path('https://host/project.git'))
+
+  def test_path_depends_on_url(self):
+    self.assertNotEqual(mirrors.mirror_path('https://a/x.git', 'm'), mirrors.mirror_path('https://a/y.git', 'm'))
+    self.assertEqual(mirrors.mirror_path('https://a/x.git/', 'm'), mirrors.mirror_path('https://a/x.git', 'm'))
+
+  def test_failed_clone_leaves_nothing(self):
+    with self.assertRaises(pygit2.GitError):
+      mirrors.open_mirror('file://' + os.path.join(self.tmp.name, 'missing'), self.mirror_dir)
+    self.assertEqual([name for name in os.listdir(self.mirror_dir) if not name.endswith('.lock')], [])
+
+
+if __name__ == '__main__':
+  unittest.main()
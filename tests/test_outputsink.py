@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analyzers
+import ctagspool
+import diffanalyze
+import outputsink
+
+OLD = b'''int a(int x)
+{
+  return x;
+}
+
+int b(int x)
+{
+  return x + 1;
+}
+'''
+
+NEW = b'''int a(int x)
+{
+  x++;
+  return x;
+}
+
+int b(int x)
+{
+  return x + 2;
+}
+'''
+
+
+def summary(commit='c0ffee', filename='src/f.c'):
+  tagger = ctagspool.BlobTagger(analyzers.ScanPool())
+  diff = diffanalyze.FileDifferences(filename, commit, ctagspool.BlobData('1' * 40, OLD),
+                                     ctagspool.BlobData('2' * 40, NEW), tagger)
+  diff.match_lines_to_fn([3], [])
+  diff.match_lines_to_fn([9], [8])
+  diff.release_fn_maps()
+  result = diffanalyze.DiffSummary(commit)
+  result.add_file_diff(diff)
+  return result
+
+
+class OutputSinkTest(unittest.TestCase):
+
+  def render(self, mode, *summaries, **options):
+    out = io.StringIO()
+    sink = outputsink.create_sink(mode, stream=out, **options)
+    for diff_summary in summaries:
+      sink.write(diff_summary)
+    sink.close()
+    return out.getvalue()
+
+  def test_full(self):
+    self.assertEqual(self.render('full', summary()),
+                     'src/f.c: In function a\n'
+                     'Patch c0ffee has added lines (new line indices): [3]\n'
+                     'src/f.c: In function b\n'
+                     'Patch c0ffee has added lines (new line indices): [9]\n'
+                     'Patch c0ffee has added lines (rem line indices): [8]\n')
+
+  def test_full_verbose(self):
+    self.assertEqual(self.render('full', diffanalyze.DiffSummary('c0ffee'), verbose=True),
+                     'No relevant changes detected.\n\n')
+
+  def test_simple(self):
+    self.assertEqual(self.render('simple', summary()),
+                     '# Commit: c0ffee\nsrc/f.c,a,3\nsrc/f.c,b,8\nsrc/f.c,b,9\n')
+    self.assertEqual(self.render('simple', summary(), only_added=True),
+                     '# Commit: c0ffee\nsrc/f.c,a,3\nsrc/f.c,b,9\n')
+
+  def test_simple_keeps_lines(self):
+    diff_summary = summary()
+    self.render('simple', diff_summary)
+    self.assertEqual(list(diff_summary.file_diffs[0].fn_to_changed_lines['b'].added_lines), [9])
+
+  def test_functions(self):
+    self.assertEqual(self.render('functions', summary()), 'src/f.c,a\nsrc/f.c,b\n')
+    self.assertEqual(self.render('functions', summary(), with_hash=True), 'src/f.c,a,c0ffee\nsrc/f.c,b,c0ffee\n')
+
+  def test_only_fn_dedup(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'updated_functions')
+      out = io.StringIO()
+      sink = outputsink.OnlyFnSink(stream=out, functions_file=path)
+      sink.write(summary('c0ffee'))
+      sink.write(summary('bada55'))
+      sink.close()
+      self.assertEqual(out.getvalue(), 'a\nb\n')
+      with open(path) as f:
+        self.assertEqual(f.read(), 'a\nb\na\nb\n')
+
+  def test_csv(self):
+    self.assertEqual(self.render('csv', summary(), summary('bada55'), only_added=True),
+                     'commit,file,function,change,line\n'
+                     'c0ffee,src/f.c,a,added,3\nc0ffee,src/f.c,b,added,9\n'
+                     'bada55,src/f.c,a,added,3\nbada55,src/f.c,b,added,9\n')
+
+  def test_jsonl(self):
+    lines = self.render('jsonl', summary(), diffanalyze.DiffSummary('bada55')).splitlines()
+    self.assertEqual([json.loads(line) for line in lines], [
+      {'commit': 'c0ffee', 'files': {'src/f.c': {'a': {'added': [3], 'removed': []},
+                                                 'b': {'added': [9], 'removed': [8]}}}},
+      {'commit': 'bada55', 'files': {}},
+    ])
+
+  def test_colour_disabled_for_files(self):
+    self.assertFalse(outputsink.OutputSink(stream=io.StringIO()).colour)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import profiling
+
+
+class ProfilerTest(unittest.TestCase):
+
+  def test_stages(self):
+    profiler = profiling.Profiler()
+    with profiler.stage('diff'):
+      pass
+    with profiler.stage('diff', 10):
+      pass
+    profiler.add('analyse', 0.5, 2, 100)
+    stages = profiler.report()['stages']
+    self.assertEqual(stages['diff']['calls'], 2)
+    self.assertEqual(stages['diff']['bytes'], 10)
+    self.assertEqual(stages['analyse'], {'seconds': 0.5, 'calls': 2, 'bytes': 100})
+    # Slowest stage first
+    self.assertEqual(list(stages)[0], 'analyse')
+
+  def test_iterate(self):
+    profiler = profiling.Profiler()
+    self.assertEqual(list(profiler.iterate('walk', range(3))), [0, 1, 2])
+    self.assertEqual(profiler.report()['stages']['walk']['calls'], 3)
+
+  def test_slowest(self):
+    profiler = profiling.Profiler(top=2)
+    for i, seconds in enumerate([0.1, 0.5, 0.3, 0.2]):
+      profiler.record('commits', seconds, commit=str(i))
+    report = profiler.report()
+    self.assertEqual([c['commit'] for c in report['slowest_commits']], ['1', '2'])
+    self.assertEqual(report['slowest_commits'][0]['seconds'], 0.5)
+    self.assertEqual(report['slowest_files'], [])
+
+  def test_merge(self):
+    worker = profiling.Profiler(top=2)
+    worker.add('analyse', 1.0, 1, 10)
+    worker.record('files', 1.0, file='a.c')
+    snapshot = worker.snapshot()
+    self.assertEqual(worker.report()['stages'], {})
+
+    profiler = profiling.Profiler(top=2)
+    profiler.add('analyse', 0.5, 1, 5)
+    profiler.record('files', 0.1, file='b.c')
+    profiler.merge(json.loads(json.dumps(snapshot)))
+    report = profiler.report()
+    self.assertEqual(report['stages']['analyse'], {'seconds': 1.5, 'calls': 2, 'bytes': 15})
+    self.assertEqual([f['file'] for f in report['slowest_files']], ['a.c', 'b.c'])
+
+  def test_write(self):
+    profiler = profiling.Profiler()
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'profile.json')
+      profiler.write(path)
+      with open(path) as f:
+        report = json.load(f)
+    self.assertGreater(report['peak_rss_kb'], 0)
+    self.assertIn('wall_seconds', report)
+
+  def test_null_profiler(self):
+    profiler = profiling.NULL
+    with profiler.stage('diff'):
+      pass
+    self.assertEqual(list(profiler.iterate('walk', [1, 2])), [1, 2])
+    self.assertIsNone(profiler.snapshot())
+    self.assertFalse(profiler.enabled)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import statstore
+
+
+def sample():
+  stats = statstore.CommitStats()
+  stats.append('a' * 40, 100, 3, 10, 2, extensions=['.h'], initial=True)
+  stats.append('b' * 40, 200, 1, 1, 0, extensions=['.h', 'none'])
+  stats.append('c' * 40, 300, 1, 0, 4)
+  return stats
+
+
+class CommitStatsTest(unittest.TestCase):
+
+  def test_histograms(self):
+    stats = sample()
+    self.assertEqual(list(stats.functions_histogram().items()), [(1, 2), (3, 1)])
+    self.assertEqual(list(stats.functions_histogram(skip_initial=True).items()), [(1, 2)])
+    self.assertEqual(list(stats.extension_counts().items()), [('.h', 2), ('none', 1)])
+    self.assertEqual(stats.commits_by_functions(), {3: ['a' * 40], 1: ['b' * 40, 'c' * 40]})
+    self.assertEqual(stats.commits_by_extension(), {'.h': {'a' * 40, 'b' * 40}, 'none': {'b' * 40}})
+
+  def test_save_load(self):
+    stats = sample()
+    with tempfile.TemporaryDirectory() as tmp:
+      stats.save(tmp, repo='r')
+      loaded, meta = statstore.CommitStats.load(tmp)
+      self.assertEqual(meta['repo'], 'r')
+      self.assertEqual(meta['commits'], 3)
+      self.assertEqual(loaded.state(), stats.state())
+      descr, shape, data = statstore.read_npy(os.path.join(tmp, 'time.npy'))
+      self.assertEqual((descr, shape, len(data)), ('<i8', (3,), 24))
+      with open(os.path.join(tmp, 'time.npy'), 'rb') as f:
+        self.assertEqual(f.read().index(data) % 64, 0)
+
+  def test_many_extensions(self):
+    stats = statstore.CommitStats()
+    stats.append('a' * 40, 1, 0, 0, 0, extensions=['.x{}'.format(i) for i in range(70)])
+    stats.append('b' * 40, 2, 0, 0, 0, extensions=['.x69'])
+    with tempfile.TemporaryDirectory() as tmp:
+      stats.save(tmp)
+      self.assertEqual(statstore.read_npy(os.path.join(tmp, 'extensions.npy'))[1], (2, 2))
+      loaded, _ = statstore.CommitStats.load(tmp)
+    self.assertEqual(loaded.extension_counts()['.x69'], 2)
+    self.assertEqual(loaded.extension_counts()['.x0'], 1)
+
+  def test_state(self):
+    stats = sample()
+    self.assertEqual(statstore.CommitStats.from_state(stats.state()).state(), stats.state())
+
+  def test_missing(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      self.assertRaises(statstore.StatsError, statstore.CommitStats.load, tmp)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import synthrepo
+
+
+class SyntheticRepositoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def create(self, name, **shape):
+    return synthrepo.create_repository(os.path.join(self.tmp.name, name), **shape)
+
+  def test_shape(self):
+    repo = self.create('a', commits=30, files=5, functions=4, merge_density=0.3)
+    commits = list(repo.walk(repo.head.target))
+    self.assertEqual(len(commits), 30)
+    self.assertTrue(any(len(c.parents) == 2 for c in commits))
+
+    root = commits[-1]
+    self.assertEqual(len(root.parents), 0)
+    sources = [e.name for e in root.tree / 'src']
+    self.assertEqual(len(sources), 5)
+    content = repo[(root.tree / 'src' / 'file_0.c').id].data
+    self.assertEqual(content.count(b'(int x)\n{'), 4)
+
+  def test_deterministic(self):
+    first = self.create('a', commits=20, files=4, merge_density=0.2, seed=3)
+    second = self.create('b', commits=20, files=4, merge_density=0.2, seed=3)
+    third = self.create('c', commits=20, files=4, merge_density=0.2, seed=4)
+    self.assertEqual(first.head.target, second.head.target)
+    self.assertNotEqual(first.head.target, third.head.target)
+
+  def test_no_merges(self):
+    repo = self.create('a', commits=15, files=3, merge_density=0)
+    self.assertTrue(all(len(c.parents) <= 1 for c in repo.walk(repo.head.target)))
+
+
+if __name__ == '__main__':
+  unittest.main()
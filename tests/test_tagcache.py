@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tagcache
+
+BLOB = 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+OTHER_BLOB = '8ab686eafeb1f44702738c8b0f24f2567c36da6d'
+
+
+class TagCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.tags = [{'_type': 'tag', 'name': 'main', 'kind': 'function', 'line': 3, 'end': 9,
+                  'pattern': '/^int main(void)$/', 'path': '/tmp/x.c'}]
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_miss_then_hit(self):
+    cache = tagcache.TagCache(self.cache_dir)
+    self.assertIsNone(cache.get(BLOB, 'f'))
+    cache.put(BLOB, 'f', self.tags)
+    self.assertEqual(cache.get(BLOB, 'f'),
+                     [{'name': 'main', 'kind': 'function', 'line': 3, 'end': 9, 'pattern': '/^int main(void)$/'}])
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+    cache.close()
+
+  def test_flavour_is_part_of_the_key(self):
+    cache = tagcache.TagCache(self.cache_dir)
+    cache.put(BLOB, tagcache.flavour('ctags 1', '--fields=+ne'), self.tags)
+    self.assertIsNone(cache.get(BLOB, tagcache.flavour('ctags 2', '--fields=+ne')))
+    cache.close()
+
+  def test_persistent(self):
+    cache = tagcache.TagCache(self.cache_dir)
+    cache.put(BLOB, 'f', self.tags)
+    cache.close()
+
+    cache = tagcache.TagCache(self.cache_dir)
+    self.assertIsNotNone(cache.get(BLOB, 'f'))
+    self.assertGreater(cache.size, 0)
+    cache.close()
+
+  def test_lru_eviction(self):
+    cache = tagcache.TagCache(self.cache_dir)
+    cache.clock = lambda: 0
+    cache.put(BLOB, 'f', self.tags)
+    cache.max_size = cache.size * 2 - 1
+    cache.clock = lambda: tagcache.TOUCH_INTERVAL
+    cache.get(BLOB, 'f')
+    cache.clock = lambda: 2 * tagcache.TOUCH_INTERVAL
+    cache.put(OTHER_BLOB, 'f', self.tags)
+    cache.put(OTHER_BLOB, 'g', self.tags)
+
+    # The oldest entry not used since is dropped first
+    self.assertIsNotNone(cache.get(OTHER_BLOB, 'g'))
+    self.assertIsNone(cache.get(BLOB, 'f'))
+    self.assertLessEqual(cache.size, cache.max_size)
+    cache.close()
+
+  def test_access_time_granularity(self):
+    cache = tagcache.TagCache(self.cache_dir)
+    cache.clock = lambda: 0
+    cache.put(BLOB, 'f', self.tags)
+    used = 'SELECT used FROM tags'
+    # Reads within TOUCH_INTERVAL of the last update do not write
+    cache.clock = lambda: tagcache.TOUCH_INTERVAL - 1
+    cache.get(BLOB, 'f')
+    self.assertEqual(cache.db.execute(used).fetchone(), (0,))
+    cache.clock = lambda: tagcache.TOUCH_INTERVAL
+    cache.get(BLOB, 'f')
+    self.assertEqual(cache.db.execute(used).fetchone(), (tagcache.TOUCH_INTERVAL,))
+    cache.close()
+
+  def test_shared_size_bound(self):
+    caches = [tagcache.TagCache(self.cache_dir) for _ in range(2)]
+    caches[0].put(BLOB, 'size', self.tags)
+    entry_size = caches[0].size
+    for cache in caches:
+      cache.max_size = entry_size * 5
+    # Every cache sees the entries of the other one and keeps the total under the bound
+    for i in range(20):
+      caches[i % 2].put(BLOB, str(i), self.tags)
+      self.assertLessEqual(caches[0].size, entry_size * 5)
+    self.assertEqual(caches[0].size, caches[1].size)
+    self.assertEqual(caches[0].size, caches[0].db.execute('SELECT SUM(size) FROM tags').fetchone()[0])
+    for cache in caches:
+      cache.close()
+
+if __name__ == '__main__':
+  unittest.main()